@@ -0,0 +1,56 @@
+import os
+import json
+import threading
+import tempfile
+
+# --- Versioned Analysis Cache ---
+# Holds derived results (metrics, rendered chat context) against the data
+# version they were computed from. Only the latest version of each entry is
+# kept, in memory and on disk, so the cache survives restarts and anything
+# computed from older data is simply never returned.
+
+class VersionedCache:
+    """In-memory plus on-disk cache of the latest value per name and version."""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self._memory = {}
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.cache_dir, f"{name}.json")
+
+    def get(self, name, version):
+        """Returns the cached value for name at this version, or None."""
+        with self._lock:
+            entry = self._memory.get(name)
+        if entry and entry[0] == version:
+            return entry[1]
+
+        try:
+            with open(self._path(name), 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        if stored.get('version') != version:
+            return None
+
+        with self._lock:
+            self._memory[name] = (version, stored['value'])
+        return stored['value']
+
+    def put(self, name, version, value):
+        """Stores value as the latest entry for name."""
+        with self._lock:
+            self._memory[name] = (version, value)
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=f".{name}.", suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'version': version, 'value': value}, f, ensure_ascii=False)
+            os.replace(tmp_path, self._path(name))
+        except OSError as e:
+            print(f"--- ❌ Could not persist cached '{name}': {e} ---")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
@@ -3,18 +3,117 @@ import json
 import hashlib
 import io
 import re
+import time
 from datetime import datetime, timedelta
 from collections import defaultdict
-import google.generativeai as genai
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 from dotenv import load_dotenv
-import PyPDF2
+import threading
+import gzip
+from concurrent.futures import ThreadPoolExecutor
+from financial_aggregates import aggregate_metrics, build_aggregates, ordered_summaries, summary_version
+from categorization import configure_categorizer
+from storage import create_storage
+from partitions import DEFAULT_USER_ID, PartitionRegistry, account_of
+from extraction_cache import ExtractionCache
+from pdf_text import count_pages, extract_page_texts
+from attijariwafa_parser import StatementParseError, parse_statement
+from chunked_extraction import chunk_instructions, plan_chunks, stitch_extractions
+from llm_backends import RecordingNotFoundError, create_llm_backend
+from instrumentation import configure_instrumentation, get_instrumentation, increment, span, timed
+from jobs import QueueFullError, UploadJobQueue
+from transaction_index import TransactionIndex
+from chat_retrieval import TransactionSearchIndex, build_retrieval_context
+from merge_index import MergeIndex, transaction_fingerprint
+
+try:
+    import brotli  # Optional: enables 'br' response compression
+except ImportError:
+    brotli = None
 
 # --- Configuration ---
 load_dotenv()
 # REMOVED: API_KEY = os.getenv("GEMINI_API_KEY") - This will now be passed per request.
 OUTPUT_JSON_PATH = "bank_statements_data.json"
+AGGREGATES_JSON_PATH = "bank_statements_aggregates.json"
+# Statements, metrics and caches are partitioned per user and account number. The user is the
+# X-User-ID header: a namespace picked by the client, not an identity, so any client can read or
+# write any user's statements. Set PARTITION_USER_FROM_API_KEY=true to bind users to the caller's
+# X-Gemini-API-Key instead (then required on every data endpoint; X-User-ID becomes a sub-namespace).
+PARTITION_USER_FROM_API_KEY = os.getenv("PARTITION_USER_FROM_API_KEY", "false").lower() == "true"
+PARTITIONS_DIR = os.getenv("PARTITIONS_DIR", "partitions")
+# Partitions kept open in memory; the least recently used are closed first.
+PARTITION_CACHE_SIZE = int(os.getenv("PARTITION_CACHE_SIZE", 256))
+# Backend of every partition: 'sqlite' (default), 'json' or 'log'. The single store used before
+# partitioning (the paths below) is split once into the default user's account partitions.
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite")
+SQLITE_DB_PATH = os.getenv("SQLITE_DB_PATH", "bank_statements.db")
+# 'log' backend: snapshot plus append-only segments, compacted in the background.
+LOG_STORAGE_DIR = os.getenv("LOG_STORAGE_DIR", "statement_log")
+LOG_SEGMENT_MAX_BYTES = int(os.getenv("LOG_SEGMENT_MAX_BYTES", 8 * 1024 * 1024))
+LOG_COMPACT_THRESHOLD_BYTES = int(os.getenv("LOG_COMPACT_THRESHOLD_BYTES", 32 * 1024 * 1024))
+
+GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL_NAME", "gemini-1.5-flash-latest")
+# 'gemini' (default), 'record' (Gemini, saving every response under LLM_RECORDINGS_DIR),
+# 'replay' (recorded responses only, no network) or 'mock' (synthetic responses, for load tests).
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+LLM_RECORDINGS_DIR = os.getenv("LLM_RECORDINGS_DIR", "llm_recordings")
+# 'mock' backend: delay per call (plus random jitter) and transactions per synthetic document.
+MOCK_LLM_LATENCY_MS = int(os.getenv("MOCK_LLM_LATENCY_MS", 500))
+MOCK_LLM_JITTER_MS = int(os.getenv("MOCK_LLM_JITTER_MS", 0))
+MOCK_LLM_TRANSACTIONS = int(os.getenv("MOCK_LLM_TRANSACTIONS", 20))
+# Model clients are kept per API key (by hash) and reused across requests.
+MODEL_CLIENT_POOL_SIZE = int(os.getenv("MODEL_CLIENT_POOL_SIZE", 64))
+MODEL_CLIENT_TTL_SECONDS = int(os.getenv("MODEL_CLIENT_TTL_SECONDS", 3600))
+# Bump whenever the extraction prompts change so cached extractions are not reused.
+EXTRACTION_PROMPT_VERSION = "1"
+EXTRACTION_CACHE_PATH = os.getenv("EXTRACTION_CACHE_PATH", "extraction_cache.db")
+EXTRACTION_CACHE_MAX_BYTES = int(os.getenv("EXTRACTION_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+EXTRACTION_CACHE_MAX_AGE_DAYS = int(os.getenv("EXTRACTION_CACHE_MAX_AGE_DAYS", 90))
+# Worker processes for per-page PDF text extraction; smaller PDFs are parsed in-process.
+PDF_TEXT_WORKERS = int(os.getenv("PDF_TEXT_WORKERS", min(4, os.cpu_count() or 1)))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", 8))
+# Parse well-structured Attijariwafa statements locally, calling the model only when
+# the parsed transactions do not reconcile with the printed balances.
+LOCAL_PARSER_ENABLED = os.getenv("LOCAL_PARSER_ENABLED", "true").lower() == "true"
+# Pages read to classify a PDF (and pick its prompt) before any model call.
+CLASSIFICATION_PAGES = int(os.getenv("CLASSIFICATION_PAGES", 2))
+# Long PDFs are extracted from their text in concurrent page-range chunks instead of one
+# direct call; each chunk repeats the tail of the previous one to catch split transactions.
+CHUNKED_EXTRACTION_MIN_PAGES = int(os.getenv("CHUNKED_EXTRACTION_MIN_PAGES", 8))
+EXTRACTION_CHUNK_PAGES = int(os.getenv("EXTRACTION_CHUNK_PAGES", 4))
+EXTRACTION_CHUNK_OVERLAP_CHARS = int(os.getenv("EXTRACTION_CHUNK_OVERLAP_CHARS", 1500))
+EXTRACTION_CHUNK_WORKERS = int(os.getenv("EXTRACTION_CHUNK_WORKERS", 4))
+# Upper bound on PDFs analyzed in parallel by the batch upload endpoint.
+UPLOAD_BATCH_MAX_WORKERS = int(os.getenv("UPLOAD_BATCH_MAX_WORKERS", 4))
+# Background workers and maximum queued/running jobs for async uploads.
+UPLOAD_JOBS_DB_PATH = os.getenv("UPLOAD_JOBS_DB_PATH", "upload_jobs.db")
+UPLOAD_JOB_WORKERS = int(os.getenv("UPLOAD_JOB_WORKERS", 2))
+UPLOAD_JOB_MAX_QUEUE = int(os.getenv("UPLOAD_JOB_MAX_QUEUE", 50))
+# Finished upload jobs are deleted from the job table after this many seconds (default: 7 days).
+UPLOAD_JOB_RETENTION_SECONDS = int(os.getenv("UPLOAD_JOB_RETENTION_SECONDS", 7 * 24 * 3600))
+# Metrics and chat context are cached per data version, in memory and in each partition's directory.
+# Bump whenever the metrics or context output changes so cached copies are not reused.
+ANALYSIS_CACHE_VERSION = "3"
+# Chat prompts carry only the context sections and transactions relevant to the question,
+# within this many (estimated) tokens. Set CHAT_RETRIEVAL_ENABLED=false to send the full context.
+CHAT_RETRIEVAL_ENABLED = os.getenv("CHAT_RETRIEVAL_ENABLED", "true").lower() == "true"
+CHAT_CONTEXT_TOKEN_BUDGET = int(os.getenv("CHAT_CONTEXT_TOKEN_BUDGET", 1200))
+CHAT_RETRIEVAL_MAX_TRANSACTIONS = int(os.getenv("CHAT_RETRIEVAL_MAX_TRANSACTIONS", 25))
+# Optional JSON rule table with user-defined expense categories (see categorization.py).
+CATEGORY_RULES_PATH = os.getenv("CATEGORY_RULES_PATH", "category_rules.json")
+# Per-stage latency histograms and counters on /metrics; optionally one JSON log line per stage.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_LOG_SPANS = os.getenv("METRICS_LOG_SPANS", "false").lower() == "true"
+# Responses smaller than this are sent uncompressed.
+COMPRESSION_MIN_BYTES = 1024
+
+# Shared state, created by create_app() (see Startup at the end of this file)
+extraction_cache = None
+llm_backend = None
+partitions = None
+upload_jobs = None
 
 # --- Flask App Initialization ---
 app = Flask(__name__)
@@ -22,282 +121,36 @@ CORS(app)
 
 # --- Enhanced Financial Analysis Functions ---
 # Note: These helper functions do not need modification as they don't directly call the API.
+# The heavy lifting lives in financial_aggregates.py, which keeps per-document running totals.
 def calculate_comprehensive_metrics(financial_data):
     """
     Calculates comprehensive financial metrics from all available data.
     """
     if not financial_data:
         return {}
-    
-    # Separate document types
-    monthly_statements = [d for d in financial_data if d.get('document_type') == 'monthly_statement']
-    transaction_lists = [d for d in financial_data if d.get('document_type') == 'transaction_list']
-    
-    # Sort by date
-    monthly_statements.sort(key=lambda x: x.get('statement_period', {}).get('end_date', ''))
-    transaction_lists.sort(key=lambda x: x.get('statement_period', {}).get('end_date', ''))
-    
-    metrics = {}
-    
-    # Current Net Worth (Latest Balance)
-    current_net_worth = 0
-    latest_balance_date = None
-    
-    # Try to get from most recent monthly statement first
-    if monthly_statements:
-        latest_statement = monthly_statements[-1]
-        current_net_worth = latest_statement.get('summary', {}).get('closing_balance', 0)
-        latest_balance_date = latest_statement.get('statement_period', {}).get('end_date')
-    
-    # If we have more recent transaction lists, use those
-    if transaction_lists:
-        latest_transaction_list = transaction_lists[-1]
-        latest_closing_balance = latest_transaction_list.get('summary', {}).get('closing_balance')
-        if latest_closing_balance is not None:
-            latest_list_date = latest_transaction_list.get('statement_period', {}).get('end_date')
-            if not latest_balance_date or (latest_list_date and latest_list_date > latest_balance_date):
-                current_net_worth = latest_closing_balance
-                latest_balance_date = latest_list_date
-    
-    metrics['current_net_worth'] = current_net_worth
-    metrics['net_worth_as_of_date'] = latest_balance_date
-    
-    # Historical balances for trend analysis
-    balance_history = []
-    for stmt in monthly_statements:
-        end_date = stmt.get('statement_period', {}).get('end_date')
-        closing_balance = stmt.get('summary', {}).get('closing_balance')
-        if end_date and closing_balance is not None:
-            balance_history.append({
-                'date': end_date,
-                'balance': closing_balance,
-                'source': 'monthly_statement'
-            })
-    
-    # Add transaction list balances if they're more recent
-    for tlist in transaction_lists:
-        end_date = tlist.get('statement_period', {}).get('end_date')
-        closing_balance = tlist.get('summary', {}).get('closing_balance')
-        if end_date and closing_balance is not None:
-            balance_history.append({
-                'date': end_date,
-                'balance': closing_balance,
-                'source': 'transaction_list'
-            })
-    
-    # Sort and deduplicate balance history (handle None dates)
-    balance_history.sort(key=lambda x: x.get('date') or '1900-01-01')
-    metrics['balance_history'] = balance_history
-    
-    # Net worth change calculations (handle None dates)
-    if len(balance_history) >= 2:
-        first_balance = balance_history[0]['balance']
-        latest_balance = balance_history[-1]['balance']
-        
-        metrics['total_net_worth_change'] = latest_balance - first_balance
-        metrics['net_worth_change_percentage'] = ((latest_balance - first_balance) / first_balance * 100) if first_balance != 0 else 0
-        
-        # Calculate period - handle None dates
-        first_date_str = balance_history[0].get('date')
-        latest_date_str = balance_history[-1].get('date')
-        
-        if first_date_str and latest_date_str:
-            try:
-                first_date = datetime.strptime(first_date_str, '%Y-%m-%d')
-                latest_date = datetime.strptime(latest_date_str, '%Y-%m-%d')
-                metrics['tracking_period_days'] = (latest_date - first_date).days
-                metrics['tracking_period_months'] = metrics['tracking_period_days'] / 30.44
-            except ValueError:
-                metrics['tracking_period_days'] = 0
-                metrics['tracking_period_months'] = 0
-    
-    # All transactions analysis
-    all_transactions = []
-    for doc in financial_data:
-        all_transactions.extend(doc.get('transactions', []))
-    
-    # Sort transactions by date (handle None values)
-    all_transactions.sort(key=lambda x: x.get('transaction_date') or '1900-01-01')
-    
-    # Total income and expenses
-    total_income = sum(t.get('credit', 0) or 0 for t in all_transactions)
-    total_expenses = sum(t.get('debit', 0) or 0 for t in all_transactions)
-    
-    metrics['total_income_all_time'] = total_income
-    metrics['total_expenses_all_time'] = total_expenses
-    metrics['net_cash_flow_all_time'] = total_income - total_expenses
-    
-    # Monthly analysis - handle None dates
-    monthly_data = defaultdict(lambda: {'income': 0, 'expenses': 0, 'transactions': []})
-    
-    for transaction in all_transactions:
-        trans_date = transaction.get('transaction_date')
-        if trans_date and isinstance(trans_date, str) and len(trans_date) >= 7:
-            try:
-                month_key = trans_date[:7]  # YYYY-MM format
-                monthly_data[month_key]['transactions'].append(transaction)
-                if transaction.get('credit'):
-                    monthly_data[month_key]['income'] += transaction['credit']
-                if transaction.get('debit'):
-                    monthly_data[month_key]['expenses'] += transaction['debit']
-            except (ValueError, TypeError):
-                continue
-    
-    # Convert to list and sort
-    monthly_summary = []
-    for month, data in monthly_data.items():
-        monthly_summary.append({
-            'month': month,
-            'income': data['income'],
-            'expenses': data['expenses'],
-            'net_flow': data['income'] - data['expenses'],
-            'transaction_count': len(data['transactions'])
-        })
-    
-    monthly_summary.sort(key=lambda x: x['month'])
-    metrics['monthly_summary'] = monthly_summary
-    
-    # Recent period analysis (last 3 months)
-    if monthly_summary:
-        recent_months = monthly_summary[-3:]
-        recent_income = sum(m['income'] for m in recent_months)
-        recent_expenses = sum(m['expenses'] for m in recent_months)
-        
-        metrics['recent_3_months'] = {
-            'income': recent_income,
-            'expenses': recent_expenses,
-            'net_flow': recent_income - recent_expenses,
-            'avg_monthly_income': recent_income / len(recent_months),
-            'avg_monthly_expenses': recent_expenses / len(recent_months)
-        }
-    
-    # Income stability analysis
-    if len(monthly_summary) >= 3:
-        incomes = [m['income'] for m in monthly_summary if m['income'] > 0]
-        if incomes:
-            avg_income = sum(incomes) / len(incomes)
-            income_variance = sum((x - avg_income) ** 2 for x in incomes) / len(incomes)
-            income_std_dev = income_variance ** 0.5
-            income_stability = max(0, 100 - (income_std_dev / avg_income * 100)) if avg_income > 0 else 0
-            
-            metrics['income_analysis'] = {
-                'average_monthly_income': avg_income,
-                'income_stability_score': income_stability,
-                'income_volatility': (income_std_dev / avg_income * 100) if avg_income > 0 else 0
-            }
-    
-    # Expense analysis
-    expense_categories = defaultdict(lambda: {'total': 0, 'count': 0, 'transactions': []})
-    
-    for transaction in all_transactions:
-        if transaction.get('debit'):
-            description = transaction.get('description', '').upper()
-            
-            # Categorize expenses based on description keywords
-            category = 'OTHER'
-            if any(word in description for word in ['INWI', 'IAM', 'ORANGE']):
-                category = 'TELECOMMUNICATIONS'
-            elif any(word in description for word in ['GAB', 'RETRAIT', 'ATM']):
-                category = 'CASH_WITHDRAWALS'
-            elif any(word in description for word in ['VIREMENT', 'TRANSFER']):
-                category = 'TRANSFERS'
-            elif any(word in description for word in ['COMMISSION', 'FRAIS', 'TIMBRE']):
-                category = 'BANK_FEES'
-            elif any(word in description for word in ['PAIEMENT', 'CB']):
-                category = 'CARD_PAYMENTS'
-            
-            expense_categories[category]['total'] += transaction['debit']
-            expense_categories[category]['count'] += 1
-            expense_categories[category]['transactions'].append(transaction)
-    
-    metrics['expense_categories'] = dict(expense_categories)
-    
-    # Spending patterns
-    largest_expenses = sorted([t for t in all_transactions if t.get('debit')], 
-                            key=lambda x: x['debit'], reverse=True)[:10]
-    metrics['largest_expenses'] = largest_expenses
-    
-    # Recurring transactions analysis - handle None dates
-    recurring_patterns = defaultdict(lambda: {'count': 0, 'total_amount': 0, 'avg_amount': 0, 'dates': []})
-    
-    for transaction in all_transactions:
-        if transaction.get('debit'):
-            # Normalize description for pattern matching
-            desc = transaction.get('description', '')
-            if desc:
-                desc = re.sub(r'\d{2}/\d{2}(/\d{4})?', '', desc)
-                desc = re.sub(r'\d{2}H\d{2}', '', desc)
-                desc = re.sub(r'\s+', ' ', desc).strip().upper()
-                
-                if len(desc) > 5:  # Only consider meaningful descriptions
-                    recurring_patterns[desc]['count'] += 1
-                    recurring_patterns[desc]['total_amount'] += transaction['debit']
-                    trans_date = transaction.get('transaction_date')
-                    if trans_date:
-                        recurring_patterns[desc]['dates'].append(trans_date)
-    
-    # Filter for truly recurring (3+ occurrences)
-    recurring_expenses = {}
-    for pattern, data in recurring_patterns.items():
-        if data['count'] >= 3:
-            data['avg_amount'] = data['total_amount'] / data['count']
-            recurring_expenses[pattern] = data
-    
-    metrics['recurring_expenses'] = recurring_expenses
-    
-    # Financial health score calculation
-    health_score = 100
-    
-    # Reduce score based on various factors
-    if metrics.get('recent_3_months'):
-        recent_net_flow = metrics['recent_3_months']['net_flow']
-        if recent_net_flow < 0:
-            health_score -= 20  # Negative cash flow
-        
-        avg_monthly_expenses = metrics['recent_3_months']['avg_monthly_expenses']
-        if avg_monthly_expenses > 0:
-            runway_months = current_net_worth / avg_monthly_expenses
-            if runway_months < 3:
-                health_score -= 30
-            elif runway_months < 6:
-                health_score -= 15
-    
-    # Income stability impact
-    if metrics.get('income_analysis'):
-        stability = metrics['income_analysis']['income_stability_score']
-        if stability < 70:
-            health_score -= 15
-        elif stability < 50:
-            health_score -= 25
-    
-    metrics['financial_health_score'] = max(0, health_score)
-    
-    # Savings rate calculation
-    if balance_history and len(balance_history) >= 2:
-        time_period_months = metrics.get('tracking_period_months', 1)
-        total_net_worth_change = metrics.get('total_net_worth_change', 0)
-        
-        if time_period_months > 0 and total_income > 0:
-            savings_rate = (total_net_worth_change / total_income) * 100
-            metrics['savings_rate'] = savings_rate
-    
-    return metrics
+    return aggregate_metrics(build_aggregates(financial_data))
 
-def create_comprehensive_financial_context(financial_data):
+def create_comprehensive_financial_context(financial_data=None, aggregates=None, metrics=None):
     """
     Creates an extremely detailed financial context with all calculations and metrics.
+    Pass the persisted aggregates (and metrics, if known) to skip re-walking the raw documents.
     """
-    if not financial_data:
+    if aggregates is None:
+        aggregates = build_aggregates(financial_data)
+    summaries = ordered_summaries(aggregates)
+    if not summaries:
         return "No financial data available to analyze."
     
     # Get comprehensive metrics
-    metrics = calculate_comprehensive_metrics(financial_data)
+    if metrics is None:
+        metrics = aggregate_metrics(aggregates)
     
     # Build detailed context
     context_parts = []
     
     # Header
-    context_parts.append("=== COMPREHENSIVE FINANCIAL ANALYSIS FOR MOUMEN ===\n\n")
+    holder = metrics.get('account_holder')
+    context_parts.append(f"=== COMPREHENSIVE FINANCIAL ANALYSIS{f' FOR {holder.upper()}' if holder else ''} ===\n\n")
     
     # Current Financial Position
     context_parts.append("### CURRENT FINANCIAL POSITION\n")
@@ -380,10 +233,13 @@ def create_comprehensive_financial_context(financial_data):
         context_parts.append("### RECURRING/SUBSCRIPTION EXPENSES\n")
         recurring = metrics['recurring_expenses']
         for pattern, data in sorted(recurring.items(), key=lambda x: x[1]['total_amount'], reverse=True)[:10]:
+            cadence = ""
+            if data.get('cadence', 'irregular') != 'irregular':
+                cadence = f", {data['cadence'].title()}, next expected {data['next_expected_date']}"
             context_parts.append(
                 f"• '{pattern}': {data['count']} occurrences, "
                 f"Total: {data['total_amount']:,.2f} MAD, "
-                f"Average: {data['avg_amount']:,.2f} MAD\n"
+                f"Average: {data['avg_amount']:,.2f} MAD{cadence}\n"
             )
         context_parts.append("\n")
     
@@ -429,18 +285,18 @@ def create_comprehensive_financial_context(financial_data):
     
     # Raw Data Summary
     context_parts.append("### DATA SOURCES SUMMARY\n")
-    monthly_statements = [d for d in financial_data if d.get('document_type') == 'monthly_statement']
-    transaction_lists = [d for d in financial_data if d.get('document_type') == 'transaction_list']
+    monthly_statements = [s for s in summaries if s.get('document_type') == 'monthly_statement']
+    transaction_lists = [s for s in summaries if s.get('document_type') == 'transaction_list']
     
     context_parts.append(f"• Monthly Statements: {len(monthly_statements)} documents\n")
     context_parts.append(f"• Transaction Lists: {len(transaction_lists)} documents\n")
     
-    total_transactions = sum(len(doc.get('transactions', [])) for doc in financial_data)
+    total_transactions = sum(s['transaction_count'] for s in summaries)
     context_parts.append(f"• Total Transactions Analyzed: {total_transactions}\n")
     
     if monthly_statements:
-        earliest_start = min((s.get('statement_period', {}).get('start_date') or '9999-12-31') for s in monthly_statements)
-        latest_end = max((s.get('statement_period', {}).get('end_date') or '1900-01-01') for s in monthly_statements)
+        earliest_start = min((s.get('start_date') or '9999-12-31') for s in monthly_statements)
+        latest_end = max((s.get('end_date') or '1900-01-01') for s in monthly_statements)
         if earliest_start != '9999-12-31' and latest_end != '1900-01-01':
             context_parts.append(f"• Data Period: {earliest_start} to {latest_end}\n")
     
@@ -450,8 +306,8 @@ def create_comprehensive_financial_context(financial_data):
     return "".join(context_parts)
 
 # --- PDF Analysis Logic (keeping existing functions) ---
-# Note: These functions have been updated to not call genai.configure() directly.
-# The API key will be configured in the main calling function.
+# Note: These functions never call genai.configure(); model calls go through the
+# per-key client that the calling function takes from llm_backend.
 def identify_pdf_type(text_content):
     """
     Analyzes the PDF text content to determine the type of bank document.
@@ -581,10 +437,9 @@ def get_appropriate_prompt(pdf_type):
     else:
         return create_unknown_document_prompt()
 
-def _analyze_pdf_direct(pdf_data, pdf_type):
+def _analyze_pdf_direct(pdf_data, pdf_type, client):
     """Enhanced direct PDF analysis with type-specific prompts."""
     try:
-        client = genai.GenerativeModel('gemini-1.5-flash-latest')
         prompt = get_appropriate_prompt(pdf_type)
         
         response = client.generate_content(
@@ -599,12 +454,40 @@ def _analyze_pdf_direct(pdf_data, pdf_type):
         print(f"--- ❌ Direct PDF analysis failed: {e} ---")
         return None
 
-def _analyze_pdf_with_text_extraction(pdf_data, pdf_type):
-    """Enhanced fallback text extraction with type-specific prompts."""
+def _extract_text_chunk(client, prompt, chunk, page_count):
+    """Runs one model call over a chunk of extracted text."""
+    text_prompt = f"""
+        {prompt}
+        {chunk_instructions(chunk, page_count)}
+
+        Here is the extracted text content from the PDF:
+        ---
+        {chunk['text']}
+        ---
+        """
+
+    response = client.generate_content(
+        text_prompt,
+        generation_config={"temperature": 0.1}
+    )
+
+    cleaned_text = response.text.strip().replace("```json", "").replace("```", "").strip()
+    return json.loads(cleaned_text)
+
+def _analyze_pdf_with_text_extraction(pdf_data, pdf_type, client, file_hash=None, page_texts=None):
+    """
+    Enhanced fallback text extraction with type-specific prompts.
+    The text is sent in page-range chunks (EXTRACTION_CHUNK_PAGES pages each)
+    extracted concurrently and stitched together, so nothing is truncated.
+    """
     try:
         print("--- Attempting fallback processing using text extraction... ---")
-        pdf_reader = PyPDF2.PdfReader(io.BytesIO(pdf_data))
-        extracted_text = "".join(page.extract_text() for page in pdf_reader.pages)
+        if page_texts is None:
+            page_texts = extract_page_texts(
+                pdf_data, file_hash=file_hash, cache=extraction_cache,
+                max_workers=PDF_TEXT_WORKERS, parallel_min_pages=PDF_PARALLEL_MIN_PAGES
+            )
+        extracted_text = "".join(page_texts)
         
         if not extracted_text or len(extracted_text.strip()) < 50:
             print("--- ❌ Fallback failed: Could not extract sufficient text from PDF. ---")
@@ -615,25 +498,15 @@ def _analyze_pdf_with_text_extraction(pdf_data, pdf_type):
             pdf_type = identify_pdf_type(extracted_text)
             print(f"--- Identified PDF type from text: {pdf_type} ---")
 
-        client = genai.GenerativeModel('gemini-1.5-flash-latest')
         prompt = get_appropriate_prompt(pdf_type)
-        
-        text_prompt = f"""
-        {prompt}
+        chunks = plan_chunks(page_texts, EXTRACTION_CHUNK_PAGES, EXTRACTION_CHUNK_OVERLAP_CHARS)
+        if len(chunks) == 1:
+            return _extract_text_chunk(client, prompt, chunks[0], len(page_texts))
 
-        Here is the extracted text content from the PDF:
-        ---
-        {extracted_text[:30000]} 
-        ---
-        """
-
-        response = client.generate_content(
-            text_prompt,
-            generation_config={"temperature": 0.1}
-        )
-        
-        cleaned_text = response.text.strip().replace("```json", "").replace("```", "").strip()
-        return json.loads(cleaned_text)
+        print(f"--- Extracting {len(page_texts)} pages in {len(chunks)} chunks ---")
+        with ThreadPoolExecutor(max_workers=min(EXTRACTION_CHUNK_WORKERS, len(chunks))) as executor:
+            parts = list(executor.map(lambda chunk: _extract_text_chunk(client, prompt, chunk, len(page_texts)), chunks))
+        return stitch_extractions(parts, chunks)
 
     except Exception as e:
         print(f"--- ❌ Fallback text analysis failed: {e} ---")
@@ -687,160 +560,679 @@ def post_process_extracted_data(extracted_data):
     
     return extracted_data
 
-def smart_merge_data(existing_data, new_data):
+def smart_merge_data(existing_data, new_data, changes=None, index=None):
     """
     Intelligently merges new data with existing data.
     Handles both monthly statements and transaction lists.
+    If a `changes` list is given, each outcome is recorded in it as an
+    (action, document) pair where action is 'insert', 'replace' or 'merge'.
+    Pass the same MergeIndex when merging several documents into one list.
     """
+    if changes is None:
+        changes = []
+
     if not existing_data:
-        return [new_data]
+        changes.append(('insert', new_data))
+        documents = []
+        if index is not None:
+            index.insert(documents, new_data)
+        else:
+            documents.append(new_data)
+        return documents
+
+    if index is None:
+        index = MergeIndex(existing_data)
     
     new_hash = new_data.get('source_file_hash')
     
     # Check if this exact file was already processed
-    for i, stmt in enumerate(existing_data):
-        if stmt.get('source_file_hash') == new_hash:
-            print(f"--- File already exists, updating data ---")
-            existing_data[i] = new_data
-            return existing_data
+    position = index.find_by_hash(new_hash)
+    if position is not None:
+        print(f"--- File already exists, updating data ---")
+        index.replace(existing_data, position, new_data)
+        changes.append(('replace', new_data))
+        return existing_data
     
     # For transaction lists, try to merge with existing monthly statements
     if new_data.get('document_type') == 'transaction_list':
-        merged = False
         new_transactions = new_data.get('transactions', [])
+        new_dates = sorted({
+            t.get('transaction_date') for t in new_transactions if isinstance(t.get('transaction_date'), str) and t.get('transaction_date')
+        })
         
-        for stmt in existing_data:
-            if stmt.get('document_type') == 'monthly_statement':
-                # Check if transactions overlap with existing statement period
-                stmt_start = stmt.get('statement_period', {}).get('start_date')
-                stmt_end = stmt.get('statement_period', {}).get('end_date')
-                
-                if stmt_start and stmt_end:
-                    # Check if any new transactions fall within this period
-                    overlapping_transactions = []
-                    for trans in new_transactions:
-                        trans_date = trans.get('transaction_date')
-                        if trans_date and stmt_start <= trans_date <= stmt_end:
-                            overlapping_transactions.append(trans)
-                    
-                    if overlapping_transactions:
-                        print(f"--- Found overlapping transactions, merging with existing statement ---")
-                        # Add new transactions that don't already exist
-                        existing_transactions = stmt.get('transactions', [])
-                        existing_descriptions = [t.get('description', '') + str(t.get('transaction_date', '')) for t in existing_transactions]
-                        
-                        for new_trans in overlapping_transactions:
-                            new_desc_date = new_trans.get('description', '') + str(new_trans.get('transaction_date', ''))
-                            if new_desc_date not in existing_descriptions:
-                                existing_transactions.append(new_trans)
-                        
-                        # Update totals
-                        total_debits = sum(t.get('debit', 0) or 0 for t in existing_transactions)
-                        total_credits = sum(t.get('credit', 0) or 0 for t in existing_transactions)
-                        stmt['summary']['total_debits'] = total_debits
-                        stmt['summary']['total_credits'] = total_credits
-                        
-                        merged = True
-                        break
+        # Find the first monthly statement whose period contains any new transaction
+        stmt, overlapping_dates = index.first_overlapping(existing_data, new_dates)
         
-        if not merged:
-            # Add as separate entry if no overlap found
-            existing_data.append(new_data)
+        if stmt is not None:
+            print(f"--- Found overlapping transactions, merging with existing statement ---")
+            overlapping_transactions = [t for t in new_transactions if t.get('transaction_date') in overlapping_dates]
+
+            # Add new transactions that don't already exist
+            existing_transactions = stmt.get('transactions', [])
+            existing_descriptions = index.fingerprints(stmt, existing_transactions)
+            
+            added = []
+            for new_trans in overlapping_transactions:
+                if transaction_fingerprint(new_trans) not in existing_descriptions:
+                    existing_transactions.append(new_trans)
+                    added.append(new_trans)
+            existing_descriptions.update(transaction_fingerprint(t) for t in added)
+            
+            # Update totals
+            total_debits = sum(t.get('debit', 0) or 0 for t in existing_transactions)
+            total_credits = sum(t.get('credit', 0) or 0 for t in existing_transactions)
+            stmt['summary']['total_debits'] = total_debits
+            stmt['summary']['total_credits'] = total_credits
+            
+            changes.append(('merge', stmt))
+            # The list stays sorted by end date
+            index.ensure_sorted(existing_data)
+        else:
+            # Add as separate entry if no overlap found, at its end-date position
+            index.insert(existing_data, new_data)
+            changes.append(('insert', new_data))
     else:
-        # For monthly statements, just add to the list
-        existing_data.append(new_data)
+        # For monthly statements, just add to the list at its end-date position
+        index.insert(existing_data, new_data)
+        changes.append(('insert', new_data))
     
-    # Sort by end date
-    existing_data.sort(key=lambda x: x.get('statement_period', {}).get('end_date', '') or '1900-01-01')
     return existing_data
 
-def analyze_pdf_with_smart_detection(pdf_data, filename, api_key):
+def guess_pdf_type_from_filename(filename):
+    """Guesses the PDF type from keywords in the file name."""
+    filename_lower = filename.lower()
+    if 'statement' in filename_lower or 'releve' in filename_lower:
+        return 'monthly_statement'
+    elif 'operation' in filename_lower or 'mouvement' in filename_lower or 'transaction' in filename_lower:
+        return 'transaction_list'
+    return 'unknown'
+
+_classification_stats = {'total': 0, 'checked': 0, 'correct': 0}
+_classification_stats_lock = threading.Lock()
+
+def classify_pdf(pdf_data, filename, file_hash=None):
     """
-    Enhanced PDF analysis that takes an API key as an argument.
+    Picks the PDF type before any model call by scoring the text of the first
+    CLASSIFICATION_PAGES pages with identify_pdf_type; the file name is only
+    used when the content is inconclusive.
     """
-    # ** NEW: Configure GenAI with the user-provided key **
+    started = time.perf_counter()
+    filename_type = guess_pdf_type_from_filename(filename)
+    content_type = 'unknown'
     try:
-        genai.configure(api_key=api_key)
+        first_pages = extract_page_texts(
+            pdf_data, file_hash=file_hash, cache=extraction_cache,
+            page_indexes=range(min(CLASSIFICATION_PAGES, count_pages(pdf_data))), max_workers=1
+        )
+        content_type = identify_pdf_type("\n".join(first_pages))
     except Exception as e:
-        print(f"--- ❌ Failed to configure Gemini with provided API key: {e}")
-        # This will raise an AuthenticationError if the key is invalid
+        print(f"--- ❌ Could not read the first pages for classification: {e} ---")
+
+    pdf_type = content_type if content_type != 'unknown' else filename_type
+    classification = {
+        'pdf_type': pdf_type,
+        'source': 'content' if content_type != 'unknown' else ('filename' if filename_type != 'unknown' else 'none'),
+        'content_type': content_type,
+        'filename_type': filename_type,
+        'classification_ms': round((time.perf_counter() - started) * 1000, 2),
+    }
+    print(f"--- Classified as {pdf_type} from {classification['source']} in {classification['classification_ms']} ms ---")
+    return classification
+
+def record_classification(classification, page_texts):
+    """
+    Checks a classification against identify_pdf_type over the full text of
+    every page. The extracted document_type is no check: it follows from the
+    chosen prompt or parser. Classifications are not checked when the full
+    text is inconclusive too (correct is None).
+    """
+    full_text_type = identify_pdf_type("".join(page_texts)) if page_texts else 'unknown'
+    classification['full_text_type'] = full_text_type
+    classification['correct'] = None if full_text_type == 'unknown' else classification['pdf_type'] == full_text_type
+    with _classification_stats_lock:
+        _classification_stats['total'] += 1
+        if classification['correct'] is not None:
+            _classification_stats['checked'] += 1
+            _classification_stats['correct'] += classification['correct']
+
+def classification_accuracy():
+    """Share of checked classifications that matched the full-text type since startup."""
+    with _classification_stats_lock:
+        total, checked, correct = (_classification_stats['total'], _classification_stats['checked'],
+                                   _classification_stats['correct'])
+    return {'classified': total, 'checked': checked, 'correct': correct,
+            'accuracy': (correct / checked) if checked else None}
+
+def _analyze_pdf_with_model(pdf_data, pdf_type, api_key, file_hash, page_texts, has_text):
+    """Model-based extraction: chunked text for long PDFs, else direct with a text fallback."""
+    # Each key has its own client, so concurrent uploads never share SDK state
+    try:
+        client = llm_backend.get(api_key)
+    except Exception as e:
+        print(f"--- ❌ Failed to create a Gemini client for the provided API key: {e}")
         raise ValueError(f"Invalid or improperly formatted Gemini API Key. {e}")
 
+    # Long PDFs with a text layer go straight to chunked text extraction, so
+    # latency follows the chunk size rather than the document length.
+    extracted_data = None
+    chunked = has_text and len(page_texts) >= CHUNKED_EXTRACTION_MIN_PAGES
+    if chunked:
+        print(f"--- Attempting Method 1: Chunked Text Analysis ({len(page_texts)} pages) ---")
+        with span('model_chunked'):
+            extracted_data = _analyze_pdf_with_text_extraction(pdf_data, pdf_type, client, file_hash, page_texts)
+        increment('finance_extractions_total', method='chunked', outcome='success' if extracted_data else 'failure')
+        if extracted_data:
+            print("--- ✅ Success with Chunked Text Analysis ---")
+            extracted_data['processed_with_fallback'] = False
+
+    if not extracted_data:
+        print("--- Attempting Method 1: Direct PDF Analysis ---" if not chunked
+              else "--- Attempting Method 2: Direct PDF Analysis ---")
+        with span('model_direct'):
+            extracted_data = _analyze_pdf_direct(pdf_data, pdf_type, client)
+        increment('finance_extractions_total', method='direct', outcome='success' if extracted_data else 'failure')
+        if extracted_data:
+            print("--- ✅ Success with Direct PDF Analysis ---")
+            extracted_data['processed_with_fallback'] = not chunked
+        elif not chunked:
+            with span('model_text_fallback'):
+                extracted_data = _analyze_pdf_with_text_extraction(pdf_data, pdf_type, client, file_hash, page_texts)
+            increment('finance_extractions_total', method='fallback', outcome='success' if extracted_data else 'failure')
+            if extracted_data:
+                print("--- ✅ Success with Text Extraction Fallback ---")
+                extracted_data['processed_with_fallback'] = True
+    return extracted_data
+
+@timed('analyze_pdf')
+def analyze_pdf_with_smart_detection(pdf_data, filename, api_key, force_reextract=False):
+    """
+    Enhanced PDF analysis that takes an API key as an argument.
+    Files that were already extracted with the same prompt version and model
+    are served from the extraction cache unless force_reextract is set.
+    """
+    file_hash = hashlib.sha256(pdf_data).hexdigest()
+
+    if not force_reextract:
+        with span('extraction_cache_lookup'):
+            cached_data = extraction_cache.get(file_hash, EXTRACTION_PROMPT_VERSION, llm_backend.model_name)
+        increment('finance_cache_requests_total', cache='extraction', result='hit' if cached_data else 'miss')
+        if cached_data:
+            print(f"\nProcessing '{filename}'...")
+            print("--- ✅ Extraction cache hit, skipping model calls ---")
+            cached_data['source_file_name'] = filename
+            cached_data['processing_timestamp'] = datetime.now().isoformat()
+            cached_data['processed_from_cache'] = True
+            return cached_data
 
     print(f"\nProcessing '{filename}'...")
-    
-    # First, try to determine PDF type from filename
-    pdf_type = 'unknown'
-    filename_lower = filename.lower()
-    if 'statement' in filename_lower or 'releve' in filename_lower:
-        pdf_type = 'monthly_statement'
-    elif 'operation' in filename_lower or 'mouvement' in filename_lower or 'transaction' in filename_lower:
-        pdf_type = 'transaction_list'
-    
-    print(f"--- Initial type guess from filename: {pdf_type} ---")
-    print("--- Attempting Method 1: Direct PDF Analysis ---")
-    
-    extracted_data = _analyze_pdf_direct(pdf_data, pdf_type)
 
-    if extracted_data:
-        print("--- ✅ Success with Direct PDF Analysis ---")
-        extracted_data['processed_with_fallback'] = False
-    else:
-        extracted_data = _analyze_pdf_with_text_extraction(pdf_data, pdf_type)
-        if extracted_data:
-            print("--- ✅ Success with Text Extraction Fallback ---")
-            extracted_data['processed_with_fallback'] = True
+    with span('classify'):
+        classification = classify_pdf(pdf_data, filename, file_hash)
+    pdf_type = classification['pdf_type']
+
+    page_texts = None
+    try:
+        with span('pdf_text_extraction'):
+            page_texts = extract_page_texts(
+                pdf_data, file_hash=file_hash, cache=extraction_cache,
+                max_workers=PDF_TEXT_WORKERS, parallel_min_pages=PDF_PARALLEL_MIN_PAGES
+            )
+    except Exception as e:
+        print(f"--- ❌ Could not read PDF pages: {e} ---")
+    has_text = bool(page_texts) and len("".join(page_texts).strip()) >= 50
+
+    # Known Attijariwafa layouts are parsed locally; the model is only used
+    # when the parsed transactions do not reconcile with the balances.
+    extracted_data = None
+    if LOCAL_PARSER_ENABLED and has_text and pdf_type != 'unknown':
+        try:
+            with span('local_parse'):
+                extracted_data = parse_statement("\n".join(page_texts), pdf_type)
+            print("--- ✅ Parsed locally, transactions reconcile with the balances ---")
+            extracted_data['processed_with_fallback'] = False
+            extracted_data['processed_with_local_parser'] = True
+            increment('finance_extractions_total', method='local_parser', outcome='success')
+        except StatementParseError as e:
+            print(f"--- Local parser not used: {e} ---")
+            increment('finance_extractions_total', method='local_parser', outcome='failure')
+
+    if not extracted_data:
+        extracted_data = _analyze_pdf_with_model(pdf_data, pdf_type, api_key, file_hash, page_texts, has_text)
 
     if not extracted_data:
         print("--- ❌ Both analysis methods failed. ---")
         return None
     
     # Post-process the data
-    extracted_data = post_process_extracted_data(extracted_data)
+    with span('post_process'):
+        extracted_data = post_process_extracted_data(extracted_data)
     
     # Add metadata
-    file_hash = hashlib.sha256(pdf_data).hexdigest()
     extracted_data['source_file_hash'] = file_hash
     extracted_data['source_file_name'] = filename
     extracted_data['processing_timestamp'] = datetime.now().isoformat()
+    extracted_data['processed_from_cache'] = False
+    record_classification(classification, page_texts if has_text else None)
+    extracted_data['classification'] = classification
+
+    # Local parses are cheaper to redo than to look up, so only model output is cached
+    if not extracted_data.get('processed_with_local_parser'):
+        try:
+            extraction_cache.put(file_hash, EXTRACTION_PROMPT_VERSION, llm_backend.model_name, extracted_data)
+        except Exception as e:
+            print(f"--- ❌ Could not store extraction in cache: {e} ---")
     
     print(f"--- ✅ Successfully processed as {extracted_data.get('document_type', 'unknown')} ---")
     return extracted_data
 
+def _analysis_cache_version(partition):
+    """Cache key for derived results: code versions plus the partition's data version."""
+    return f"{ANALYSIS_CACHE_VERSION}:{summary_version()}:{partition.storage.get_data_version()}"
+
+def get_cached_metrics(partition):
+    """Returns the comprehensive metrics, recomputing them only when the data changed."""
+    version = _analysis_cache_version(partition)
+    metrics = partition.analysis_cache.get('metrics', version)
+    increment('finance_cache_requests_total', cache='metrics', result='hit' if metrics is not None else 'miss')
+    if metrics is not None:
+        return metrics
+
+    with span('compute_metrics'):
+        metrics = aggregate_metrics(partition.storage.load_aggregates())
+    # Only cache if no upload landed while we were computing
+    if _analysis_cache_version(partition) == version:
+        partition.analysis_cache.put('metrics', version, metrics)
+    return metrics
+
+def get_cached_financial_context(partition):
+    """Returns the rendered chat context, or None when no data has been uploaded."""
+    version = _analysis_cache_version(partition)
+    cached = partition.analysis_cache.get('financial_context', version)
+    increment('finance_cache_requests_total', cache='financial_context', result='hit' if cached is not None else 'miss')
+    if cached is not None:
+        return cached['context']
+
+    aggregates = partition.storage.load_aggregates()
+    context = None
+    if aggregates['order']:
+        metrics = partition.analysis_cache.get('metrics', version)
+        if metrics is None:
+            metrics = aggregate_metrics(aggregates)
+        with span('build_financial_context'):
+            context = create_comprehensive_financial_context(aggregates=aggregates, metrics=metrics)
+    if _analysis_cache_version(partition) == version:
+        partition.analysis_cache.put('financial_context', version, {'context': context})
+    return context
+
+def get_transaction_index(partition):
+    """Returns the partition's TransactionIndex, rebuilt lazily once per data version."""
+    version = partition.storage.get_data_version()
+    with partition.transaction_index_lock:
+        state = partition.transaction_index
+        if state['version'] != version or state['index'] is None:
+            state['index'] = TransactionIndex(partition.storage.load_documents())
+            state['version'] = version
+        return state['index']
+
+def get_chat_search_index(partition):
+    """Returns the partition's TransactionSearchIndex, built on the first chat."""
+    version = partition.storage.get_data_version()
+    with partition.chat_search_index_lock:
+        state = partition.chat_search_index
+        if state['version'] != version or state['index'] is None:
+            state['index'] = TransactionSearchIndex(partition.storage.load_documents())
+            state['version'] = version
+        return state['index']
+
+def _update_chat_search_index(partition, previous_version, changes):
+    """Re-indexes only the merged documents if the index was current before the save."""
+    with partition.chat_search_index_lock:
+        state = partition.chat_search_index
+        if state['index'] is not None and state['version'] == previous_version:
+            state['index'].apply_changes(changes)
+            state['version'] = partition.storage.get_data_version()
+
+def _merge_and_save(partition, new_documents):
+    """
+    Merges extracted documents into one partition's data with a single persist.
+    Only the stored documents the merge can touch are loaded (same source file,
+    or a monthly statement overlapping a transaction list); returns the merged
+    candidates and the changes.
+    """
+    storage = partition.storage
+    # The storage lock keeps other workers' load-merge-save cycles out until we saved
+    with storage.lock():
+        with span('load_merge_candidates'):
+            candidates = storage.load_merge_candidates(new_documents)
+        previous_version = storage.get_data_version()
+        changes = []
+        with span('merge'):
+            index = MergeIndex(candidates)
+            for new_statement_data in new_documents:
+                candidates = smart_merge_data(candidates, new_statement_data, changes, index)
+            # A re-extraction may have moved an end date; storage is kept in end-date order
+            index.ensure_sorted(candidates)
+        if changes:
+            # Persist only the documents touched by the merge
+            with span('persist'):
+                storage.save_changes(candidates, changes)
+            _update_chat_search_index(partition, previous_version, changes)
+    return candidates, changes
+
+def _migrate_legacy_store():
+    """Splits the pre-partition statement store, if any, into the default user's partitions."""
+    legacy_paths = {
+        'json': [OUTPUT_JSON_PATH],
+        'sqlite': [SQLITE_DB_PATH, OUTPUT_JSON_PATH],
+        'log': [LOG_STORAGE_DIR, OUTPUT_JSON_PATH],
+    }
+    if partitions.legacy_migrated() or not any(os.path.exists(p) for p in legacy_paths.get(STORAGE_BACKEND, [])):
+        return
+    legacy = create_storage(
+        STORAGE_BACKEND, OUTPUT_JSON_PATH, AGGREGATES_JSON_PATH, SQLITE_DB_PATH, LOG_STORAGE_DIR,
+        segment_max_bytes=LOG_SEGMENT_MAX_BYTES, compact_threshold_bytes=LOG_COMPACT_THRESHOLD_BYTES
+    )
+    with legacy.lock():
+        if not partitions.legacy_migrated():
+            partitions.migrate_legacy(legacy.load_documents(), DEFAULT_USER_ID)
+
+def merge_and_persist(new_documents, user_id):
+    """
+    Merges documents into their account partitions, coalesced with concurrent callers.
+    Returns the account each document was merged into (see PartitionRegistry.resolve_accounts).
+    """
+    accounts = partitions.resolve_accounts(user_id, new_documents)
+    by_account = defaultdict(list)
+    for document, account in zip(new_documents, accounts):
+        by_account[account].append(document)
+    for account, documents in by_account.items():
+        partitions.get(user_id, account).merge_writer.submit(documents)
+    return accounts
+
+def _process_upload_job(filename, pdf_data, api_key, force_reextract, user_id):
+    """Background handler for async uploads: analyze, then merge and persist."""
+    new_statement_data = analyze_pdf_with_smart_detection(pdf_data, filename, api_key, force_reextract)
+    if not new_statement_data:
+        raise ValueError("Failed to extract data from PDF. The PDF may be an image, password-protected, or not a supported bank document format.")
+    merge_and_persist([new_statement_data], user_id)
+    return new_statement_data
+
+# --- Conditional and Compressed Responses ---
+# Encoded bodies of the data endpoints are kept per partition (Partition.encoded_responses),
+# keyed by (ETag, encoding), for the partition's current data version only. Each encoding
+# is a separate representation, so compressed bodies carry the ETag suffixed with it.
+
+def _data_etag(partition, variant):
+    """Strong ETag for a data endpoint variant at the partition's current data version."""
+    return f"{partition.tag}:{_analysis_cache_version(partition)}:{variant}"
+
+def _negotiate_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+def _representation_etag(etag, content_encoding):
+    """ETag of one encoding of a response: compressed bodies get their own strong ETag."""
+    return f"{etag}-{content_encoding}" if content_encoding else etag
+
+def _not_modified(etag):
+    """
+    Returns a 304 response if the client already holds this ETag, in the encoding
+    it would be served now or uncompressed (small bodies are never compressed), else None.
+    """
+    for candidate in (_representation_etag(etag, _negotiate_encoding()), etag):
+        if not request.if_none_match.contains(candidate):
+            continue
+        response = Response(status=304)
+        response.set_etag(candidate)
+        response.vary.add('Accept-Encoding')
+        response.vary.add('X-User-ID')
+        response.vary.add('X-Gemini-API-Key')
+        return response
+    return None
+
+def _cached_json_response(partition, etag, payload_factory):
+    """
+    Serializes (and compresses, if the client accepts it) a JSON payload once per
+    ETag and encoding, then serves the stored bytes to every later request.
+    """
+    encoding = _negotiate_encoding()
+    version = etag.rsplit(':', 1)[0]
+    cache = partition.encoded_responses
+    with partition.encoded_responses_lock:
+        if cache['version'] != version:
+            cache['version'] = version
+            cache['bodies'] = {}
+        entry = cache['bodies'].get((etag, encoding))
+
+    if entry is None:
+        body = app.json.dumps(payload_factory()).encode('utf-8')
+        content_encoding = None
+        if encoding and len(body) >= COMPRESSION_MIN_BYTES:
+            body = brotli.compress(body) if encoding == 'br' else gzip.compress(body, compresslevel=6)
+            content_encoding = encoding
+        entry = (body, content_encoding)
+        with partition.encoded_responses_lock:
+            if cache['version'] == version:
+                cache['bodies'][(etag, encoding)] = entry
+
+    body, content_encoding = entry
+    response = Response(body, mimetype='application/json')
+    if content_encoding:
+        response.headers['Content-Encoding'] = content_encoding
+    response.set_etag(_representation_etag(etag, content_encoding))
+    response.vary.add('Accept-Encoding')
+    response.vary.add('X-User-ID')
+    response.vary.add('X-Gemini-API-Key')
+    return response
+
+def _lean_metrics(metrics):
+    """Drops the transaction lists embedded in each expense category."""
+    lean = dict(metrics)
+    lean['expense_categories'] = {
+        category: {key: value for key, value in data.items() if key != 'transactions'}
+        for category, data in metrics.get('expense_categories', {}).items()
+    }
+    return lean
+
+# --- Request Partitions ---
+def _request_user_id():
+    """
+    Returns (user_id, error_response). The user is the X-User-ID header (requests
+    without one share the default user), or, with PARTITION_USER_FROM_API_KEY,
+    a hash of the X-Gemini-API-Key plus that header.
+    """
+    user_id = (request.headers.get('X-User-ID') or '').strip()
+    if not PARTITION_USER_FROM_API_KEY:
+        return user_id or DEFAULT_USER_ID, None
+
+    api_key = request.headers.get('X-Gemini-API-Key')
+    if not api_key:
+        return None, (jsonify({"error": "Gemini API key is missing. Please provide it in the X-Gemini-API-Key header."}), 401)
+    return 'key-' + hashlib.sha256(f"{api_key}\0{user_id}".encode('utf-8')).hexdigest()[:32], None
+
+def _request_partition():
+    """
+    Returns (partition, error_response) for the account addressed by ?account=.
+    Without it, a user's only account is used, or a read-only CombinedView of
+    all of them; partition is None if the user has no data yet.
+    """
+    user_id, error = _request_user_id()
+    if error:
+        return None, error
+    account = request.args.get('account')
+    if account:
+        partition = partitions.find(user_id, account)
+        if partition is None:
+            return None, (jsonify({"error": f"Unknown account '{account}'"}), 404)
+        return partition, None
+
+    accounts = partitions.accounts(user_id)
+    if len(accounts) > 1:
+        return partitions.combined(user_id), None
+    if not accounts:
+        return None, None
+    return partitions.get(user_id, accounts[0]), None
+
 # --- API Endpoints ---
+@app.route('/api/accounts', methods=['GET'])
+def list_accounts():
+    """Account numbers stored for the requesting user."""
+    user_id, error = _request_user_id()
+    if error:
+        return error
+    accounts = partitions.accounts(user_id)
+    return jsonify({"accounts": accounts, "count": len(accounts)})
+
 @app.route('/api/get-financial-data', methods=['GET'])
 def get_financial_data():
-    """Endpoint to fetch all stored financial data."""
-    if not os.path.exists(OUTPUT_JSON_PATH):
+    """Endpoint to fetch all stored financial data of one account."""
+    partition, error = _request_partition()
+    if error:
+        return error
+    if partition is None:
         return jsonify([])
     try:
-        with open(OUTPUT_JSON_PATH, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        return jsonify(data)
+        etag = _data_etag(partition, 'data')
+        not_modified = _not_modified(etag)
+        if not_modified:
+            return not_modified
+        return _cached_json_response(partition, etag, partition.storage.load_documents)
     except Exception as e:
         return jsonify({"error": f"Failed to read data file: {e}"}), 500
 
 @app.route('/api/get-financial-metrics', methods=['GET'])
 def get_financial_metrics():
-    """New endpoint to get comprehensive financial metrics and calculations."""
-    if not os.path.exists(OUTPUT_JSON_PATH):
+    """
+    New endpoint to get comprehensive financial metrics and calculations.
+    Pass ?lean=true to omit the transactions embedded in each expense category,
+    or ?from=&to= (YYYY-MM-DD, either may be omitted) for the totals of a date range.
+    """
+    partition, error = _request_partition()
+    if error:
+        return error
+    if partition is None:
         return jsonify({"error": "No financial data available"}), 404
-    
+
+    if request.args.get('from') or request.args.get('to'):
+        return _range_metrics(partition, request.args.get('from') or None, request.args.get('to') or None)
+
+    lean = request.args.get('lean', '').lower() in ('1', 'true', 'yes')
     try:
-        with open(OUTPUT_JSON_PATH, 'r', encoding='utf-8') as f:
-            financial_data = json.load(f)
+        etag = _data_etag(partition, 'metrics-lean' if lean else 'metrics')
+        not_modified = _not_modified(etag)
+        if not_modified:
+            return not_modified
+
+        # Served from the versioned cache between uploads
+        metrics = get_cached_metrics(partition)
         
-        if not financial_data:
+        if not metrics:
             return jsonify({"error": "No financial data available"}), 404
         
-        # Calculate comprehensive metrics
-        metrics = calculate_comprehensive_metrics(financial_data)
-        return jsonify(metrics)
+        return _cached_json_response(partition, etag, lambda: _lean_metrics(metrics) if lean else metrics)
         
     except Exception as e:
         return jsonify({"error": f"Failed to calculate metrics: {e}"}), 500
 
+def _date_range_error(start_date, end_date):
+    """Returns a 400 response if from/to are not YYYY-MM-DD dates in order, else None."""
+    try:
+        for value in (start_date, end_date):
+            if value:
+                datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        return jsonify({"error": "from and to must be dates formatted as YYYY-MM-DD"}), 400
+    if start_date and end_date and start_date > end_date:
+        return jsonify({"error": "from must not be after to"}), 400
+    return None
+
+def _range_metrics(partition, start_date, end_date):
+    """Income, expenses and category totals for one date range, from the prefix sums."""
+    error = _date_range_error(start_date, end_date)
+    if error:
+        return error
+
+    try:
+        etag = _data_etag(partition, f"range:{start_date or ''}:{end_date or ''}")
+        not_modified = _not_modified(etag)
+        if not_modified:
+            return not_modified
+
+        index = get_transaction_index(partition)
+        if not len(index):
+            return jsonify({"error": "No financial data available"}), 404
+        with span('range_metrics'):
+            payload = index.range_totals(start_date, end_date)
+        response = jsonify(payload)
+        response.set_etag(etag)
+        response.vary.add('X-User-ID')
+        response.vary.add('X-Gemini-API-Key')
+        return response
+    except Exception as e:
+        return jsonify({"error": f"Failed to calculate metrics: {e}"}), 500
+
+@app.route('/api/transactions', methods=['GET'])
+def get_transactions():
+    """
+    Paginated, filterable transaction query.
+    Filters: from, to (YYYY-MM-DD), type (debit/credit), category, min_amount,
+    max_amount, q (description substring). Paging: limit, cursor, order (desc/asc).
+    """
+    args = request.args
+    kind = args.get('type') or None
+    if kind not in (None, 'debit', 'credit'):
+        return jsonify({"error": "type must be 'debit' or 'credit'"}), 400
+    order = args.get('order', 'desc')
+    if order not in ('asc', 'desc'):
+        return jsonify({"error": "order must be 'asc' or 'desc'"}), 400
+    date_error = _date_range_error(args.get('from') or None, args.get('to') or None)
+    if date_error:
+        return date_error
+
+    try:
+        min_amount = float(args['min_amount']) if args.get('min_amount') else None
+        max_amount = float(args['max_amount']) if args.get('max_amount') else None
+        limit = int(args.get('limit', 50))
+    except ValueError:
+        return jsonify({"error": "min_amount, max_amount and limit must be numbers"}), 400
+
+    partition, error = _request_partition()
+    if error:
+        return error
+    if partition is None:
+        return jsonify({"transactions": [], "count": 0, "next_cursor": None})
+
+    try:
+        index = get_transaction_index(partition)
+        items, next_cursor = index.query(
+            start_date=args.get('from') or None,
+            end_date=args.get('to') or None,
+            kind=kind,
+            category=(args.get('category') or '').upper() or None,
+            min_amount=min_amount,
+            max_amount=max_amount,
+            text=args.get('q') or None,
+            cursor=args.get('cursor') or None,
+            limit=limit,
+            descending=order == 'desc'
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"Failed to query transactions: {e}"}), 500
+
+    return jsonify({
+        "transactions": items,
+        "count": len(items),
+        "next_cursor": next_cursor
+    })
+
 @app.route('/api/upload-statement', methods=['POST'])
+@timed('upload_statement')
 def upload_statement():
     """Enhanced endpoint to upload and analyze any type of bank PDF."""
     # ** NEW: Get API key from request header **
@@ -855,13 +1247,32 @@ def upload_statement():
     if file.filename == '':
         return jsonify({"error": "No selected file"}), 400
 
+    force_reextract = request.args.get('force_reextract', '').lower() in ('1', 'true', 'yes')
+    async_mode = request.args.get('async', '').lower() in ('1', 'true', 'yes')
+    user_id, error = _request_user_id()
+    if error:
+        return error
+
     if file and file.filename.endswith('.pdf'):
         pdf_data = file.read()
         filename = file.filename
+
+        if async_mode:
+            # Accept immediately; extraction runs on the background job queue
+            try:
+                job_id = upload_jobs.submit(filename, pdf_data, user_api_key, force_reextract, user_id)
+            except QueueFullError as e:
+                return jsonify({"error": str(e)}), 503
+            return jsonify({
+                "message": "File accepted for processing",
+                "job_id": job_id,
+                "status": "queued",
+                "status_url": f"/api/upload-jobs/{job_id}"
+            }), 202
         
         try:
             # ** NEW: Pass the user's API key to the analysis function **
-            new_statement_data = analyze_pdf_with_smart_detection(pdf_data, filename, user_api_key)
+            new_statement_data = analyze_pdf_with_smart_detection(pdf_data, filename, user_api_key, force_reextract)
         except ValueError as e:
              # This catches invalid API key errors from our analysis function
             return jsonify({"error": str(e)}), 401 # 401 Unauthorized is appropriate for bad keys
@@ -875,58 +1286,156 @@ def upload_statement():
                 "error": "Failed to extract data from PDF. The PDF may be an image, password-protected, or not a supported bank document format." 
             }), 500
 
-        # Load existing data
-        all_statements_data = []
-        if os.path.exists(OUTPUT_JSON_PATH):
-            with open(OUTPUT_JSON_PATH, 'r', encoding='utf-8') as f:
-                try: 
-                    all_statements_data = json.load(f)
-                except json.JSONDecodeError: 
-                    pass # Overwrite if corrupt
-
-        # Smart merge with existing data
-        all_statements_data = smart_merge_data(all_statements_data, new_statement_data)
-        
-        # Save updated data
-        with open(OUTPUT_JSON_PATH, 'w', encoding='utf-8') as f:
-            json.dump(all_statements_data, f, indent=2, ensure_ascii=False)
+        # Smart merge with the account's existing data and persist
+        account = merge_and_persist([new_statement_data], user_id)[0]
             
         return jsonify({
             "message": f"File processed successfully as {new_statement_data.get('document_type', 'unknown')}", 
-            "data": new_statement_data
+            "account": account,
+            "data": new_statement_data,
+            "classification": new_statement_data.get('classification'),
+            "classification_accuracy": classification_accuracy()
         })
 
     return jsonify({"error": "Invalid file type, only PDF is allowed."}), 400
 
-@app.route('/api/chat', methods=['POST'])
-def chat():
-    """Enhanced chat endpoint with comprehensive financial analysis capabilities."""
-    # ** NEW: Get API key from request header **
+@app.route('/api/upload-statements', methods=['POST'])
+@timed('upload_statements_batch')
+def upload_statements_batch():
+    """
+    Batch endpoint: analyzes many PDFs concurrently, then applies every result
+    in one merge pass with a single persist. Returns a status per file.
+    """
     user_api_key = request.headers.get('X-Gemini-API-Key')
     if not user_api_key:
         return jsonify({"error": "Gemini API key is missing. Please provide it in the X-Gemini-API-Key header."}), 400
 
-    data = request.get_json()
-    user_message = data.get('message')
-    if not user_message:
-        return jsonify({"error": "No message provided"}), 400
+    files = [f for f in request.files.getlist('files') if f and f.filename]
+    if not files:
+        return jsonify({"error": "No files provided. Send them as multipart 'files' fields."}), 400
+
+    force_reextract = request.args.get('force_reextract', '').lower() in ('1', 'true', 'yes')
+    user_id, error = _request_user_id()
+    if error:
+        return error
+
+    results = []
+    pending = []
+    for file in files:
+        result = {"filename": file.filename}
+        results.append(result)
+        if not file.filename.endswith('.pdf'):
+            result.update({"status": "failed", "error": "Invalid file type, only PDF is allowed."})
+            continue
+        pending.append((result, file.read()))
+
+    def analyze(item):
+        result, pdf_data = item
+        try:
+            return analyze_pdf_with_smart_detection(pdf_data, result['filename'], user_api_key, force_reextract), None
+        except ValueError as e:
+            return None, (str(e), 401)
+        except Exception as e:
+            print(f"An unexpected error occurred during PDF analysis: {e}")
+            return None, (f"An unexpected server error occurred: {e}", 500)
+
+    if pending:
+        with ThreadPoolExecutor(max_workers=min(UPLOAD_BATCH_MAX_WORKERS, len(pending))) as executor:
+            outcomes = list(executor.map(analyze, pending))
+    else:
+        outcomes = []
+
+    # Apply every successful extraction in one merge pass, in upload order
+    merged_documents = []
+    merged_results = []
+    auth_failures = 0
+    for (result, _), (new_statement_data, error) in zip(pending, outcomes):
+        if error:
+            auth_failures += error[1] == 401
+            result.update({"status": "failed", "error": error[0]})
+        elif not new_statement_data:
+            result.update({
+                "status": "failed",
+                "error": "Failed to extract data from PDF. The PDF may be an image, password-protected, or not a supported bank document format."
+            })
+        else:
+            merged_documents.append(new_statement_data)
+            merged_results.append(result)
+            result.update({
+                "status": "processed",
+                "document_type": new_statement_data.get('document_type', 'unknown'),
+                "classification": new_statement_data.get('classification'),
+                "data": new_statement_data
+            })
+
+    if merged_documents:
+        for result, account in zip(merged_results, merge_and_persist(merged_documents, user_id)):
+            result["account"] = account
+
+    if pending and auth_failures == len(pending):
+        return jsonify({"error": pending[0][0]["error"], "results": results}), 401
 
-    # Load financial data and create comprehensive context
+    processed = sum(1 for r in results if r["status"] == "processed")
+    return jsonify({
+        "message": f"Processed {processed} of {len(results)} files",
+        "results": results,
+        "classification_accuracy": classification_accuracy()
+    })
+
+@app.route('/api/upload-jobs/<job_id>', methods=['GET'])
+def get_upload_job(job_id):
+    """Reports the status of an async upload: queued, running, done or failed."""
+    job = upload_jobs.get(job_id)
+    if not job:
+        return jsonify({"error": "Upload job not found"}), 404
+
+    response = {
+        "job_id": job['job_id'],
+        "filename": job['filename'],
+        "status": job['status'],
+        "created_at": job['created_at'],
+        "updated_at": job['updated_at'],
+        "queue_depth": upload_jobs.depth()
+    }
+    if job['error']:
+        response["error"] = job['error']
+    if job['result'] is not None:
+        response["document_type"] = job['result'].get('document_type', 'unknown')
+        response["account"] = account_of(job['result'])
+        response["classification"] = job['result'].get('classification')
+        response["data"] = job['result']
+    return jsonify(response)
+
+@timed('chat_context')
+def build_chat_prompt(user_message, partition=None):
+    """
+    Builds the full chat prompt from one partition's data. The financial context is
+    narrowed to the sections and transactions relevant to the message (see chat_retrieval.py).
+    """
+    # Load financial aggregates and create comprehensive context
     financial_context = "No financial data has been uploaded yet."
-    raw_financial_data = []
+    holder = None
     
-    if os.path.exists(OUTPUT_JSON_PATH):
-        try:
-            with open(OUTPUT_JSON_PATH, 'r', encoding='utf-8') as f:
-                raw_financial_data = json.load(f)
-                if raw_financial_data:
-                    financial_context = create_comprehensive_financial_context(raw_financial_data)
-        except (json.JSONDecodeError, FileNotFoundError) as e:
-            print(f"Could not read or parse financial data file: {e}")
-            financial_context = "Error: Could not read financial data file."
+    try:
+        # Reuses the context rendered for the current data version, if any
+        cached_context = get_cached_financial_context(partition) if partition else None
+        if cached_context:
+            holder = get_cached_metrics(partition).get('account_holder')
+        if cached_context and CHAT_RETRIEVAL_ENABLED:
+            with span('chat_retrieval'):
+                financial_context = build_retrieval_context(
+                    user_message, cached_context, get_chat_search_index(partition),
+                    CHAT_CONTEXT_TOKEN_BUDGET, CHAT_RETRIEVAL_MAX_TRANSACTIONS
+                )
+        elif cached_context:
+            financial_context = cached_context
+    except Exception as e:
+        print(f"Could not read or parse financial data: {e}")
+        financial_context = "Error: Could not read financial data."
 
     # Enhanced prompt with calculation capabilities
-    prompt = f"""You are SmartFin AI, Moumen's expert financial advisor and analyst. When the user talk normal just chat normal and when give you a tassk do it and ansswer bassed on what he want
+    advisee = f"{holder}'s" if holder else "the user's"
+    prompt = f"""You are SmartFin AI, {advisee} expert financial advisor and analyst. When the user talk normal just chat normal and when give you a tassk do it and ansswer bassed on what he want
 
 You have access to COMPLETE financial data and comprehensive analysis. You can answer ANY financial question with precise calculations and insights.
 
@@ -974,22 +1483,152 @@ User's question: "{user_message}"
 
 Provide a detailed, data-driven answer with specific numbers and insights from the analysis above.
 """
+    return prompt
+
+def _chat_error_message(error):
+    """Maps a model error to the message and status code returned to the client."""
+    # Provide a more specific error for invalid keys
+    if "API_KEY_INVALID" in str(error):
+        return "The provided Gemini API key is invalid. Please check it in the settings.", 401
+    if isinstance(error, RecordingNotFoundError):
+        return "No recorded model response matches this request (LLM_BACKEND=replay).", 503
+    return "Sorry, I couldn't process that request due to a server-side AI error.", 500
+
+def _sse_event(payload, event=None):
+    """Formats a Server-Sent Events message with a JSON payload."""
+    lines = f"event: {event}\n" if event else ""
+    return f"{lines}data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+@app.route('/api/chat', methods=['POST'])
+def chat():
+    """Enhanced chat endpoint with comprehensive financial analysis capabilities."""
+    # ** NEW: Get API key from request header **
+    user_api_key = request.headers.get('X-Gemini-API-Key')
+    if not user_api_key:
+        return jsonify({"error": "Gemini API key is missing. Please provide it in the X-Gemini-API-Key header."}), 400
+
+    data = request.get_json()
+    user_message = data.get('message')
+    if not user_message:
+        return jsonify({"error": "No message provided"}), 400
+
+    partition, error = _request_partition()
+    if error:
+        return error
+    prompt = build_chat_prompt(user_message, partition)
 
     try:
-        # ** NEW: Configure GenAI with the user-provided key for this request **
-        genai.configure(api_key=user_api_key)
-        client = genai.GenerativeModel('gemini-1.5-flash-latest') # Changed to 1.5-flash for consistency
-        response = client.generate_content(
-            prompt,
-            generation_config={"temperature": 0.2}
-        )
+        client = llm_backend.get(user_api_key)
+        with span('chat_model'):
+            response = client.generate_content(
+                prompt,
+                generation_config={"temperature": 0.2}
+            )
         return jsonify({"reply": response.text})
     except Exception as e:
         print(f"Error in chat endpoint: {e}")
-        # Provide a more specific error for invalid keys
-        if "API_KEY_INVALID" in str(e):
-            return jsonify({"error": "The provided Gemini API key is invalid. Please check it in the settings."}), 401
-        return jsonify({"error": "Sorry, I couldn't process that request due to a server-side AI error."}), 500
+        message, status = _chat_error_message(e)
+        return jsonify({"error": message}), status
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    Streaming variant of /api/chat. Sends the reply as Server-Sent Events:
+    'message' events carry text chunks as they arrive from the model, followed
+    by a final 'done' event, or an 'error' event if generation fails.
+    """
+    user_api_key = request.headers.get('X-Gemini-API-Key')
+    if not user_api_key:
+        return jsonify({"error": "Gemini API key is missing. Please provide it in the X-Gemini-API-Key header."}), 400
+
+    data = request.get_json()
+    user_message = data.get('message')
+    if not user_message:
+        return jsonify({"error": "No message provided"}), 400
+
+    partition, error = _request_partition()
+    if error:
+        return error
+    prompt = build_chat_prompt(user_message, partition)
+
+    def generate():
+        response = None
+        try:
+            client = llm_backend.get(user_api_key)
+            # Covers the whole stream, from the request to the last chunk
+            with span('chat_model_stream'):
+                response = client.generate_content(
+                    prompt,
+                    generation_config={"temperature": 0.2},
+                    stream=True
+                )
+                for chunk in response:
+                    text = getattr(chunk, 'text', '')
+                    if text:
+                        yield _sse_event({"text": text})
+            yield _sse_event({}, event="done")
+        except GeneratorExit:
+            # Client disconnected: stop pulling chunks from the model
+            print("--- Chat stream cancelled by client ---")
+            raise
+        except Exception as e:
+            print(f"Error in chat stream endpoint: {e}")
+            message, status = _chat_error_message(e)
+            yield _sse_event({"error": message, "status": status}, event="error")
+        finally:
+            if response is not None and hasattr(response, 'close'):
+                response.close()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Stage latency histograms and counters in the Prometheus text format."""
+    instrumentation = get_instrumentation()
+    if not instrumentation.enabled:
+        return jsonify({"error": "Metrics are disabled. Set METRICS_ENABLED=true to enable them."}), 404
+    return Response(instrumentation.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# --- Startup ---
+# Everything with side effects (rule and metrics configuration, the caches, the
+# LLM backend, the partitions and their legacy migration, the upload job queue)
+# runs in create_app() rather than at import: the PDF text pool's workers
+# re-import the script that started the server and must not repeat it.
+# WSGI servers load the app with "app:create_app()".
+
+def create_app():
+    """Creates the app's shared state (once) and returns the Flask app."""
+    global extraction_cache, llm_backend, partitions, upload_jobs
+    if partitions is not None:
+        return app
+
+    configure_categorizer(CATEGORY_RULES_PATH)
+    configure_instrumentation(METRICS_ENABLED, METRICS_LOG_SPANS)
+    extraction_cache = ExtractionCache(
+        EXTRACTION_CACHE_PATH, EXTRACTION_CACHE_MAX_BYTES, EXTRACTION_CACHE_MAX_AGE_DAYS * 24 * 3600
+    )
+    llm_backend = create_llm_backend(
+        LLM_BACKEND, GEMINI_MODEL_NAME, LLM_RECORDINGS_DIR,
+        pool_options={'max_clients': MODEL_CLIENT_POOL_SIZE, 'ttl_seconds': MODEL_CLIENT_TTL_SECONDS},
+        latency_seconds=MOCK_LLM_LATENCY_MS / 1000, jitter_seconds=MOCK_LLM_JITTER_MS / 1000,
+        transactions=MOCK_LLM_TRANSACTIONS
+    )
+    # Each partition coalesces its concurrent uploads (see Partition.merge_writer):
+    # one of them merges the whole queue and saves once.
+    partitions = PartitionRegistry(
+        PARTITIONS_DIR, STORAGE_BACKEND, _merge_and_save, PARTITION_CACHE_SIZE,
+        segment_max_bytes=LOG_SEGMENT_MAX_BYTES, compact_threshold_bytes=LOG_COMPACT_THRESHOLD_BYTES
+    )
+    _migrate_legacy_store()
+    upload_jobs = UploadJobQueue(
+        UPLOAD_JOBS_DB_PATH, _process_upload_job, UPLOAD_JOB_WORKERS, UPLOAD_JOB_MAX_QUEUE,
+        retention_seconds=UPLOAD_JOB_RETENTION_SECONDS
+    )
+    return app
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5001)
\ No newline at end of file
+    create_app().run(debug=True, port=5001)
\ No newline at end of file
@@ -0,0 +1,238 @@
+import re
+from datetime import datetime
+
+# --- Local Attijariwafa Parser ---
+# Rule-based extraction for the two well-structured Attijariwafa layouts
+# (monthly statements and "Mouvement du compte" transaction lists), working on
+# the PyPDF2 text. It produces the same JSON as the extraction prompts, and a
+# result is only returned when the transactions reconcile with the balances
+# and totals printed on the document; anything else (including a transaction
+# list that prints no starting balance to check against) raises
+# StatementParseError so the caller can fall back to the model.
+
+AMOUNT = r'-?\d{1,3}(?:[ .\u00a0]\d{3})*,\d{2}'
+
+_AMOUNT_PATTERN = re.compile(AMOUNT)
+_PERIOD_PATTERN = re.compile(r'\bDU\s+(\d{2}/\d{2}/\d{4})\s+AU\s+(\d{2}/\d{2}/\d{4})', re.IGNORECASE)
+_ACCOUNT_PATTERN = re.compile(r'(?:N°|NUMERO(?: DE)?|NUM)\s*(?:DE\s+)?COMPTE\s*:?\s*(\d[\d ]{9,}\d)', re.IGNORECASE)
+_RIB_PATTERN = re.compile(r'\b(\d{3}\s?\d{3}\s?\d{16}\s?\d{2})\b')
+_AGENCY_PATTERN = re.compile(r'AGENCE\s*:?\s*([^\n]+)', re.IGNORECASE)
+_OPENING_PATTERN = re.compile(r'SOLDE DEPART[^\n]*?(' + AMOUNT + r')\s*(DEBITEUR|CREDITEUR)?', re.IGNORECASE)
+_CLOSING_PATTERN = re.compile(r'SOLDE FINAL[^\n]*?(' + AMOUNT + r')\s*(DEBITEUR|CREDITEUR)?', re.IGNORECASE)
+_TOTALS_PATTERN = re.compile(r'TOTAL MOUVEMENTS[^\n]*?(' + AMOUNT + r')\s+(' + AMOUNT + r')', re.IGNORECASE)
+_REAL_BALANCE_PATTERN = re.compile(r'SOLDE R[EÉ]EL[^\n]*?(' + AMOUNT + r')', re.IGNORECASE)
+_LIST_OPENING_PATTERN = re.compile(
+    r'(?:ANCIEN SOLDE|SOLDE INITIAL|SOLDE D[EÉ]PART|SOLDE AU \d{2}/\d{2}/\d{4})[^\n]*?(' + AMOUNT + r')\s*(DEBITEUR|CREDITEUR)?',
+    re.IGNORECASE
+)
+# "Titulaire : NAME", "Intitulé du compte : NAME", or an address block line "M. NAME"
+_HOLDER_PATTERN = re.compile(
+    r'^\s*(?:(?:TITULAIRE|INTITUL[EÉ](?: DU COMPTE)?)\s*:?\s*|(?:M\.|MR\.?|MME\.?|MLLE\.?|MONSIEUR|MADAME)\s+)'
+    r'([A-ZÀ-Ÿ][A-ZÀ-Ÿ\'. -]{2,60}?)\s*$',
+    re.IGNORECASE | re.MULTILINE
+)
+
+# Monthly statement line: "05 01 PAIEMENT CB MARJANE 05 01 2024 250,00"
+_STATEMENT_LINE_PATTERN = re.compile(
+    r'^(\d{2})\s?(\d{2})\s+(.+?)\s+(\d{2})\s?(\d{2})\s?(\d{4})\s+(' + AMOUNT + r')$'
+)
+# Transaction list line: "05/01/2024 PAIEMENT CB MARJANE [05/01/2024] -250,00 [MAD]"
+_LIST_LINE_PATTERN = re.compile(
+    r'^(\d{2}/\d{2}/\d{4})\s+(.+?)(?:\s+(\d{2}/\d{2}/\d{4}))?\s+(' + AMOUNT + r')(?:\s*(?:MAD|DH))?$'
+)
+_DATED_LINE_PATTERN = re.compile(r'^\d{2}(?:\s?\d{2}\s|/\d{2}/\d{4}\s)')
+
+# Monthly statements print debits and credits in separate columns, which the
+# text layer does not keep; credits are recognized by their wording instead
+# and the balance check rejects any wrong guess.
+CREDIT_KEYWORDS = (
+    'VIREMENT RECU', 'VIR RECU', 'VIR.RECU', 'VIREMENT EN VOTRE FAVEUR', 'VIR EN VOTRE FAVEUR',
+    'VERSEMENT', 'REMISE', 'SALAIRE', 'ANNULATION', 'RETOUR', 'INTERETS CREDITEURS', 'REMBOURSEMENT',
+)
+
+class StatementParseError(ValueError):
+    """The text is not a supported layout or does not reconcile with its balances."""
+
+def parse_amount(text):
+    """Parses a French-formatted amount such as '1 234,56' or '-1.234,56'."""
+    cleaned = re.sub(r'[ .\u00a0]', '', text).replace(',', '.')
+    return float(cleaned)
+
+def _iso_date(value):
+    return datetime.strptime(value, '%d/%m/%Y').strftime('%Y-%m-%d')
+
+def _cents(value):
+    return round((value or 0) * 100)
+
+def _signed_balance(match):
+    amount = parse_amount(match.group(1))
+    return -abs(amount) if (match.group(2) or '').upper() == 'DEBITEUR' else amount
+
+def _base_document(document_type, text):
+    account = _ACCOUNT_PATTERN.search(text)
+    rib = _RIB_PATTERN.search(text)
+    agency = _AGENCY_PATTERN.search(text)
+    period = _PERIOD_PATTERN.search(text)
+    holder = _HOLDER_PATTERN.search(text)
+    return {
+        'document_type': document_type,
+        'bank_name': 'Attijariwafa bank',
+        'agency': agency.group(1).strip() if agency else None,
+        'account_holder': {'name': holder.group(1).strip() if holder else None, 'address': None},
+        'account_details': {
+            'account_number': account.group(1).replace(' ', '') if account else None,
+            'full_bank_id': rib.group(1).replace(' ', '') if rib else None,
+            'currency': 'MAD',
+        },
+        'statement_period': {
+            'start_date': _iso_date(period.group(1)) if period else None,
+            'end_date': _iso_date(period.group(2)) if period else None,
+        },
+        'summary': {},
+        'transactions': [],
+    }
+
+def _operation_year(month, period):
+    start, end = period.get('start_date'), period.get('end_date')
+    if not start or not end:
+        raise StatementParseError("Statement period not found.")
+    start_year, end_year = int(start[:4]), int(end[:4])
+    if start_year == end_year:
+        return start_year
+    return end_year if month <= int(end[5:7]) else start_year
+
+def parse_monthly_statement(text):
+    """Parses a monthly statement and checks it against its balances and totals."""
+    document = _base_document('monthly_statement', text)
+    opening = _OPENING_PATTERN.search(text)
+    closing = _CLOSING_PATTERN.search(text)
+    if not opening or not closing:
+        raise StatementParseError("Opening or closing balance not found.")
+
+    unparsed = 0
+    for line in text.splitlines():
+        line = line.strip()
+        match = _STATEMENT_LINE_PATTERN.match(line)
+        if not match:
+            if _DATED_LINE_PATTERN.match(line) and _AMOUNT_PATTERN.search(line):
+                unparsed += 1
+            continue
+        day, month, description, value_day, value_month, value_year, amount = match.groups()
+        year = _operation_year(int(month), document['statement_period'])
+        amount = parse_amount(amount)
+        is_credit = any(keyword in description.upper() for keyword in CREDIT_KEYWORDS)
+        document['transactions'].append({
+            'transaction_date': f"{year}-{month}-{day}",
+            'value_date': f"{value_year}-{value_month}-{value_day}",
+            'description': description.strip(),
+            'debit': None if is_credit else amount,
+            'credit': amount if is_credit else None,
+        })
+
+    if unparsed:
+        raise StatementParseError(f"{unparsed} transaction line(s) could not be parsed.")
+
+    document['summary'] = {
+        'opening_balance': _signed_balance(opening),
+        'closing_balance': _signed_balance(closing),
+        'total_debits': sum(t['debit'] or 0 for t in document['transactions']),
+        'total_credits': sum(t['credit'] or 0 for t in document['transactions']),
+    }
+    totals = _TOTALS_PATTERN.search(text)
+    if totals:
+        printed_debits, printed_credits = parse_amount(totals.group(1)), parse_amount(totals.group(2))
+        if (_cents(printed_debits), _cents(printed_credits)) != (
+                _cents(document['summary']['total_debits']), _cents(document['summary']['total_credits'])):
+            raise StatementParseError("Transaction totals do not match TOTAL MOUVEMENTS.")
+    return document
+
+def parse_transaction_list(text):
+    """
+    Parses a 'Mouvement du compte' transaction list with signed amounts, and
+    checks it against its starting balance and its real balance.
+    """
+    document = _base_document('transaction_list', text)
+    opening = _LIST_OPENING_PATTERN.search(text)
+    real_balance = _REAL_BALANCE_PATTERN.search(text)
+    if not opening or not real_balance:
+        raise StatementParseError("Transaction list has no starting and real balance to reconcile against.")
+
+    unparsed = 0
+    for line in text.splitlines():
+        line = line.strip()
+        match = _LIST_LINE_PATTERN.match(line)
+        if not match:
+            # Includes dated lines whose amount wrapped onto the next line
+            if _DATED_LINE_PATTERN.match(line):
+                unparsed += 1
+            continue
+        operation_date, description, value_date, amount = match.groups()
+        amount = parse_amount(amount)
+        document['transactions'].append({
+            'transaction_date': _iso_date(operation_date),
+            'value_date': _iso_date(value_date) if value_date else None,
+            'description': description.strip(),
+            'debit': -amount if amount < 0 else None,
+            'credit': amount if amount >= 0 else None,
+        })
+
+    if unparsed:
+        raise StatementParseError(f"{unparsed} transaction line(s) could not be parsed.")
+
+    # Transaction lists report no opening balance (see the extraction prompt);
+    # the starting balance is only used for the check
+    document['summary'] = {
+        'opening_balance': None,
+        'closing_balance': parse_amount(real_balance.group(1)),
+        'total_debits': sum(t['debit'] or 0 for t in document['transactions']),
+        'total_credits': sum(t['credit'] or 0 for t in document['transactions']),
+    }
+    expected = (_cents(_signed_balance(opening)) - _cents(document['summary']['total_debits'])
+                + _cents(document['summary']['total_credits']))
+    if expected != _cents(document['summary']['closing_balance']):
+        raise StatementParseError("Starting balance plus movements does not equal the real balance.")
+    return document
+
+def validate_statement(document):
+    """Returns a list of problems; an empty list means the document reconciles."""
+    problems = []
+    transactions = document.get('transactions') or []
+    summary = document.get('summary') or {}
+    if not transactions:
+        problems.append("No transactions found.")
+
+    for transaction in transactions:
+        if bool(transaction.get('debit')) == bool(transaction.get('credit')):
+            problems.append(f"Transaction without a single amount: {transaction.get('description')!r}")
+
+    period = document.get('statement_period') or {}
+    start, end = period.get('start_date'), period.get('end_date')
+    if start and end:
+        outside = [t for t in transactions if not start <= (t.get('transaction_date') or '') <= end]
+        if outside:
+            problems.append(f"{len(outside)} transaction(s) fall outside the statement period.")
+
+    if document.get('document_type') == 'monthly_statement':
+        expected = (_cents(summary.get('opening_balance')) - _cents(summary.get('total_debits'))
+                    + _cents(summary.get('total_credits')))
+        if expected != _cents(summary.get('closing_balance')):
+            problems.append("Opening balance plus movements does not equal the closing balance.")
+    return problems
+
+def parse_statement(text, pdf_type):
+    """
+    Parses statement text of the given type ('monthly_statement' or
+    'transaction_list'). Raises StatementParseError when the layout is not
+    supported or the result does not validate.
+    """
+    if pdf_type == 'monthly_statement':
+        document = parse_monthly_statement(text)
+    elif pdf_type == 'transaction_list':
+        document = parse_transaction_list(text)
+    else:
+        raise StatementParseError(f"No local parser for document type '{pdf_type}'.")
+
+    problems = validate_statement(document)
+    if problems:
+        raise StatementParseError("; ".join(problems))
+    return document
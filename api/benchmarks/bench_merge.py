@@ -0,0 +1,70 @@
+"""
+Benchmark for smart_merge_data: merge cost as the stored history grows.
+
+Run from the api/ directory:
+    python benchmarks/bench_merge.py
+"""
+import os
+import sys
+import copy
+import time
+import tempfile
+import contextlib
+import io
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+app = None  # imported by main(), from a scratch working directory
+
+def make_statement(month_index, transactions_per_statement):
+    year, month = 2015 + month_index // 12, month_index % 12 + 1
+    transactions = [
+        {
+            "transaction_date": f"{year}-{month:02d}-{day % 28 + 1:02d}",
+            "value_date": f"{year}-{month:02d}-{day % 28 + 1:02d}",
+            "description": f"PAIEMENT CB MARCHAND {day}",
+            "debit": float(day % 97 + 1),
+            "credit": None,
+        }
+        for day in range(transactions_per_statement)
+    ]
+    return {
+        "document_type": "monthly_statement",
+        "statement_period": {"start_date": f"{year}-{month:02d}-01", "end_date": f"{year}-{month:02d}-28"},
+        "summary": {"opening_balance": 0.0, "closing_balance": 0.0, "total_debits": 0.0, "total_credits": 0.0},
+        "transactions": transactions,
+        "source_file_hash": f"statement-{month_index}",
+    }
+
+def bench(history_months, transactions_per_statement, repeats=5):
+    history = [make_statement(i, transactions_per_statement) for i in range(history_months)]
+    latest = history[-1]
+    transaction_list = {
+        "document_type": "transaction_list",
+        "statement_period": dict(latest["statement_period"]),
+        "summary": {"opening_balance": None, "closing_balance": 0.0, "total_debits": 0.0, "total_credits": 0.0},
+        "transactions": copy.deepcopy(latest["transactions"]),
+        "source_file_hash": "transaction-list",
+    }
+
+    timings = []
+    for _ in range(repeats):
+        documents = copy.deepcopy(history)
+        new_document = copy.deepcopy(transaction_list)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            app.smart_merge_data(documents, new_document, [])
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def main():
+    global app
+    os.chdir(tempfile.mkdtemp())  # app creates its databases in the working directory
+    import app
+    app.create_app()
+    print(f"{'months':>8} {'txns/stmt':>10} {'merge (ms)':>12}")
+    for months, per_statement in [(12, 200), (60, 200), (120, 200), (12, 2000), (60, 2000), (120, 2000)]:
+        print(f"{months:>8} {per_statement:>10} {bench(months, per_statement) * 1000:>12.2f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+"""
+Benchmark suite for the hot paths, on synthetic data (see synthetic.py).
+
+Covers calculate_comprehensive_metrics, create_comprehensive_financial_context,
+smart_merge_data, post_process_extracted_data and the data endpoints through
+the Flask test client. Every benchmark reports its best and mean time over the
+repeats and its peak traced memory (from a separate run under tracemalloc).
+
+Run from the api/ directory:
+    python benchmarks/run_benchmarks.py                      # 1k and 100k transactions
+    python benchmarks/run_benchmarks.py --sizes 1k,100k,1m --repeats 1   # opt in to 1M
+    python benchmarks/run_benchmarks.py --compare benchmarks/results/<earlier run>.json
+
+Each run is stored as benchmarks/results/<timestamp>.json.
+"""
+import os
+import sys
+import io
+import json
+import copy
+import time
+import platform
+import argparse
+import tempfile
+import contextlib
+import subprocess
+import tracemalloc
+from datetime import datetime
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, "results")
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from partitions import PartitionRegistry  # noqa: E402
+from synthetic import count_transactions, generate_documents  # noqa: E402
+
+app = None  # imported by main(), from a scratch working directory
+
+SIZES = {"1k": 1_000, "10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+BENCHMARK_USER = "benchmark"
+HEADERS = {"X-User-ID": BENCHMARK_USER}
+
+def measure(run, setup=None, repeats=3):
+    """Times run(setup()) repeats times, then traces one more call for peak memory."""
+    timings = []
+    for _ in range(repeats):
+        argument = setup() if setup else None
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            run(argument)
+            timings.append(time.perf_counter() - start)
+
+    argument = setup() if setup else None
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            run(argument)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "best_ms": round(min(timings) * 1000, 3),
+        "mean_ms": round(sum(timings) / len(timings) * 1000, 3),
+        "peak_memory_mb": round(peak / (1024 * 1024), 3),
+    }
+
+def _overlapping_transaction_list(documents):
+    """A new transaction list overlapping the latest statement, to exercise the merge path."""
+    position = max(
+        (i for i, d in enumerate(documents) if d["document_type"] == "monthly_statement"),
+        key=lambda i: documents[i]["statement_period"]["end_date"]
+    )
+    statement = documents[position]
+    new_list = copy.deepcopy(statement)
+    new_list["document_type"] = "transaction_list"
+    new_list["source_file_hash"] = "benchmark-new-transaction-list"
+    for transaction in new_list["transactions"][::2]:
+        transaction["description"] += " BIS"
+    return position, new_list
+
+def _load_partition(documents):
+    """
+    Points the app at fresh SQLite partitions, with every document in one
+    partition of the benchmark user so sizes stay comparable across runs.
+    """
+    app.partitions = PartitionRegistry(tempfile.mkdtemp(), "sqlite", app._merge_and_save)
+    partition = app.partitions.get(BENCHMARK_USER, "all")
+    with contextlib.redirect_stdout(io.StringIO()):
+        partition.storage.save_changes(documents, [("insert", d) for d in documents])
+
+def run_size(total_transactions, repeats):
+    documents = generate_documents(total_transactions)
+    results = {}
+
+    results["calculate_comprehensive_metrics"] = measure(
+        lambda _: app.calculate_comprehensive_metrics(documents), repeats=repeats
+    )
+    results["create_comprehensive_financial_context"] = measure(
+        lambda _: app.create_comprehensive_financial_context(documents), repeats=repeats
+    )
+
+    position, new_list = _overlapping_transaction_list(documents)
+    def merge_setup():
+        history = list(documents)
+        history[position] = copy.deepcopy(documents[position])
+        return history, copy.deepcopy(new_list)
+    results["smart_merge_data"] = measure(
+        lambda args: app.smart_merge_data(args[0], args[1], []), setup=merge_setup, repeats=repeats
+    )
+    results["post_process_extracted_data"] = measure(
+        lambda _: [app.post_process_extracted_data(d) for d in documents], repeats=repeats
+    )
+
+    _load_partition(documents)
+    client = app.app.test_client()
+    start = time.perf_counter()
+    client.get("/api/get-financial-metrics", headers=HEADERS)
+    results["GET /api/get-financial-metrics (cold)"] = {
+        "best_ms": round((time.perf_counter() - start) * 1000, 3), "mean_ms": None, "peak_memory_mb": None
+    }
+    endpoints = [
+        "/api/get-financial-metrics",
+        "/api/get-financial-metrics?lean=true",
+        "/api/get-financial-data",
+        "/api/transactions?limit=50",
+        "/api/transactions?type=debit&category=CASH_WITHDRAWALS&limit=50",
+    ]
+    for url in endpoints:
+        results[f"GET {url}"] = measure(lambda _, url=url: client.get(url, headers=HEADERS).get_data(), repeats=repeats)
+    etag = client.get("/api/get-financial-data", headers=HEADERS).headers.get("ETag")
+    if etag:
+        results["GET /api/get-financial-data (304)"] = measure(
+            lambda _: client.get("/api/get-financial-data", headers={**HEADERS, "If-None-Match": etag}),
+            repeats=repeats
+        )
+
+    return {
+        "transactions": count_transactions(documents),
+        "documents": len(documents),
+        "benchmarks": results,
+    }
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BENCHMARKS_DIR, capture_output=True, text=True
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+def print_results(run, baseline=None):
+    for size, size_results in run["sizes"].items():
+        print(f"\n=== {size}: {size_results['transactions']} transactions, {size_results['documents']} documents ===")
+        print(f"{'benchmark':<66} {'best (ms)':>12} {'mean (ms)':>12} {'peak (MB)':>10} {'vs base':>8}")
+        base = (baseline or {}).get("sizes", {}).get(size, {}).get("benchmarks", {})
+        for name, result in size_results["benchmarks"].items():
+            ratio = ""
+            if name in base and base[name]["best_ms"]:
+                ratio = f"{result['best_ms'] / base[name]['best_ms']:.2f}x"
+            mean = f"{result['mean_ms']:.3f}" if result["mean_ms"] is not None else "-"
+            peak = f"{result['peak_memory_mb']:.2f}" if result["peak_memory_mb"] is not None else "-"
+            print(f"{name:<66} {result['best_ms']:>12.3f} {mean:>12} {peak:>10} {ratio:>8}")
+
+def main():
+    global app
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1k,100k", help="comma-separated sizes (1m is slow and opt-in): " + ", ".join(SIZES))
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+
+    os.chdir(tempfile.mkdtemp())  # app creates its databases in the working directory
+    import app
+    app.create_app()
+
+    run = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeats": args.repeats,
+        "sizes": {},
+    }
+    for size in [s.strip().lower() for s in args.sizes.split(",") if s.strip()]:
+        if size not in SIZES:
+            parser.error(f"unknown size '{size}'")
+        print(f"--- Running {size} ({SIZES[size]} transactions) ---")
+        run["sizes"][size] = run_size(SIZES[size], args.repeats)
+
+    baseline = None
+    if compare_path:
+        with open(compare_path, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_results(run, baseline)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(run, f, indent=2)
+    print(f"\n--- ✅ Results stored in {path} ---")
+
+if __name__ == "__main__":
+    main()
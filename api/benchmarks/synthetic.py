@@ -0,0 +1,138 @@
+"""
+Synthetic Attijariwafa documents in the exact schema of the extraction prompts.
+
+generate_documents(total_transactions) returns monthly statements plus
+transaction lists whose periods overlap the statements (and repeat some of
+their transactions), spread over as many accounts as needed to keep every
+account to ten years of history. Output is deterministic for a given seed.
+"""
+import random
+import hashlib
+import calendar
+
+MONTHS_PER_ACCOUNT = 120
+
+# (description template, debit range, credit range); one of the ranges is None
+MERCHANTS = [
+    ("PAIEMENT CB MARJANE {ddmm}", (80, 1500), None),
+    ("PAIEMENT CB CARREFOUR {ddmm}", (50, 1200), None),
+    ("PAIEMENT CB GLOVO {ddmm}", (40, 300), None),
+    ("PAIEMENT CB NETFLIX.COM {ddmm}", (65, 65), None),
+    ("RETRAIT GAB {ddmm} {hhmm}", (100, 2000), None),
+    ("RETRAIT GAB HORS RESEAU {ddmm} {hhmm}", (200, 1000), None),
+    ("RECHARGE INWI {ddmm}", (20, 200), None),
+    ("FACTURE IAM MOBILE", (99, 349), None),
+    ("ORANGE MAROC PAIEMENT", (49, 299), None),
+    ("PRELEVEMENT LYDEC", (150, 900), None),
+    ("VIREMENT EMIS VERS LOYER", (3000, 6000), None),
+    ("FRAIS TENUE DE COMPTE", (15, 15), None),
+    ("COMMISSION SUR VIREMENT", (5, 13), None),
+    ("TIMBRE", (2, 2), None),
+    ("VIREMENT RECU SALAIRE", None, (9000, 18000)),
+    ("VIREMENT RECU DE PARTICULIER", None, (200, 3000)),
+    ("VERSEMENT ESPECES", None, (500, 5000)),
+]
+
+def _amount(rng, bounds):
+    low, high = bounds
+    return round(rng.uniform(low, high), 2) if low != high else float(low)
+
+def _transaction(rng, year, month):
+    day = rng.randint(1, calendar.monthrange(year, month)[1])
+    template, debit_range, credit_range = rng.choice(MERCHANTS)
+    date = f"{year}-{month:02d}-{day:02d}"
+    description = template.format(
+        ddmm=f"{day:02d}/{month:02d}", hhmm=f"{rng.randint(0, 23):02d}H{rng.randint(0, 59):02d}"
+    )
+    return {
+        "transaction_date": date,
+        "value_date": date,
+        "description": description,
+        "debit": _amount(rng, debit_range) if debit_range else None,
+        "credit": _amount(rng, credit_range) if credit_range else None,
+    }
+
+def _header(document_type, account_number):
+    return {
+        "document_type": document_type,
+        "bank_name": "Attijariwafa bank",
+        "agency": "CASABLANCA MAARIF",
+        "account_holder": {"name": "MOUMEN", "address": "CASABLANCA"},
+        "account_details": {
+            "account_number": account_number,
+            "full_bank_id": f"007780{account_number}",
+            "currency": "MAD",
+        },
+    }
+
+def _file_hash(*parts):
+    return hashlib.sha256(":".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+def generate_documents(total_transactions, transactions_per_statement=250, list_every=3, seed=0):
+    """
+    Returns documents holding about total_transactions statement transactions.
+    Every list_every-th month also gets a transaction list spanning the end of
+    that month and the start of the next one.
+    """
+    rng = random.Random(seed)
+    statements = max(1, round(total_transactions / transactions_per_statement))
+    documents = []
+    balance = 0.0
+
+    for index in range(statements):
+        account, month_index = divmod(index, MONTHS_PER_ACCOUNT)
+        if month_index == 0:
+            balance = round(rng.uniform(5000, 50000), 2)
+        account_number = f"{account + 1:016d}"
+        year, month = 2015 + month_index // 12, month_index % 12 + 1
+        last_day = calendar.monthrange(year, month)[1]
+
+        transactions = sorted(
+            (_transaction(rng, year, month) for _ in range(transactions_per_statement)),
+            key=lambda t: t["transaction_date"]
+        )
+        total_debits = round(sum(t["debit"] or 0 for t in transactions), 2)
+        total_credits = round(sum(t["credit"] or 0 for t in transactions), 2)
+        opening = balance
+        balance = round(opening - total_debits + total_credits, 2)
+
+        statement = _header("monthly_statement", account_number)
+        statement.update({
+            "statement_period": {"start_date": f"{year}-{month:02d}-01", "end_date": f"{year}-{month:02d}-{last_day}"},
+            "summary": {
+                "opening_balance": opening, "closing_balance": balance,
+                "total_debits": total_debits, "total_credits": total_credits,
+            },
+            "transactions": transactions,
+            "source_file_hash": _file_hash("statement", seed, account_number, year, month),
+            "source_file_name": f"releve_{account_number}_{year}_{month:02d}.pdf",
+        })
+        documents.append(statement)
+
+        if month_index % list_every == list_every - 1:
+            next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+            repeated = [dict(t) for t in transactions if t["transaction_date"] >= f"{year}-{month:02d}-20"]
+            fresh = [_transaction(rng, next_year, next_month) for _ in range(transactions_per_statement // 10)]
+            list_transactions = sorted(repeated + fresh, key=lambda t: t["transaction_date"])
+            transaction_list = _header("transaction_list", account_number)
+            transaction_list.update({
+                "statement_period": {
+                    "start_date": f"{year}-{month:02d}-20",
+                    "end_date": max(t["transaction_date"] for t in list_transactions),
+                },
+                "summary": {
+                    "opening_balance": None, "closing_balance": None,
+                    "total_debits": round(sum(t["debit"] or 0 for t in list_transactions), 2),
+                    "total_credits": round(sum(t["credit"] or 0 for t in list_transactions), 2),
+                },
+                "transactions": list_transactions,
+                "source_file_hash": _file_hash("list", seed, account_number, year, month),
+                "source_file_name": f"mouvements_{account_number}_{year}_{month:02d}.pdf",
+            })
+            documents.append(transaction_list)
+
+    return documents
+
+def count_transactions(documents):
+    """Total number of transactions across documents."""
+    return sum(len(d.get("transactions") or []) for d in documents)
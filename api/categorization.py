@@ -0,0 +1,136 @@
+import os
+import re
+import json
+import hashlib
+from functools import lru_cache
+
+# --- Expense Categorization ---
+# Categories come from a rule table: each rule maps a set of keywords to a
+# category with a priority. All keywords are compiled into one regex that scans
+# a description once; when several rules match, the highest priority wins
+# (ties go to the rule listed first). Results are cached per description.
+#
+# User rules can be supplied as JSON (see CATEGORY_RULES_PATH in app.py):
+#   {
+#     "replace_defaults": false,
+#     "default_category": "OTHER",
+#     "rules": [{"category": "GROCERIES", "keywords": ["MARJANE", "CARREFOUR"], "priority": 60}]
+#   }
+# A user rule without a priority gets USER_RULE_PRIORITY, above every default
+# rule, so "GROCERIES: MARJANE" wins over CARD_PAYMENTS on "PAIEMENT CB MARJANE".
+
+DEFAULT_CATEGORY = 'OTHER'
+
+# Equivalent to the original keyword chain: earlier checks have higher priority.
+DEFAULT_CATEGORY_RULES = [
+    {'category': 'TELECOMMUNICATIONS', 'keywords': ['INWI', 'IAM', 'ORANGE'], 'priority': 50},
+    {'category': 'CASH_WITHDRAWALS', 'keywords': ['GAB', 'RETRAIT', 'ATM'], 'priority': 40},
+    {'category': 'TRANSFERS', 'keywords': ['VIREMENT', 'TRANSFER'], 'priority': 30},
+    {'category': 'BANK_FEES', 'keywords': ['COMMISSION', 'FRAIS', 'TIMBRE'], 'priority': 20},
+    {'category': 'CARD_PAYMENTS', 'keywords': ['PAIEMENT', 'CB'], 'priority': 10},
+]
+
+# Priority of user rules that do not set one (above the highest default rule)
+USER_RULE_PRIORITY = 100
+
+CATEGORY_CACHE_SIZE = 65536
+
+class Categorizer:
+    """Compiled multi-keyword matcher over a prioritized rule table."""
+
+    def __init__(self, rules, default_category=DEFAULT_CATEGORY):
+        self.rules = [
+            {
+                'category': str(rule['category']).upper(),
+                'keywords': [str(k).upper() for k in rule.get('keywords', []) if str(k)],
+                'priority': rule.get('priority', 0),
+            }
+            for rule in rules
+        ]
+        self.default_category = default_category
+
+        # Each keyword keeps the best (priority, rule order) of the rules listing it
+        ranked = {}
+        for order, rule in enumerate(self.rules):
+            rank = (-rule['priority'], order)
+            for keyword in rule['keywords']:
+                if keyword not in ranked or rank < ranked[keyword][0]:
+                    ranked[keyword] = (rank, rule['category'])
+        keywords = sorted(ranked, key=lambda k: (ranked[k][0], -len(k)))
+        self._ranks = {k: ranked[k] for k in keywords}
+
+        # A lookahead reports, at every position, the best-ranked keyword starting
+        # there, so overlapping keywords are never hidden by each other.
+        self._pattern = (
+            re.compile('(?=(' + '|'.join(re.escape(k) for k in keywords) + '))') if keywords else None
+        )
+        self._categorize_cached = lru_cache(maxsize=CATEGORY_CACHE_SIZE)(self._categorize)
+
+        payload = json.dumps([self.rules, self.default_category], sort_keys=True)
+        self.fingerprint = hashlib.sha256(payload.encode('utf-8')).hexdigest()[:12]
+
+    def _categorize(self, description):
+        if self._pattern is None:
+            return self.default_category
+        best = None
+        for match in self._pattern.finditer(description):
+            rank = self._ranks[match.group(1)]
+            if best is None or rank[0] < best[0]:
+                best = rank
+        return best[1] if best else self.default_category
+
+    def categorize(self, description):
+        """Returns the category for a transaction description."""
+        return self._categorize_cached((description or '').upper())
+
+    def categories(self):
+        """All categories this rule table can produce, including the default."""
+        names = []
+        for rule in self.rules:
+            if rule['category'] not in names:
+                names.append(rule['category'])
+        if self.default_category not in names:
+            names.append(self.default_category)
+        return names
+
+
+def load_categorizer(rules_path=None):
+    """Builds a Categorizer from the defaults plus an optional JSON rule file."""
+    rules = list(DEFAULT_CATEGORY_RULES)
+    default_category = DEFAULT_CATEGORY
+
+    if rules_path and os.path.exists(rules_path):
+        try:
+            with open(rules_path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            raise ValueError(f"Could not load category rules from '{rules_path}': {e}")
+
+        user_rules = config.get('rules', [])
+        for rule in user_rules:
+            if not rule.get('category') or not rule.get('keywords'):
+                raise ValueError(f"Invalid category rule {rule!r}: 'category' and 'keywords' are required.")
+            priority = rule.get('priority')
+            if priority is not None and (isinstance(priority, bool) or not isinstance(priority, (int, float))):
+                raise ValueError(f"Invalid category rule {rule!r}: 'priority' must be a number.")
+        user_rules = [
+            dict(rule, priority=USER_RULE_PRIORITY if rule.get('priority') is None else rule['priority'])
+            for rule in user_rules
+        ]
+        rules = user_rules if config.get('replace_defaults') else user_rules + rules
+        default_category = str(config.get('default_category', DEFAULT_CATEGORY)).upper()
+
+    return Categorizer(rules, default_category)
+
+
+_active_categorizer = Categorizer(DEFAULT_CATEGORY_RULES)
+
+def configure_categorizer(rules_path=None):
+    """Replaces the process-wide categorizer with one built from rules_path."""
+    global _active_categorizer
+    _active_categorizer = load_categorizer(rules_path)
+    return _active_categorizer
+
+def get_categorizer():
+    """Returns the process-wide categorizer."""
+    return _active_categorizer
@@ -0,0 +1,380 @@
+import re
+import math
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+
+from financial_aggregates import document_key
+
+# --- Chat Retrieval ---
+# Instead of pasting the whole financial context into every chat prompt, the
+# question is matched against:
+#   - a BM25 inverted index over normalized transaction descriptions, with
+#     month and amount facets (dates, "over 1000 MAD", "income" vs "spent")
+#   - the '### ' sections of the rendered financial context
+# and only the best sections and transactions are kept, within a token budget.
+# The index is updated per changed document after each merge, so an upload
+# costs the size of the uploaded statements, not of the whole history.
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Terms found in more than this share of transactions are skipped when rarer terms matched
+COMMON_TERM_SHARE = 0.5
+
+STOPWORDS = {
+    'A', 'AN', 'THE', 'OF', 'ON', 'IN', 'AT', 'TO', 'FOR', 'AND', 'OR', 'MY', 'ME', 'I', 'IS', 'ARE',
+    'DID', 'DO', 'HOW', 'MUCH', 'MANY', 'WHAT', 'WHEN', 'WHERE', 'WHICH', 'WITH', 'FROM', 'THAT', 'THIS',
+    'WAS', 'WERE', 'CAN', 'YOU', 'SHOW', 'LIST', 'GIVE', 'ALL', 'ANY', 'PLEASE', 'THAN', 'MORE', 'LESS',
+    'OVER', 'UNDER', 'ABOVE', 'BELOW',
+    'DE', 'DU', 'DES', 'LA', 'LE', 'LES', 'ET', 'EN', 'AU', 'AUX', 'UN', 'UNE', 'POUR', 'PAR', 'SUR',
+    'MAD', 'DH', 'DHS',
+}
+
+# English question words mapped to the French wording of Attijariwafa descriptions
+SYNONYMS = {
+    'WITHDRAWAL': ('RETRAIT',), 'ATM': ('RETRAIT', 'GAB'), 'CASH': ('RETRAIT', 'ESPECE'),
+    'SALARY': ('SALAIRE',), 'TRANSFER': ('VIREMENT',), 'FEE': ('FRAI', 'COMMISSION'),
+    'CARD': ('CB', 'CARTE'), 'RENT': ('LOYER',), 'DEPOSIT': ('VERSEMENT',),
+    'ELECTRICITY': ('LYDEC',), 'WATER': ('LYDEC',), 'PHONE': ('IAM', 'INWI', 'ORANGE'),
+    'TOPUP': ('RECHARGE',), 'DIRECT': ('PRELEVEMENT',), 'STAMP': ('TIMBRE',),
+}
+
+CREDIT_WORDS = {'INCOME', 'EARN', 'EARNED', 'RECEIVED', 'RECEIVE', 'CREDIT', 'CREDITS', 'SALARY', 'REVENU', 'DEPOSIT'}
+DEBIT_WORDS = {'SPEND', 'SPENT', 'PAID', 'PAY', 'EXPENSE', 'EXPENSES', 'DEBIT', 'DEBITS', 'BOUGHT',
+               'PURCHASE', 'WITHDRAW', 'WITHDREW', 'DEPENSE'}
+
+MONTHS = {
+    'JANUARY': 1, 'JANVIER': 1, 'JAN': 1, 'FEBRUARY': 2, 'FEVRIER': 2, 'FEB': 2, 'MARCH': 3, 'MARS': 3,
+    'APRIL': 4, 'AVRIL': 4, 'APR': 4, 'MAY': 5, 'MAI': 5, 'JUNE': 6, 'JUIN': 6, 'JULY': 7, 'JUILLET': 7,
+    'AUGUST': 8, 'AOUT': 8, 'AUG': 8, 'SEPTEMBER': 9, 'SEPTEMBRE': 9, 'SEPT': 9, 'OCTOBER': 10,
+    'OCTOBRE': 10, 'OCT': 10, 'NOVEMBER': 11, 'NOVEMBRE': 11, 'NOV': 11, 'DECEMBER': 12, 'DECEMBRE': 12,
+    'DEC': 12,
+}
+
+# Question words that make a context section relevant, keyed by its '### ' title
+SECTION_KEYWORDS = {
+    'CURRENT FINANCIAL POSITION': {'NET', 'WORTH', 'BALANCE', 'SOLDE', 'POSITION', 'HAVE', 'LEFT'},
+    'CASH FLOW ANALYSIS': {'INCOME', 'EXPENSE', 'CASH', 'FLOW', 'SPEND', 'SPENT', 'EARN', 'RUNWAY', 'TOTAL'},
+    'MONTHLY BREAKDOWN': {'MONTH', 'MONTHLY', 'LAST', 'TREND', 'COMPARE'} | set(MONTHS),
+    'INCOME ANALYSIS': {'INCOME', 'SALARY', 'SALAIRE', 'STABILITY', 'VOLATILITY', 'EARN'},
+    'EXPENSE BREAKDOWN BY CATEGORY': {'CATEGORY', 'CATEGORIE', 'SPEND', 'SPENT', 'EXPENSE', 'BREAKDOWN', 'BUDGET'},
+    'RECURRING/SUBSCRIPTION EXPENSES': {'RECURRING', 'SUBSCRIPTION', 'ABONNEMENT', 'BILL', 'MONTHLY', 'REGULAR'},
+    'TOP 10 LARGEST EXPENSES': {'LARGEST', 'BIGGEST', 'TOP', 'EXPENSIVE', 'HIGHEST', 'MAJOR'},
+    'FINANCIAL HEALTH ASSESSMENT': {'HEALTH', 'SCORE', 'SAVING', 'SAVINGS', 'ADVICE', 'DOING'},
+    'BALANCE HISTORY TREND': {'HISTORY', 'TREND', 'BALANCE', 'EVOLUTION', 'GROWTH'},
+    'DATA SOURCES SUMMARY': {'STATEMENT', 'DOCUMENT', 'DATA', 'UPLOADED', 'FILE'},
+}
+# Used when nothing in the question points anywhere more specific
+DEFAULT_SECTIONS = ('CURRENT FINANCIAL POSITION', 'CASH FLOW ANALYSIS', 'MONTHLY BREAKDOWN',
+                    'EXPENSE BREAKDOWN BY CATEGORY', 'FINANCIAL HEALTH ASSESSMENT')
+
+_WORD = re.compile(r'[A-Z]+')
+_ISO_DATE = re.compile(r'\b(\d{4})-(\d{2})(?:-(\d{2}))?\b')
+_YEAR = re.compile(r'\b(20\d{2}|19\d{2})\b')
+_AMOUNT = re.compile(
+    r'(?:(MORE THAN|OVER|ABOVE|GREATER THAN|PLUS DE|>)|(LESS THAN|UNDER|BELOW|MOINS DE|<))?\s*'
+    r'(\d{1,3}(?:[ ,]\d{3})+(?:\.\d+)?|\d+(?:[.,]\d+)?)\s*(MAD|DH|DHS|DIRHAMS?)?\b'
+)
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token)."""
+    return len(text) // 4 + 1
+
+def _fold(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    return ''.join(c for c in text if not unicodedata.combining(c)).upper()
+
+def _stem(word):
+    return word[:-1] if len(word) > 3 and word.endswith('S') else word
+
+def tokenize(text):
+    """Normalized description terms: accents folded, digits dropped, plurals stripped."""
+    return [_stem(word) for word in _WORD.findall(_fold(text)) if len(word) > 1 and word not in STOPWORDS]
+
+def _parse_number(raw):
+    raw = raw.replace(' ', '')
+    if ',' in raw and not re.search(r',\d{3}\b', raw):
+        raw = raw.replace(',', '.')
+    return float(raw.replace(',', ''))
+
+def parse_question(question):
+    """Search terms plus month, amount and debit/credit facets found in a question."""
+    folded = _fold(question)
+    words = set(_WORD.findall(folded))
+    facets = {'months': set(), 'month_numbers': set(), 'days': set(), 'min_amount': None,
+              'max_amount': None, 'amount': None, 'kind': None}
+
+    for year, month, day in _ISO_DATE.findall(folded):
+        facets['months'].add(f"{year}-{month}")
+        if day:
+            facets['days'].add(f"{year}-{month}-{day}")
+    remaining = _ISO_DATE.sub(' ', folded)
+
+    years = _YEAR.findall(remaining)
+    for word in words:
+        # Short or ambiguous month words only count next to a year
+        if word in MONTHS and (years or (len(word) > 3 and word != 'MARCH')):
+            if years:
+                facets['months'].update(f"{year}-{MONTHS[word]:02d}" for year in years)
+            else:
+                facets['month_numbers'].add(MONTHS[word])
+    remaining = _YEAR.sub(' ', remaining)
+
+    for above, below, raw, currency in _AMOUNT.findall(remaining):
+        amount = _parse_number(raw)
+        if above:
+            facets['min_amount'] = amount
+        elif below:
+            facets['max_amount'] = amount
+        elif currency:
+            facets['amount'] = amount
+
+    credit, debit = bool(words & CREDIT_WORDS), bool(words & DEBIT_WORDS)
+    if credit != debit:
+        facets['kind'] = 'credit' if credit else 'debit'
+
+    terms = []
+    for word in _WORD.findall(folded):
+        if len(word) < 2 or word in STOPWORDS or word in MONTHS:
+            continue
+        term = _stem(word)
+        terms.append(term)
+        terms.extend(SYNONYMS.get(term, ()))
+    return list(dict.fromkeys(terms)), facets
+
+class TransactionSearchIndex:
+    """BM25 index over transaction descriptions with month facets, updated per document."""
+
+    def __init__(self, documents=()):
+        self.transactions = {}
+        self.postings = defaultdict(dict)
+        self.by_month = defaultdict(set)
+        self.lengths = {}
+        self.total_length = 0
+        self._doc_ids = {}
+        self._next_id = 0
+        # Chats search the shared index while uploads re-index documents in place
+        self._lock = threading.Lock()
+        for document in documents:
+            self.add_document(document)
+
+    def __len__(self):
+        return len(self.transactions)
+
+    def add_document(self, document):
+        key = document_key(document)
+        if key in self._doc_ids:
+            self.remove_document(key)
+        ids = []
+        for transaction in document.get('transactions') or []:
+            tid = self._next_id
+            self._next_id += 1
+            date = transaction.get('transaction_date') or ''
+            if not isinstance(date, str):
+                date = str(date)
+            terms = Counter(tokenize(transaction.get('description')))
+            self.transactions[tid] = {
+                'date': date,
+                'description': transaction.get('description') or '',
+                'debit': transaction.get('debit'),
+                'credit': transaction.get('credit'),
+                'document_type': document.get('document_type'),
+                'terms': terms,
+            }
+            for term, count in terms.items():
+                self.postings[term][tid] = count
+            length = sum(terms.values())
+            self.lengths[tid] = length
+            self.total_length += length
+            self.by_month[date[:7]].add(tid)
+            ids.append(tid)
+        self._doc_ids[key] = ids
+
+    def remove_document(self, key):
+        for tid in self._doc_ids.pop(key, []):
+            entry = self.transactions.pop(tid)
+            for term in entry['terms']:
+                posting = self.postings[term]
+                posting.pop(tid, None)
+                if not posting:
+                    del self.postings[term]
+            self.total_length -= self.lengths.pop(tid)
+            month = self.by_month[entry['date'][:7]]
+            month.discard(tid)
+            if not month:
+                del self.by_month[entry['date'][:7]]
+
+    def apply_changes(self, changes):
+        """Re-indexes the documents touched by a merge (smart_merge_data changes)."""
+        with self._lock:
+            for _, document in changes:
+                self.add_document(document)
+
+    def _facet_ids(self, facets):
+        months = set(facets['months'])
+        if facets['month_numbers']:
+            months.update(m for m in self.by_month if m[5:7].isdigit() and int(m[5:7]) in facets['month_numbers'])
+        if not months:
+            return None
+        ids = set()
+        for month in months:
+            ids.update(self.by_month.get(month, ()))
+        if facets['days']:
+            ids = {tid for tid in ids if self.transactions[tid]['date'] in facets['days']}
+        return ids
+
+    def _matches_facets(self, entry, facets):
+        if facets['kind'] and not entry[facets['kind']]:
+            return False
+        amount = entry['debit'] or entry['credit'] or 0
+        if facets['min_amount'] is not None and amount < facets['min_amount']:
+            return False
+        if facets['max_amount'] is not None and amount > facets['max_amount']:
+            return False
+        if facets['amount'] is not None and abs(amount - facets['amount']) > max(0.01, facets['amount'] * 0.01):
+            return False
+        return True
+
+    def search(self, question, limit=25):
+        """
+        Returns (hits, summary): up to limit transactions ranked by BM25 (newest
+        first when only facets matched), and totals over every transaction that
+        matches all effective terms and facets.
+        """
+        with self._lock:
+            return self._search(question, limit)
+
+    def _search(self, question, limit):
+        terms, facets = parse_question(question)
+        allowed = self._facet_ids(facets)
+        count = len(self.transactions)
+        # Debit/credit alone matches half the history, so it only narrows other matches
+        has_facets = allowed is not None or any(
+            facets[name] is not None for name in ('min_amount', 'max_amount', 'amount'))
+        if not count:
+            return [], None
+
+        matched = [t for t in terms if t in self.postings]
+        rare = [t for t in matched if len(self.postings[t]) <= count * COMMON_TERM_SHARE]
+        effective = rare or matched
+        if not effective and not has_facets:
+            return [], None
+
+        scores = defaultdict(float)
+        if effective:
+            average = self.total_length / count or 1
+            for term in effective:
+                posting = self.postings[term]
+                idf = math.log(1 + (count - len(posting) + 0.5) / (len(posting) + 0.5))
+                for tid, tf in posting.items():
+                    if allowed is not None and tid not in allowed:
+                        continue
+                    norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[tid] / average)
+                    scores[tid] += idf * tf * (BM25_K1 + 1) / norm
+            candidates = scores
+        else:
+            candidates = allowed if allowed is not None else self.transactions.keys()
+
+        candidates = [tid for tid in candidates if self._matches_facets(self.transactions[tid], facets)]
+        if effective:
+            # Best score first, newest first among equal scores
+            candidates.sort(key=lambda tid: self.transactions[tid]['date'], reverse=True)
+            candidates.sort(key=lambda tid: scores[tid], reverse=True)
+            strict = [tid for tid in candidates if all(t in self.transactions[tid]['terms'] for t in effective)]
+        else:
+            candidates.sort(key=lambda tid: self.transactions[tid]['date'], reverse=True)
+            strict = candidates
+
+        summary = None
+        if strict:
+            summary = {
+                'terms': effective,
+                'count': len(strict),
+                'total_debits': round(sum(self.transactions[tid]['debit'] or 0 for tid in strict), 2),
+                'total_credits': round(sum(self.transactions[tid]['credit'] or 0 for tid in strict), 2),
+                'first_date': min(self.transactions[tid]['date'] for tid in strict),
+                'last_date': max(self.transactions[tid]['date'] for tid in strict),
+            }
+        return [self.transactions[tid] for tid in candidates[:limit]], summary
+
+def split_sections(context):
+    """Splits a rendered financial context into (title, text) sections."""
+    sections = []
+    for block in re.split(r'\n(?=### )', context):
+        block = block.strip('\n')
+        if not block:
+            continue
+        title = block[4:].split('\n', 1)[0].strip() if block.startswith('### ') else ''
+        sections.append((title, block + '\n'))
+    return sections
+
+def _rank_sections(question, sections):
+    words = {_stem(w) for w in _WORD.findall(_fold(question))} | set(_WORD.findall(_fold(question)))
+    terms = set(tokenize(question))
+    ranked = []
+    for position, (title, text) in enumerate(sections):
+        keywords = SECTION_KEYWORDS.get(title, set())
+        score = 2 * len(words & keywords)
+        body = set(tokenize(text))
+        score += len(terms & body)
+        if score:
+            ranked.append((score, position))
+    ranked.sort(key=lambda item: (-item[0], item[1]))
+    return [position for _, position in ranked]
+
+def _format_transaction(entry):
+    if entry['debit']:
+        amount = f"debit {entry['debit']:,.2f} MAD"
+    else:
+        amount = f"credit {(entry['credit'] or 0):,.2f} MAD"
+    return f"• {entry['date']}: {entry['description']} - {amount} ({entry['document_type']})\n"
+
+def build_retrieval_context(question, context, index, token_budget=1200, transaction_limit=25):
+    """
+    The parts of the financial context relevant to question, plus the matching
+    transactions, kept under token_budget (estimated) tokens.
+    """
+    sections = split_sections(context)
+    if not sections:
+        return context
+    header = sections[0][1] if not sections[0][0] else ''
+    titled = [(title, text) for title, text in sections if title]
+
+    ranked = _rank_sections(question, titled)
+    hits, summary = index.search(question, transaction_limit) if index is not None else ([], None)
+    if not ranked and not hits:
+        ranked = [i for i, (title, _) in enumerate(titled) if title in DEFAULT_SECTIONS]
+
+    transaction_lines = []
+    if summary:
+        transaction_lines.append(
+            f"• {summary['count']} transactions match ({', '.join(summary['terms']) or 'filters'}) "
+            f"from {summary['first_date']} to {summary['last_date']}: "
+            f"total debits {summary['total_debits']:,.2f} MAD, total credits {summary['total_credits']:,.2f} MAD\n"
+        )
+    transaction_lines.extend(_format_transaction(entry) for entry in hits)
+
+    used = estimate_tokens(header)
+    # Transactions get up to half the budget when the question matched any
+    reserved = min(sum(estimate_tokens(line) for line in transaction_lines), token_budget // 2)
+    chosen = []
+    for position in ranked:
+        cost = estimate_tokens(titled[position][1])
+        if used + cost + reserved <= token_budget:
+            chosen.append(position)
+            used += cost
+
+    parts = [header] if header else []
+    parts.extend(titled[position][1] + '\n' for position in sorted(chosen))
+    if transaction_lines:
+        parts.append("### TRANSACTIONS RELEVANT TO THE QUESTION\n")
+        used += estimate_tokens(parts[-1])
+        for line in transaction_lines:
+            cost = estimate_tokens(line)
+            if used + cost > token_budget:
+                break
+            parts.append(line)
+            used += cost
+        parts.append("\n")
+    parts.append("(Only the sections and transactions relevant to this question are included.)\n")
+    return "".join(parts)
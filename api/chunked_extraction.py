@@ -0,0 +1,143 @@
+import re
+from collections import Counter
+
+# --- Chunked Extraction ---
+# Long statements are split into page-range chunks that are extracted by
+# separate, concurrent model calls. Each chunk also carries the tail of the
+# previous chunk's text so a transaction cut by a page break is seen whole at
+# least once; the duplicates this produces at chunk boundaries are removed
+# when the partial results are stitched back into one document. Only the
+# transactions that can come from that repeated text are candidates, so equal
+# transactions on both sides of a boundary (two same-day withdrawals) are kept.
+
+# Top-level fields combined by rule rather than taken from the first chunk that has them
+_STITCHED_FIELDS = ('statement_period', 'transactions', 'summary')
+
+def plan_chunks(page_texts, chunk_pages, overlap_chars):
+    """
+    Splits page texts into chunks of chunk_pages pages.
+    Returns a list of {'first_page', 'last_page', 'text', 'overlap'} (pages are
+    1-based); 'overlap' is the text repeated from the previous chunk.
+    """
+    chunk_pages = max(1, chunk_pages)
+    chunks = []
+    for start in range(0, len(page_texts), chunk_pages):
+        pages = page_texts[start:start + chunk_pages]
+        overlap = "".join(page_texts[:start])[-overlap_chars:] if start and overlap_chars else ""
+        chunks.append({
+            'first_page': start + 1, 'last_page': start + len(pages),
+            'text': overlap + "".join(pages), 'overlap': overlap,
+        })
+    return chunks
+
+def chunk_instructions(chunk, page_count):
+    """Extra prompt text telling the model which part of the document it sees."""
+    if chunk['first_page'] == 1 and chunk['last_page'] == page_count:
+        return ""
+    return (
+        f"This text covers pages {chunk['first_page']}-{chunk['last_page']} of a {page_count}-page document "
+        f"(it may start with a few lines from the previous page). Extract every transaction in this text. "
+        f"Report header fields, balances and totals only if they appear in this text, otherwise use null."
+    )
+
+def _transaction_key(transaction):
+    return (
+        transaction.get('transaction_date'),
+        transaction.get('value_date'),
+        (transaction.get('description') or '').strip().upper(),
+        transaction.get('debit'),
+        transaction.get('credit'),
+    )
+
+def _first_value(parts, *path):
+    for part in parts:
+        value = part
+        for key in path:
+            value = value.get(key) if isinstance(value, dict) else None
+        if value is not None:
+            return value
+    return None
+
+def _normalize_text(text):
+    return re.sub(r'\s+', ' ', (text or '').upper()).strip()
+
+def _boundary_duplicates(previous, current, overlap):
+    """
+    Number of leading transactions of current that repeat the tail of previous.
+    Only transactions whose description occurs in the overlap text can be
+    repeats, and the repeated run must equal the same number of transactions
+    at the end of the previous chunk.
+    """
+    overlap = _normalize_text(overlap)
+    if not previous or not overlap:
+        return 0
+    used = Counter()
+    limit = 0
+    for transaction in current[:len(previous)]:
+        description = _normalize_text(transaction.get('description'))
+        if not description or overlap.count(description) <= used[description]:
+            break
+        used[description] += 1
+        limit += 1
+    for count in range(limit, 0, -1):
+        if Counter(map(_transaction_key, current[:count])) == Counter(map(_transaction_key, previous[-count:])):
+            return count
+    return 0
+
+def stitch_extractions(parts, chunks):
+    """
+    Combines per-chunk extraction results (in page order, one per chunk from
+    plan_chunks) into one document. Leading transactions of a chunk that were
+    read from its overlap with the previous chunk are dropped as boundary
+    duplicates. Other header fields are merged key by key, first value wins.
+    Summary totals are recomputed from the stitched transactions.
+    """
+    pairs = [(part, chunk) for part, chunk in zip(parts, chunks) if part]
+    if not pairs:
+        return None
+    if len(pairs) == 1:
+        return pairs[0][0]
+    parts = [part for part, _ in pairs]
+
+    stitched = {}
+    for part in parts:
+        for key, value in part.items():
+            if key in _STITCHED_FIELDS:
+                continue
+            if isinstance(value, dict):
+                merged = stitched.get(key)
+                if not isinstance(merged, dict):
+                    merged = stitched[key] = {}
+                for field, field_value in value.items():
+                    if merged.get(field) is None:
+                        merged[field] = field_value
+            elif stitched.get(key) is None:
+                stitched[key] = value
+    stitched['document_type'] = stitched.get('document_type') or 'unknown'
+
+    starts = [p['statement_period']['start_date'] for p in parts
+              if (p.get('statement_period') or {}).get('start_date')]
+    ends = [p['statement_period']['end_date'] for p in parts
+            if (p.get('statement_period') or {}).get('end_date')]
+    if starts or ends:
+        stitched['statement_period'] = {
+            'start_date': min(starts) if starts else None,
+            'end_date': max(ends) if ends else None,
+        }
+
+    transactions = []
+    previous = []
+    for part, chunk in pairs:
+        current = part.get('transactions') or []
+        transactions.extend(current[_boundary_duplicates(previous, current, chunk.get('overlap')):])
+        previous = current
+    stitched['transactions'] = transactions
+
+    # Opening balance comes from the first chunk that has one, closing from the last
+    stitched['summary'] = {
+        'opening_balance': _first_value(parts, 'summary', 'opening_balance'),
+        'closing_balance': _first_value(list(reversed(parts)), 'summary', 'closing_balance'),
+        'total_debits': sum(t.get('debit', 0) or 0 for t in transactions),
+        'total_credits': sum(t.get('credit', 0) or 0 for t in transactions),
+    }
+    return stitched
@@ -0,0 +1,152 @@
+import json
+import sqlite3
+import threading
+import time
+
+# --- Extraction Cache ---
+# Content-addressed cache of extracted statement data. Entries are keyed by the
+# PDF's SHA-256, the prompt version and the model name, so re-uploading the same
+# file skips the model entirely while prompt or model changes still miss.
+# The same database keeps the PyPDF2 text of each page, keyed by
+# (file hash, page index), so text fallbacks never re-parse a known file.
+
+EXTRACTION_CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS extractions (
+    file_hash TEXT NOT NULL,
+    prompt_version TEXT NOT NULL,
+    model_name TEXT NOT NULL,
+    data TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_used_at REAL NOT NULL,
+    PRIMARY KEY (file_hash, prompt_version, model_name)
+);
+CREATE INDEX IF NOT EXISTS idx_extractions_last_used ON extractions(last_used_at);
+CREATE INDEX IF NOT EXISTS idx_extractions_created ON extractions(created_at);
+CREATE TABLE IF NOT EXISTS page_texts (
+    file_hash TEXT NOT NULL,
+    page_index INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_used_at REAL NOT NULL,
+    PRIMARY KEY (file_hash, page_index)
+);
+CREATE INDEX IF NOT EXISTS idx_page_texts_last_used ON page_texts(last_used_at);
+"""
+
+class ExtractionCache:
+    """Persistent extraction cache with size (LRU) and age eviction."""
+
+    def __init__(self, db_path, max_bytes, max_age_seconds):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self._local = threading.local()
+        self._connect().executescript(EXTRACTION_CACHE_SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, file_hash, prompt_version, model_name):
+        """Returns the cached extraction, or None on a miss or expired entry."""
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT data, created_at FROM extractions WHERE file_hash = ? AND prompt_version = ? AND model_name = ?",
+            (file_hash, prompt_version, model_name)
+        ).fetchone()
+        if not row:
+            return None
+
+        now = time.time()
+        if self.max_age_seconds and now - row[1] > self.max_age_seconds:
+            conn.execute(
+                "DELETE FROM extractions WHERE file_hash = ? AND prompt_version = ? AND model_name = ?",
+                (file_hash, prompt_version, model_name)
+            )
+            return None
+
+        conn.execute(
+            "UPDATE extractions SET last_used_at = ? WHERE file_hash = ? AND prompt_version = ? AND model_name = ?",
+            (now, file_hash, prompt_version, model_name)
+        )
+        return json.loads(row[0])
+
+    def put(self, file_hash, prompt_version, model_name, data):
+        """Stores an extraction and evicts old or least recently used entries."""
+        payload = json.dumps(data, ensure_ascii=False)
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO extractions "
+                "(file_hash, prompt_version, model_name, data, size, created_at, last_used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (file_hash, prompt_version, model_name, payload, len(payload.encode('utf-8')), now, now)
+            )
+            self._evict(conn, now)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get_page_texts(self, file_hash):
+        """Returns {page_index: text} for every cached page of a file."""
+        conn = self._connect()
+        rows = conn.execute(
+            "SELECT page_index, text, created_at FROM page_texts WHERE file_hash = ?", (file_hash,)
+        ).fetchall()
+        now = time.time()
+        pages = {
+            index: text for index, text, created_at in rows
+            if not self.max_age_seconds or now - created_at <= self.max_age_seconds
+        }
+        if pages:
+            conn.execute("UPDATE page_texts SET last_used_at = ? WHERE file_hash = ?", (now, file_hash))
+        return pages
+
+    def put_page_texts(self, file_hash, pages):
+        """Stores extracted page texts given as {page_index: text}."""
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO page_texts (file_hash, page_index, text, size, created_at, last_used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(file_hash, index, text, len(text.encode('utf-8')), now, now) for index, text in pages.items()]
+            )
+            self._evict(conn, now)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _evict(self, conn, now):
+        # Extractions and page texts each get the full size budget
+        for table, key_columns in (('extractions', ('file_hash', 'prompt_version', 'model_name')),
+                                   ('page_texts', ('file_hash', 'page_index'))):
+            if self.max_age_seconds:
+                conn.execute(f"DELETE FROM {table} WHERE created_at < ?", (now - self.max_age_seconds,))
+
+            if not self.max_bytes:
+                continue
+            total = conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM {table}").fetchone()[0]
+            if total <= self.max_bytes:
+                continue
+
+            columns = ', '.join(key_columns)
+            expired = []
+            for row in conn.execute(f"SELECT {columns}, size FROM {table} ORDER BY last_used_at"):
+                if total <= self.max_bytes:
+                    break
+                expired.append(row[:-1])
+                total -= row[-1]
+            conditions = ' AND '.join(f"{column} = ?" for column in key_columns)
+            conn.executemany(f"DELETE FROM {table} WHERE {conditions}", expired)
@@ -0,0 +1,381 @@
+import json
+import hashlib
+from datetime import datetime
+from collections import defaultdict
+
+from categorization import get_categorizer
+from persistence import atomic_write_json
+from recurring import detect_recurring, group_recurring
+
+# --- Running Financial Aggregates ---
+# Each stored document is folded once into a small per-document summary
+# (monthly buckets, category totals, recurring-pattern counters, top expenses).
+# Reads combine those summaries instead of re-walking every transaction, and a
+# merge only re-summarizes the documents it actually touched.
+
+AGGREGATES_FORMAT_VERSION = 3
+TOP_EXPENSES_LIMIT = 10
+
+def summary_version():
+    """
+    Version tag for stored summaries: the summary format plus the active
+    category rules, since summaries embed each debit's category.
+    """
+    return f"{AGGREGATES_FORMAT_VERSION}:{get_categorizer().fingerprint}"
+
+def document_key(document):
+    """Returns the stable key used to track a document's aggregates."""
+    file_hash = document.get('source_file_hash')
+    if file_hash:
+        return file_hash
+    payload = json.dumps(document, sort_keys=True, ensure_ascii=False, default=str)
+    return 'content:' + hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def categorize_expense(description):
+    """Categorizes a debit using the configured category rule table."""
+    return get_categorizer().categorize(description)
+
+def _transaction_sort_key(transaction):
+    return transaction.get('transaction_date') or '1900-01-01'
+
+def summarize_document(document):
+    """
+    Folds a single document into the running aggregates needed by the metrics.
+    Transactions keep their position inside the document so that combining
+    summaries reproduces the exact ordering of a full date sort.
+    """
+    summary = document.get('summary') or {}
+    period = document.get('statement_period') or {}
+    transactions = document.get('transactions') or []
+
+    doc_summary = {
+        'key': document_key(document),
+        'document_type': document.get('document_type'),
+        'account_holder': (document.get('account_holder') or {}).get('name'),
+        'start_date': period.get('start_date'),
+        'end_date': period.get('end_date'),
+        'closing_balance': summary.get('closing_balance'),
+        'has_closing_balance': 'closing_balance' in summary,
+        'transaction_count': len(transactions),
+        'total_income': 0,
+        'total_expenses': 0,
+        'months': {},
+        'categories': {},
+        'largest_expenses': [],
+        'recurring': {},
+    }
+
+    ordered = sorted(enumerate(transactions), key=lambda item: _transaction_sort_key(item[1]))
+
+    months = defaultdict(lambda: {'income': 0, 'expenses': 0, 'transaction_count': 0})
+    categories = {}
+    debits = []
+
+    for index, transaction in ordered:
+        sort_key = _transaction_sort_key(transaction)
+        doc_summary['total_income'] += transaction.get('credit', 0) or 0
+        doc_summary['total_expenses'] += transaction.get('debit', 0) or 0
+
+        trans_date = transaction.get('transaction_date')
+        if trans_date and isinstance(trans_date, str) and len(trans_date) >= 7:
+            bucket = months[trans_date[:7]]
+            bucket['transaction_count'] += 1
+            if transaction.get('credit'):
+                bucket['income'] += transaction['credit']
+            if transaction.get('debit'):
+                bucket['expenses'] += transaction['debit']
+
+        if not transaction.get('debit'):
+            continue
+
+        debits.append((index, transaction))
+
+        category = categorize_expense(transaction.get('description', ''))
+        if category not in categories:
+            categories[category] = {'total': 0, 'count': 0, 'first': [sort_key, index], 'transactions': []}
+        categories[category]['total'] += transaction['debit']
+        categories[category]['count'] += 1
+        categories[category]['transactions'].append([sort_key, index, transaction])
+
+    # Merchant groups in transaction order, each marked with its first debit
+    doc_summary['recurring'] = group_recurring(
+        [transaction for _, transaction in debits],
+        [[_transaction_sort_key(transaction), index] for index, transaction in debits]
+    )
+
+    debits.sort(key=lambda item: (-item[1]['debit'], _transaction_sort_key(item[1]), item[0]))
+    doc_summary['largest_expenses'] = [
+        [_transaction_sort_key(t), index, t] for index, t in debits[:TOP_EXPENSES_LIMIT]
+    ]
+    doc_summary['months'] = dict(months)
+    doc_summary['categories'] = categories
+    return doc_summary
+
+def build_aggregates(financial_data):
+    """Builds the aggregate store from scratch for a list of documents."""
+    aggregates = {'format_version': summary_version(), 'order': [], 'documents': {}}
+    for document in financial_data or []:
+        doc_summary = summarize_document(document)
+        aggregates['documents'][doc_summary['key']] = doc_summary
+        aggregates['order'].append(doc_summary['key'])
+    return aggregates
+
+def update_aggregates(aggregates, financial_data, changes):
+    """
+    Applies the changes reported by smart_merge_data to the aggregate store.
+    Only touched documents are re-summarized; the rest are reused as-is.
+    """
+    touched = {}
+    for action, document in changes:
+        touched[document_key(document)] = document
+    for key, document in touched.items():
+        aggregates['documents'][key] = summarize_document(document)
+
+    aggregates['order'] = [document_key(d) for d in financial_data]
+    live_keys = set(aggregates['order'])
+    for key in list(aggregates['documents']):
+        if key not in live_keys:
+            del aggregates['documents'][key]
+    return aggregates
+
+def ordered_summaries(aggregates):
+    """Returns the per-document summaries in storage order."""
+    documents = aggregates.get('documents', {})
+    return [documents[key] for key in aggregates.get('order', []) if key in documents]
+
+def combine_document_summaries(summaries):
+    """
+    Combines per-document summaries into the full metrics dictionary.
+    Produces the same output as a full recompute over every transaction.
+    """
+    if not summaries:
+        return {}
+
+    monthly_statements = [s for s in summaries if s.get('document_type') == 'monthly_statement']
+    transaction_lists = [s for s in summaries if s.get('document_type') == 'transaction_list']
+
+    monthly_statements.sort(key=lambda x: x.get('end_date') or '')
+    transaction_lists.sort(key=lambda x: x.get('end_date') or '')
+
+    metrics = {}
+
+    # Current Net Worth (Latest Balance)
+    current_net_worth = 0
+    latest_balance_date = None
+
+    if monthly_statements:
+        latest_statement = monthly_statements[-1]
+        current_net_worth = latest_statement['closing_balance'] if latest_statement.get('has_closing_balance') else 0
+        latest_balance_date = latest_statement.get('end_date')
+
+    if transaction_lists:
+        latest_transaction_list = transaction_lists[-1]
+        latest_closing_balance = latest_transaction_list.get('closing_balance')
+        if latest_closing_balance is not None:
+            latest_list_date = latest_transaction_list.get('end_date')
+            if not latest_balance_date or (latest_list_date and latest_list_date > latest_balance_date):
+                current_net_worth = latest_closing_balance
+                latest_balance_date = latest_list_date
+
+    metrics['current_net_worth'] = current_net_worth
+    metrics['net_worth_as_of_date'] = latest_balance_date
+
+    # Holder name as printed on the most recent document that has one
+    holders = [s for s in monthly_statements + transaction_lists if s.get('account_holder')]
+    metrics['account_holder'] = max(holders, key=lambda s: s.get('end_date') or '')['account_holder'] if holders else None
+
+    # Historical balances for trend analysis
+    balance_history = []
+    for source, documents in (('monthly_statement', monthly_statements), ('transaction_list', transaction_lists)):
+        for doc_summary in documents:
+            end_date = doc_summary.get('end_date')
+            closing_balance = doc_summary.get('closing_balance')
+            if end_date and closing_balance is not None:
+                balance_history.append({
+                    'date': end_date,
+                    'balance': closing_balance,
+                    'source': source
+                })
+
+    balance_history.sort(key=lambda x: x.get('date') or '1900-01-01')
+    metrics['balance_history'] = balance_history
+
+    if len(balance_history) >= 2:
+        first_balance = balance_history[0]['balance']
+        latest_balance = balance_history[-1]['balance']
+
+        metrics['total_net_worth_change'] = latest_balance - first_balance
+        metrics['net_worth_change_percentage'] = ((latest_balance - first_balance) / first_balance * 100) if first_balance != 0 else 0
+
+        first_date_str = balance_history[0].get('date')
+        latest_date_str = balance_history[-1].get('date')
+
+        if first_date_str and latest_date_str:
+            try:
+                first_date = datetime.strptime(first_date_str, '%Y-%m-%d')
+                latest_date = datetime.strptime(latest_date_str, '%Y-%m-%d')
+                metrics['tracking_period_days'] = (latest_date - first_date).days
+                metrics['tracking_period_months'] = metrics['tracking_period_days'] / 30.44
+            except ValueError:
+                metrics['tracking_period_days'] = 0
+                metrics['tracking_period_months'] = 0
+
+    # Total income and expenses
+    total_income = sum(s['total_income'] for s in summaries)
+    total_expenses = sum(s['total_expenses'] for s in summaries)
+
+    metrics['total_income_all_time'] = total_income
+    metrics['total_expenses_all_time'] = total_expenses
+    metrics['net_cash_flow_all_time'] = total_income - total_expenses
+
+    # Monthly analysis
+    monthly_data = defaultdict(lambda: {'income': 0, 'expenses': 0, 'transaction_count': 0})
+    for doc_summary in summaries:
+        for month, bucket in doc_summary['months'].items():
+            monthly_data[month]['income'] += bucket['income']
+            monthly_data[month]['expenses'] += bucket['expenses']
+            monthly_data[month]['transaction_count'] += bucket['transaction_count']
+
+    monthly_summary = []
+    for month, data in monthly_data.items():
+        monthly_summary.append({
+            'month': month,
+            'income': data['income'],
+            'expenses': data['expenses'],
+            'net_flow': data['income'] - data['expenses'],
+            'transaction_count': data['transaction_count']
+        })
+
+    monthly_summary.sort(key=lambda x: x['month'])
+    metrics['monthly_summary'] = monthly_summary
+
+    # Recent period analysis (last 3 months)
+    if monthly_summary:
+        recent_months = monthly_summary[-3:]
+        recent_income = sum(m['income'] for m in recent_months)
+        recent_expenses = sum(m['expenses'] for m in recent_months)
+
+        metrics['recent_3_months'] = {
+            'income': recent_income,
+            'expenses': recent_expenses,
+            'net_flow': recent_income - recent_expenses,
+            'avg_monthly_income': recent_income / len(recent_months),
+            'avg_monthly_expenses': recent_expenses / len(recent_months)
+        }
+
+    # Income stability analysis
+    if len(monthly_summary) >= 3:
+        incomes = [m['income'] for m in monthly_summary if m['income'] > 0]
+        if incomes:
+            avg_income = sum(incomes) / len(incomes)
+            income_variance = sum((x - avg_income) ** 2 for x in incomes) / len(incomes)
+            income_std_dev = income_variance ** 0.5
+            income_stability = max(0, 100 - (income_std_dev / avg_income * 100)) if avg_income > 0 else 0
+
+            metrics['income_analysis'] = {
+                'average_monthly_income': avg_income,
+                'income_stability_score': income_stability,
+                'income_volatility': (income_std_dev / avg_income * 100) if avg_income > 0 else 0
+            }
+
+    # Expense analysis - categories appear in order of their first transaction
+    category_entries = {}
+    for doc_index, doc_summary in enumerate(summaries):
+        for category, data in doc_summary['categories'].items():
+            first = (data['first'][0], doc_index, data['first'][1])
+            entry = category_entries.setdefault(category, {'total': 0, 'count': 0, 'first': first, 'transactions': []})
+            entry['total'] += data['total']
+            entry['count'] += data['count']
+            entry['first'] = min(entry['first'], first)
+            entry['transactions'].extend(
+                (sort_key, doc_index, index, t) for sort_key, index, t in data['transactions']
+            )
+
+    expense_categories = {}
+    for category, entry in sorted(category_entries.items(), key=lambda item: item[1]['first']):
+        entry['transactions'].sort(key=lambda item: item[:3])
+        expense_categories[category] = {
+            'total': entry['total'],
+            'count': entry['count'],
+            'transactions': [item[3] for item in entry['transactions']]
+        }
+    metrics['expense_categories'] = expense_categories
+
+    # Spending patterns
+    candidates = []
+    for doc_index, doc_summary in enumerate(summaries):
+        for sort_key, index, t in doc_summary['largest_expenses']:
+            candidates.append(((-t['debit'], sort_key, doc_index, index), t))
+    candidates.sort(key=lambda item: item[0])
+    metrics['largest_expenses'] = [t for _, t in candidates[:TOP_EXPENSES_LIMIT]]
+
+    # Recurring transactions - patterns appear in order of their first transaction
+    pattern_entries = {}
+    for doc_index, doc_summary in enumerate(summaries):
+        for pattern, data in doc_summary['recurring'].items():
+            first = (data['first'][0], doc_index, data['first'][1])
+            entry = pattern_entries.setdefault(pattern, {'count': 0, 'total_amount': 0, 'first': first, 'occurrences': []})
+            entry['count'] += data['count']
+            entry['total_amount'] += data['total_amount']
+            entry['first'] = min(entry['first'], first)
+            entry['occurrences'].extend(data['occurrences'])
+
+    # Cadence, amount drift and next expected charge per merchant (see recurring.py)
+    metrics['recurring_expenses'] = detect_recurring(
+        dict(sorted(pattern_entries.items(), key=lambda item: item[1]['first']))
+    )
+
+    # Financial health score calculation
+    health_score = 100
+
+    if metrics.get('recent_3_months'):
+        recent_net_flow = metrics['recent_3_months']['net_flow']
+        if recent_net_flow < 0:
+            health_score -= 20
+
+        avg_monthly_expenses = metrics['recent_3_months']['avg_monthly_expenses']
+        if avg_monthly_expenses > 0:
+            runway_months = current_net_worth / avg_monthly_expenses
+            if runway_months < 3:
+                health_score -= 30
+            elif runway_months < 6:
+                health_score -= 15
+
+    if metrics.get('income_analysis'):
+        stability = metrics['income_analysis']['income_stability_score']
+        if stability < 70:
+            health_score -= 15
+        elif stability < 50:
+            health_score -= 25
+
+    metrics['financial_health_score'] = max(0, health_score)
+
+    # Savings rate calculation
+    if balance_history and len(balance_history) >= 2:
+        time_period_months = metrics.get('tracking_period_months', 1)
+        total_net_worth_change = metrics.get('total_net_worth_change', 0)
+
+        if time_period_months > 0 and total_income > 0:
+            savings_rate = (total_net_worth_change / total_income) * 100
+            metrics['savings_rate'] = savings_rate
+
+    return metrics
+
+def aggregate_metrics(aggregates):
+    """Returns the comprehensive metrics for an aggregate store."""
+    return combine_document_summaries(ordered_summaries(aggregates))
+
+def load_aggregates(path):
+    """Loads a persisted aggregate store, or None if it is missing or outdated."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            aggregates = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    if aggregates.get('format_version') != summary_version():
+        return None
+    return aggregates
+
+def save_aggregates(path, aggregates):
+    """Persists the aggregate store next to the statement data."""
+    atomic_write_json(path, aggregates)
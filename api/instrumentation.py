@@ -0,0 +1,169 @@
+import json
+import time
+import functools
+import threading
+from bisect import bisect_left
+from contextlib import nullcontext
+
+# --- Stage Timing and Counters ---
+# span(stage) times a block of work into a per-stage latency histogram, and
+# increment(name, **labels) bumps a labeled counter. render_prometheus()
+# exposes both in the Prometheus text format (served on /metrics), and every
+# span can also be written as one JSON log line. While disabled, span()
+# returns a shared no-op context manager and increment() returns at once.
+# A span left by GeneratorExit (a streaming client that disconnected) is a
+# cancellation: it is counted, but is neither an error nor a latency sample.
+
+STAGE_HISTOGRAM = 'finance_stage_duration_seconds'
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+COUNTER_HELP = {
+    'finance_extractions_total': 'Extraction attempts by method and outcome.',
+    'finance_cache_requests_total': 'Cache lookups by cache and result.',
+    'finance_stage_errors_total': 'Stages that raised an exception.',
+    'finance_stage_cancellations_total': 'Stages abandoned by a disconnected client.',
+}
+
+_NULL_SPAN = nullcontext()
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    parts = []
+    for key, value in labels:
+        escaped = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{escaped}"')
+    return '{' + ','.join(parts) + '}'
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Span:
+    __slots__ = ('instrumentation', 'stage', 'labels', 'started')
+
+    def __init__(self, instrumentation, stage, labels):
+        self.instrumentation = instrumentation
+        self.stage = stage
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            outcome = 'ok'
+        elif issubclass(exc_type, GeneratorExit):
+            outcome = 'cancelled'
+        else:
+            outcome = 'error'
+        self.instrumentation.record_span(self.stage, time.perf_counter() - self.started, outcome, self.labels)
+        return False
+
+class Instrumentation:
+    """Thread-safe histograms and counters with Prometheus text rendering."""
+
+    def __init__(self, enabled=False, log_spans=False, buckets=DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.log_spans = log_spans
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+
+    def span(self, stage, **labels):
+        """Context manager timing one stage."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, stage, labels)
+
+    def record_span(self, stage, seconds, outcome='ok', labels=None):
+        """Records one finished stage; outcome is 'ok', 'error' or 'cancelled'."""
+        if outcome == 'cancelled':
+            self.increment('finance_stage_cancellations_total', stage=stage)
+        else:
+            key = (('stage', stage),) + tuple(sorted((labels or {}).items()))
+            bucket = bisect_left(self.buckets, seconds)
+            with self._lock:
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+                if bucket < len(self.buckets):
+                    histogram['buckets'][bucket] += 1
+                histogram['sum'] += seconds
+                histogram['count'] += 1
+        if outcome == 'error':
+            self.increment('finance_stage_errors_total', stage=stage)
+        if self.log_spans:
+            print(json.dumps({
+                'event': 'span', 'stage': stage, 'duration_ms': round(seconds * 1000, 3),
+                'outcome': outcome, **(labels or {})
+            }, ensure_ascii=False))
+
+    def increment(self, name, amount=1, **labels):
+        """Adds amount to a labeled counter."""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def render_prometheus(self):
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            histograms = {k: {'buckets': list(v['buckets']), 'sum': v['sum'], 'count': v['count']}
+                          for k, v in self._histograms.items()}
+            counters = dict(self._counters)
+
+        lines = [
+            f'# HELP {STAGE_HISTOGRAM} Latency of each processing stage in seconds.',
+            f'# TYPE {STAGE_HISTOGRAM} histogram',
+        ]
+        for labels, histogram in sorted(histograms.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, histogram['buckets']):
+                cumulative += count
+                lines.append(f"{STAGE_HISTOGRAM}_bucket{_label_text(labels + (('le', _format_value(float(bound))),))} {cumulative}")
+            lines.append(f"{STAGE_HISTOGRAM}_bucket{_label_text(labels + (('le', '+Inf'),))} {histogram['count']}")
+            lines.append(f"{STAGE_HISTOGRAM}_sum{_label_text(labels)} {_format_value(histogram['sum'])}")
+            lines.append(f"{STAGE_HISTOGRAM}_count{_label_text(labels)} {histogram['count']}")
+
+        names = sorted({name for name, _ in counters} | set(COUNTER_HELP))
+        for name in names:
+            lines.append(f"# HELP {name} {COUNTER_HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} counter")
+            for (counter_name, labels), value in sorted(counters.items()):
+                if counter_name == name:
+                    lines.append(f"{name}{_label_text(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+_active_instrumentation = Instrumentation(enabled=False)
+
+def configure_instrumentation(enabled, log_spans=False):
+    """Replaces the process-wide instrumentation."""
+    global _active_instrumentation
+    _active_instrumentation = Instrumentation(enabled=enabled, log_spans=log_spans)
+    return _active_instrumentation
+
+def get_instrumentation():
+    """Returns the process-wide instrumentation."""
+    return _active_instrumentation
+
+def span(stage, **labels):
+    """Times a stage on the process-wide instrumentation (no-op when disabled)."""
+    return _active_instrumentation.span(stage, **labels)
+
+def increment(name, amount=1, **labels):
+    """Bumps a counter on the process-wide instrumentation (no-op when disabled)."""
+    _active_instrumentation.increment(name, amount, **labels)
+
+def timed(stage):
+    """Decorator form of span() for whole functions."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _active_instrumentation.span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,212 @@
+import os
+import json
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# --- Asynchronous Upload Jobs ---
+# Uploads submitted in async mode are recorded in a local SQLite job table and
+# processed by a bounded background executor. Clients poll the job status.
+# The table holds job status and results only: the PDF bytes and API keys of a
+# job are held in memory by the process that accepted it. Each row records that
+# process (host, pid and a per-start boot id), so a starting worker fails only
+# the unfinished jobs of processes that are gone, never those of live workers
+# sharing the database. Finished jobs are deleted once older than the retention.
+
+UPLOAD_JOBS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS upload_jobs (
+    id TEXT PRIMARY KEY,
+    filename TEXT,
+    status TEXT NOT NULL,
+    error TEXT,
+    result TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    owner_host TEXT,
+    owner_pid INTEGER,
+    owner_boot TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_upload_jobs_status ON upload_jobs(status);
+"""
+# Added after the first release of the table
+OWNER_COLUMNS = (('owner_host', 'TEXT'), ('owner_pid', 'INTEGER'), ('owner_boot', 'TEXT'))
+# Finished jobs are pruned at most this often
+PRUNE_INTERVAL_SECONDS = 3600
+# Identifies this process start, so a later process reusing the pid is told apart
+BOOT_ID = uuid.uuid4().hex
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+class QueueFullError(Exception):
+    """Raised when the upload queue already holds the maximum number of jobs."""
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return True
+
+class UploadJobQueue:
+    """Persistent upload job queue backed by a thread pool."""
+
+    def __init__(self, db_path, handler, max_workers, max_queue_depth, retention_seconds=7 * 24 * 3600):
+        self.db_path = db_path
+        self.handler = handler
+        self.max_workers = max_workers
+        self.max_queue_depth = max_queue_depth
+        self.retention_seconds = retention_seconds
+        self.host = socket.gethostname()
+        self.pid = os.getpid()
+        self.boot_id = BOOT_ID
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._last_prune = 0.0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='upload-job')
+
+        conn = self._connect()
+        conn.executescript(UPLOAD_JOBS_SCHEMA)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(upload_jobs)")}
+        for name, kind in OWNER_COLUMNS:
+            if name not in columns:
+                conn.execute(f"ALTER TABLE upload_jobs ADD COLUMN {name} {kind}")
+        self._fail_orphaned_jobs()
+        self.prune()
+
+    def _fail_orphaned_jobs(self):
+        """Fails unfinished jobs whose process on this host has exited."""
+        conn = self._connect()
+        rows = conn.execute(
+            "SELECT id, owner_host, owner_pid, owner_boot FROM upload_jobs WHERE status IN (?, ?)",
+            (JOB_QUEUED, JOB_RUNNING)
+        ).fetchall()
+        orphaned = []
+        for job_id, host, pid, boot in rows:
+            if boot == self.boot_id:
+                continue
+            # Rows from before owners were recorded, or from a reused pid, cannot still be running
+            if host is None or pid is None or (host == self.host and (pid == self.pid or not _process_alive(pid))):
+                orphaned.append(job_id)
+        now = time.time()
+        for job_id in orphaned:
+            conn.execute(
+                "UPDATE upload_jobs SET status = ?, error = ?, updated_at = ? WHERE id = ? AND status IN (?, ?)",
+                (JOB_FAILED, "The server restarted before this job finished. Please upload the file again.",
+                 now, job_id, JOB_QUEUED, JOB_RUNNING)
+            )
+        if orphaned:
+            print(f"--- ❌ Marked {len(orphaned)} upload jobs of stopped workers as failed ---")
+
+    def prune(self):
+        """Deletes finished jobs last updated longer than retention_seconds ago."""
+        self._last_prune = time.time()
+        cursor = self._connect().execute(
+            "DELETE FROM upload_jobs WHERE status IN (?, ?) AND updated_at < ?",
+            (JOB_DONE, JOB_FAILED, self._last_prune - self.retention_seconds)
+        )
+        return cursor.rowcount
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _update(self, job_id, status, error=None, result=None):
+        self._connect().execute(
+            "UPDATE upload_jobs SET status = ?, error = ?, result = ?, updated_at = ? WHERE id = ?",
+            (status, error, json.dumps(result, ensure_ascii=False) if result is not None else None, time.time(), job_id)
+        )
+
+    def submit(self, filename, *args):
+        """Queues a job and returns its id. Extra args are passed to the handler."""
+        with self._lock:
+            if self._pending >= self.max_queue_depth:
+                raise QueueFullError(
+                    f"The upload queue is full ({self.max_queue_depth} jobs). Please retry shortly."
+                )
+            self._pending += 1
+            prune_due = time.time() - self._last_prune >= PRUNE_INTERVAL_SECONDS
+            if prune_due:
+                self._last_prune = time.time()
+
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        inserted = submitted = False
+        try:
+            self._connect().execute(
+                "INSERT INTO upload_jobs (id, filename, status, created_at, updated_at, owner_host, owner_pid, owner_boot) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, filename, JOB_QUEUED, now, now, self.host, self.pid, self.boot_id)
+            )
+            inserted = True
+            self._executor.submit(self._run, job_id, filename, args)
+            submitted = True
+        finally:
+            if not submitted:
+                with self._lock:
+                    self._pending -= 1
+                if inserted:
+                    self._update(job_id, JOB_FAILED, error="The job could not be scheduled.")
+
+        if prune_due:
+            try:
+                self.prune()
+            except sqlite3.Error as e:
+                print(f"--- ❌ Could not prune finished upload jobs: {e} ---")
+        return job_id
+
+    def _run(self, job_id, filename, args):
+        try:
+            self._update(job_id, JOB_RUNNING)
+            try:
+                result = self.handler(filename, *args)
+            except Exception as e:
+                print(f"--- ❌ Upload job {job_id} failed: {e} ---")
+                self._update(job_id, JOB_FAILED, error=str(e))
+                return
+            try:
+                self._update(job_id, JOB_DONE, result=result)
+            except Exception as e:
+                # e.g. a result that is not JSON-serializable; never leave the job running
+                print(f"--- ❌ Could not store the result of upload job {job_id}: {e} ---")
+                self._update(job_id, JOB_FAILED, error=f"The job finished but its result could not be stored: {e}")
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def get(self, job_id):
+        """Returns the job record as a dict, or None if it does not exist."""
+        row = self._connect().execute(
+            "SELECT id, filename, status, error, result, created_at, updated_at FROM upload_jobs WHERE id = ?",
+            (job_id,)
+        ).fetchone()
+        if not row:
+            return None
+        return {
+            'job_id': row[0],
+            'filename': row[1],
+            'status': row[2],
+            'error': row[3],
+            'result': json.loads(row[4]) if row[4] else None,
+            'created_at': row[5],
+            'updated_at': row[6],
+        }
+
+    def depth(self):
+        """Number of jobs currently queued or running."""
+        with self._lock:
+            return self._pending
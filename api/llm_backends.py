@@ -0,0 +1,237 @@
+import os
+import re
+import json
+import time
+import random
+import hashlib
+import calendar
+import threading
+
+from persistence import atomic_write_json
+
+# --- LLM Backends ---
+# Model calls go through a backend: backend.get(api_key) returns a client with
+# generate_content(contents, generation_config=None, stream=False), shaped like
+# genai.GenerativeModel (the response has .text; a streamed response yields
+# chunks with .text). Implementations:
+#   gemini -> ModelClientPool, one isolated GenerativeModel per API key
+#   record -> calls Gemini and stores every response under LLM_RECORDINGS_DIR
+#   replay -> answers from those recordings only, without network access
+#   mock   -> synthetic responses after a configurable delay, for load testing
+# Recordings are keyed by a hash of the model name, generation config and the
+# contents, where PDF parts are represented by the SHA-256 of their bytes.
+
+class RecordingNotFoundError(LookupError):
+    """Replay mode has no recorded response for a request."""
+
+class _TextResponse:
+    """Minimal stand-in for a genai response: .text, or iterable chunks when streamed."""
+
+    def __init__(self, text, chunks=None):
+        self.text = text
+        self._chunks = chunks
+
+    def __iter__(self):
+        return iter(self._chunks if self._chunks is not None else [self])
+
+def _split_text(text, size=200):
+    return [_TextResponse(text[i:i + size]) for i in range(0, len(text), size)] or [_TextResponse('')]
+
+def request_key(model_name, contents, generation_config=None):
+    """Stable key for a model request: prompt text plus hashes of any document parts."""
+    parts = contents if isinstance(contents, list) else [contents]
+    normalized = []
+    for part in parts:
+        if isinstance(part, dict) and isinstance(part.get('data'), (bytes, bytearray)):
+            normalized.append({
+                'mime_type': part.get('mime_type'),
+                'sha256': hashlib.sha256(part['data']).hexdigest(),
+            })
+        else:
+            normalized.append(part if isinstance(part, (str, dict)) else str(part))
+    payload = json.dumps(
+        {'model': model_name, 'config': generation_config or {}, 'contents': normalized},
+        sort_keys=True, ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+# --- Record / Replay ---
+
+class _RecordingClient:
+    def __init__(self, backend, api_key):
+        self._backend = backend
+        self._api_key = api_key
+
+    def generate_content(self, contents, generation_config=None, stream=False):
+        backend = self._backend
+        key = request_key(backend.model_name, contents, generation_config)
+        recorded = backend.load(key)
+        if recorded is not None:
+            return _TextResponse(recorded, _split_text(recorded) if stream else None)
+        if backend.mode == 'replay':
+            raise RecordingNotFoundError(f"No recorded response for request {key[:12]}.")
+
+        response = backend.inner.get(self._api_key).generate_content(
+            contents, generation_config=generation_config, stream=stream
+        )
+        if not stream:
+            backend.store(key, response.text)
+            return response
+        return self._record_stream(key, response)
+
+    def _record_stream(self, key, response):
+        # The stream is passed through as it arrives and only recorded once complete
+        texts = []
+        for chunk in response:
+            texts.append(getattr(chunk, 'text', '') or '')
+            yield chunk
+        self._backend.store(key, ''.join(texts))
+
+class RecordReplayBackend:
+    """Records model responses to disk ('record') or serves only recordings ('replay')."""
+
+    def __init__(self, directory, mode='replay', inner=None, model_name=None):
+        if mode not in ('record', 'replay'):
+            raise ValueError(f"Unknown recording mode '{mode}'. Use 'record' or 'replay'.")
+        if mode == 'record' and inner is None:
+            raise ValueError("Record mode needs a backend to record from.")
+        self.directory = directory
+        self.mode = mode
+        self.inner = inner
+        self.model_name = model_name or getattr(inner, 'model_name', 'recorded')
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def load(self, key):
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as f:
+                return json.load(f)['text']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def store(self, key, text):
+        atomic_write_json(self._path(key), {'model': self.model_name, 'text': text, 'recorded_at': time.time()})
+
+    def get(self, api_key):
+        return _RecordingClient(self, api_key)
+
+    def __len__(self):
+        return sum(1 for name in os.listdir(self.directory) if name.endswith('.json'))
+
+# --- Mock ---
+
+_DOCUMENT_TYPE_PATTERN = re.compile(r'"document_type":\s*"(\w+)"')
+_MOCK_DESCRIPTIONS = [
+    ("PAIEMENT CB MARJANE", 'debit'), ("RETRAIT GAB", 'debit'), ("FACTURE IAM MOBILE", 'debit'),
+    ("PRELEVEMENT LYDEC", 'debit'), ("FRAIS TENUE DE COMPTE", 'debit'),
+    ("VIREMENT RECU SALAIRE", 'credit'), ("VERSEMENT ESPECES", 'credit'),
+]
+
+def _prompt_text(contents):
+    parts = contents if isinstance(contents, list) else [contents]
+    return "\n".join(part for part in parts if isinstance(part, str))
+
+def mock_extraction(document_type, seed, transactions=20):
+    """A well-formed extraction in the prompt schema, deterministic for a seed."""
+    rng = random.Random(seed)
+    year, month = rng.randint(2018, 2024), rng.randint(1, 12)
+    last_day = calendar.monthrange(year, month)[1]
+    rows = []
+    for _ in range(transactions):
+        description, side = rng.choice(_MOCK_DESCRIPTIONS)
+        date = f"{year}-{month:02d}-{rng.randint(1, last_day):02d}"
+        amount = round(rng.uniform(20, 5000), 2)
+        rows.append({
+            "transaction_date": date, "value_date": date, "description": description,
+            "debit": amount if side == 'debit' else None,
+            "credit": amount if side == 'credit' else None,
+        })
+    rows.sort(key=lambda t: t["transaction_date"])
+    total_debits = round(sum(t["debit"] or 0 for t in rows), 2)
+    total_credits = round(sum(t["credit"] or 0 for t in rows), 2)
+    opening = round(rng.uniform(1000, 50000), 2)
+    statement = document_type == 'monthly_statement'
+    return {
+        "document_type": document_type,
+        "bank_name": "Attijariwafa bank",
+        "account_holder": {"name": "MOCK", "address": None},
+        "account_details": {"account_number": "0000000000000001", "currency": "MAD"},
+        "statement_period": {"start_date": f"{year}-{month:02d}-01", "end_date": f"{year}-{month:02d}-{last_day}"},
+        "summary": {
+            "opening_balance": opening if statement else None,
+            "closing_balance": round(opening - total_debits + total_credits, 2) if statement else None,
+            "total_debits": total_debits, "total_credits": total_credits,
+        },
+        "transactions": rows,
+    }
+
+class _MockClient:
+    def __init__(self, backend):
+        self._backend = backend
+
+    def generate_content(self, contents, generation_config=None, stream=False):
+        backend = self._backend
+        text = backend.respond(contents, generation_config)
+        if not stream:
+            backend.wait(backend.latency_seconds)
+            return _TextResponse(text)
+        return self._stream(text)
+
+    def _stream(self, text):
+        # The delay is spread over the chunks, like a streamed reply
+        chunks = _split_text(text, 40)
+        for chunk in chunks:
+            self._backend.wait(self._backend.latency_seconds / len(chunks))
+            yield chunk
+
+class MockBackend:
+    """
+    Offline stand-in: extraction prompts get a synthetic document of the
+    requested type (derived from the request, so equal requests get equal
+    answers), anything else a short canned reply. Every call sleeps for
+    latency_seconds plus up to jitter_seconds.
+    """
+
+    def __init__(self, latency_seconds=0.5, jitter_seconds=0.0, transactions=20, model_name='mock'):
+        self.latency_seconds = latency_seconds
+        self.jitter_seconds = jitter_seconds
+        self.transactions = transactions
+        self.model_name = model_name
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def wait(self, seconds):
+        if self.jitter_seconds:
+            seconds += random.uniform(0, self.jitter_seconds)
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def respond(self, contents, generation_config=None):
+        with self._lock:
+            self.calls += 1
+        key = request_key(self.model_name, contents, generation_config)
+        match = _DOCUMENT_TYPE_PATTERN.search(_prompt_text(contents))
+        if match:
+            return json.dumps(mock_extraction(match.group(1), key, self.transactions), ensure_ascii=False)
+        return f"Mock reply ({key[:8]}): this response was generated offline without calling a model."
+
+    def get(self, api_key):
+        return _MockClient(self)
+
+def create_llm_backend(backend, model_name, recordings_dir=None, pool_options=None, **mock_options):
+    """Creates the configured LLM backend ('gemini', 'record', 'replay' or 'mock')."""
+    if backend == 'mock':
+        return MockBackend(**mock_options)
+    if backend == 'replay':
+        return RecordReplayBackend(recordings_dir, mode='replay', model_name=model_name)
+
+    # Imported here so the offline backends work without the Gemini SDK installed
+    from model_clients import ModelClientPool
+    gemini = ModelClientPool(model_name, **(pool_options or {}))
+    if backend == 'gemini':
+        return gemini
+    if backend == 'record':
+        return RecordReplayBackend(recordings_dir, mode='record', inner=gemini)
+    raise ValueError(f"Unknown LLM backend '{backend}'. Use 'gemini', 'record', 'replay' or 'mock'.")
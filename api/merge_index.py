@@ -0,0 +1,175 @@
+from bisect import bisect_left, bisect_right
+
+# --- Merge Indexes ---
+# Lookup structures used by smart_merge_data so a merge no longer scans every
+# document and every existing transaction. A MergeIndex can be reused across
+# several merges into the same list (e.g. a batch upload); it stays valid as
+# long as the list is only changed through smart_merge_data. It keeps:
+#   - the list position of every document, found by source_file_hash
+#   - the sort key (end date) of every position, so inserts bisect into place
+#     instead of re-sorting the whole list
+#   - the monthly statement periods, ordered like the list, for overlap queries
+# An insert shifts the positions of the documents after it only, which for
+# chronological uploads are few.
+
+def transaction_fingerprint(transaction):
+    """Dedup key for merged transactions: description followed by the date."""
+    return transaction.get('description', '') + str(transaction.get('transaction_date', ''))
+
+def statement_sort_key(document):
+    """The order smart_merge_data keeps documents in: by end date, undated first."""
+    return document.get('statement_period', {}).get('end_date', '') or '1900-01-01'
+
+def merge_candidate_ranges(documents):
+    """
+    What smart_merge_data can match for these documents: their source file
+    hashes, plus the (first, last) transaction dates of each transaction list,
+    since a list merges into a monthly statement whose period holds one of them.
+    """
+    hashes = {d.get('source_file_hash') for d in documents if d.get('source_file_hash')}
+    ranges = []
+    for document in documents:
+        if document.get('document_type') != 'transaction_list':
+            continue
+        dates = [t.get('transaction_date') for t in document.get('transactions') or []
+                 if isinstance(t.get('transaction_date'), str) and t.get('transaction_date')]
+        if dates:
+            ranges.append((min(dates), max(dates)))
+    return hashes, ranges
+
+class StatementPeriodIndex:
+    """
+    Periods of monthly statements ordered by end date (which is their order in
+    a sorted document list), queried with the sorted dates of incoming
+    transactions.
+    """
+
+    def __init__(self, documents=()):
+        self._ends = []
+        self._entries = []
+        for document in documents:
+            self.add(document)
+
+    def add(self, document):
+        if document.get('document_type') != 'monthly_statement':
+            return
+        period = document.get('statement_period', {})
+        start, end = period.get('start_date'), period.get('end_date')
+        if start and end:
+            # After equal end dates, as the document list places it
+            position = bisect_right(self._ends, end)
+            self._ends.insert(position, end)
+            self._entries.insert(position, (start, end, document))
+
+    def first_overlapping(self, sorted_dates):
+        """
+        Returns (statement, overlapping_dates) for the first statement, in list
+        order, whose period contains at least one of the dates, else (None, None).
+        Only statements ending on or after the earliest date are probed.
+        """
+        if not sorted_dates:
+            return None, None
+        for position in range(bisect_left(self._ends, sorted_dates[0]), len(self._entries)):
+            start, end, document = self._entries[position]
+            lo = bisect_left(sorted_dates, start)
+            hi = bisect_right(sorted_dates, end)
+            if lo < hi:
+                return document, set(sorted_dates[lo:hi])
+        return None, None
+
+def _scan_overlapping(documents, sorted_dates):
+    # List order of an unsorted list (e.g. after a replace moved an end date)
+    for document in documents:
+        entry = StatementPeriodIndex([document])
+        match = entry.first_overlapping(sorted_dates)
+        if match[0] is not None:
+            return match
+    return None, None
+
+class MergeIndex:
+    """Positions by source_file_hash, sort keys, statement periods and cached fingerprint sets."""
+
+    def __init__(self, documents):
+        self._by_hash = {}
+        self._positions = {}
+        self._fingerprints = {}
+        self._periods = None
+        self._index_list(documents)
+
+    def _index_list(self, documents):
+        self._by_hash = {}
+        self._positions = {}
+        self._keys = [statement_sort_key(document) for document in documents]
+        for position, document in enumerate(documents):
+            self._by_hash.setdefault(document.get('source_file_hash'), []).append(document)
+            self._positions[id(document)] = position
+        self._sorted = all(a <= b for a, b in zip(self._keys, self._keys[1:]))
+        self._periods = None
+
+    def ensure_sorted(self, documents):
+        """Sorts the list by end date, like smart_merge_data after inserts and merges."""
+        if not self._sorted:
+            documents.sort(key=statement_sort_key)
+            self._index_list(documents)
+
+    def insert(self, documents, document):
+        """Inserts a document at its sorted position (after equal end dates)."""
+        self.ensure_sorted(documents)
+        key = statement_sort_key(document)
+        position = bisect_right(self._keys, key)
+        documents.insert(position, document)
+        self._keys.insert(position, key)
+        for later in range(position + 1, len(documents)):
+            self._positions[id(documents[later])] = later
+        self._positions[id(document)] = position
+        self._by_hash.setdefault(document.get('source_file_hash'), []).append(document)
+        if self._periods is not None:
+            self._periods.add(document)
+
+    def replace(self, documents, position, new_document):
+        """Puts new_document at position in place of the document there (the list is not re-sorted)."""
+        old_document = documents[position]
+        documents[position] = new_document
+        matches = self._by_hash.get(old_document.get('source_file_hash'), [])
+        for i, document in enumerate(matches):
+            if document is old_document:
+                del matches[i]
+                break
+        self._by_hash.setdefault(new_document.get('source_file_hash'), []).append(new_document)
+        del self._positions[id(old_document)]
+        self._positions[id(new_document)] = position
+        self._fingerprints.pop(id(old_document), None)
+
+        key = statement_sort_key(new_document)
+        self._keys[position] = key
+        if (position and self._keys[position - 1] > key) or (
+                position + 1 < len(self._keys) and key > self._keys[position + 1]):
+            self._sorted = False
+        if 'monthly_statement' in (old_document.get('document_type'), new_document.get('document_type')):
+            self._periods = None
+
+    def find_by_hash(self, file_hash):
+        """Returns the position of the first document with this hash, or None."""
+        matches = self._by_hash.get(file_hash)
+        if not matches:
+            return None
+        return min(self._positions[id(document)] for document in matches)
+
+    def first_overlapping(self, documents, sorted_dates):
+        """The first monthly statement in list order whose period contains one of the dates."""
+        if not self._sorted:
+            return _scan_overlapping(documents, sorted_dates)
+        if self._periods is None:
+            # Built once, then kept current by insert() for the rest of the batch
+            self._periods = StatementPeriodIndex(documents)
+        return self._periods.first_overlapping(sorted_dates)
+
+    def fingerprints(self, statement, transactions):
+        """Returns the (cached) fingerprint set of a statement's transactions."""
+        if statement.get('transactions') is not transactions:
+            return {transaction_fingerprint(t) for t in transactions}
+        entry = self._fingerprints.get(id(statement))
+        if entry is None or entry[0] is not statement:
+            entry = (statement, {transaction_fingerprint(t) for t in transactions})
+            self._fingerprints[id(statement)] = entry
+        return entry[1]
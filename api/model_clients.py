@@ -0,0 +1,70 @@
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+import google.generativeai as genai
+from google.generativeai import client as genai_client
+
+# --- Model Client Pool ---
+# genai.configure() mutates process-wide SDK state, so concurrent requests with
+# different user keys could end up calling the model with each other's key.
+# Instead each API key gets its own GenerativeModel bound to a private service
+# client. Clients are reused across requests, looked up by a hash of the key
+# (the raw key is never used as a cache key), and dropped after a TTL or when
+# the pool is full (least recently used first).
+
+def hash_api_key(api_key):
+    """Stable, non-reversible identifier for an API key."""
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+
+def _create_model(api_key, model_name):
+    # A dedicated client manager keeps the SDK's defaults (transport, user agent)
+    # without touching the global configuration.
+    manager = genai_client._ClientManager()
+    manager.configure(api_key=api_key)
+    model = genai.GenerativeModel(model_name)
+    model._client = manager.make_client("generative")
+    return model
+
+class ModelClientPool:
+    """Thread-safe LRU/TTL pool of GenerativeModel instances, one per API key."""
+
+    def __init__(self, model_name, max_clients=64, ttl_seconds=3600, factory=_create_model):
+        self.model_name = model_name
+        self.max_clients = max_clients
+        self.ttl_seconds = ttl_seconds
+        self._factory = factory
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, api_key):
+        """Returns the model client for an API key, creating it on first use."""
+        if not api_key:
+            raise ValueError("Gemini API key is missing.")
+        key = hash_api_key(api_key)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._clients.get(key)
+            if entry and (not self.ttl_seconds or now - entry[1] <= self.ttl_seconds):
+                self._clients.move_to_end(key)
+                return entry[0]
+
+        # Built outside the lock so a slow client setup never blocks other keys
+        model = self._factory(api_key, self.model_name)
+
+        with self._lock:
+            entry = self._clients.get(key)
+            if entry and (not self.ttl_seconds or now - entry[1] <= self.ttl_seconds):
+                # Another thread created it first; keep a single client per key
+                self._clients.move_to_end(key)
+                return entry[0]
+            self._clients[key] = (model, now)
+            self._clients.move_to_end(key)
+            while len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+        return model
+
+    def __len__(self):
+        with self._lock:
+            return len(self._clients)
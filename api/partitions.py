@@ -0,0 +1,313 @@
+import os
+import re
+import json
+import hashlib
+import weakref
+import threading
+from collections import OrderedDict, defaultdict
+
+from storage import create_storage
+from analysis_cache import VersionedCache
+from persistence import WriteCoalescer, atomic_write_json
+from merge_index import statement_sort_key
+
+# --- User and Account Partitions ---
+# Statements are stored per user and per account number:
+#   <root>/<user>/<account>/partition.json  -> the original user id and account number
+#   <root>/<user>/<account>/...             -> that partition's statement store and analysis cache
+# A Partition also carries the in-memory state derived from its data (query
+# indexes, encoded responses, merge queue), so a request loads, merges and
+# caches only the partition it addresses, however many other users exist.
+#
+# The user id is a namespace, not an identity: it is whatever the caller
+# passes (see _request_user_id in app.py), and partitions do no access control.
+#
+# There is at most one Partition object per (user, account), so concurrent
+# requests always share its merge queue and in-memory indexes. Partitions with
+# a merge in progress are never evicted, and an evicted partition that an
+# in-flight request still holds is reused rather than opened a second time.
+#
+# Transaction lists often carry no account number. Such a document joins the
+# user's only account, or the account with a statement overlapping its period,
+# so it is still merged with that statement. Requests that name no account
+# read a CombinedView of all the user's accounts, like the single store did.
+
+DEFAULT_USER_ID = 'default'
+UNKNOWN_ACCOUNT = 'unknown'
+META_NAME = 'partition.json'
+LEGACY_MARKER = '.legacy_migrated'
+
+_SAFE_NAME = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_-]{0,63}$')
+
+def safe_name(value):
+    """Directory name for a user id or account number; unusual values are hashed."""
+    if _SAFE_NAME.match(value):
+        return value
+    return 'h-' + hashlib.sha256(value.encode('utf-8')).hexdigest()[:24]
+
+def normalize_account(account):
+    """Account number without spaces, or UNKNOWN_ACCOUNT."""
+    account = re.sub(r'\s+', '', str(account or ''))
+    return account or UNKNOWN_ACCOUNT
+
+def account_of(document):
+    """The partition account of a document (its account_details.account_number)."""
+    return normalize_account((document.get('account_details') or {}).get('account_number'))
+
+def document_dates(document):
+    """(first, last) date of a document: its statement period, else its transaction dates."""
+    period = document.get('statement_period') or {}
+    dates = sorted(t['transaction_date'] for t in document.get('transactions') or []
+                   if isinstance(t.get('transaction_date'), str) and t['transaction_date'])
+    start = period.get('start_date') or (dates[0] if dates else None)
+    end = period.get('end_date') or (dates[-1] if dates else None)
+    return start, end
+
+def _overlaps(dates, start, end):
+    return bool(dates[0] and dates[1] and start and end and start <= dates[1] and dates[0] <= end)
+
+class Partition:
+    """One user's statements for one account, with its caches and merge queue."""
+
+    def __init__(self, user_id, account, directory, backend, merge, **log_options):
+        self.user_id = user_id
+        self.account = account
+        self.directory = directory
+        # Distinguishes partitions in ETags: equal data versions in two partitions are different data
+        self.tag = hashlib.sha256(f"{user_id}\0{account}".encode('utf-8')).hexdigest()[:12]
+        os.makedirs(directory, exist_ok=True)
+
+        meta_path = os.path.join(directory, META_NAME)
+        if not os.path.exists(meta_path):
+            atomic_write_json(meta_path, {'user_id': user_id, 'account': account})
+
+        self.storage = create_storage(
+            backend,
+            os.path.join(directory, 'statements.json'),
+            os.path.join(directory, 'aggregates.json'),
+            os.path.join(directory, 'statements.db'),
+            os.path.join(directory, 'statement_log'),
+            **log_options
+        )
+        self.analysis_cache = VersionedCache(os.path.join(directory, 'analysis_cache'))
+
+        # Derived state, each rebuilt lazily once per data version
+        self.transaction_index = {'version': None, 'index': None}
+        self.transaction_index_lock = threading.Lock()
+        self.chat_search_index = {'version': None, 'index': None}
+        self.chat_search_index_lock = threading.Lock()
+        self.encoded_responses = {'version': None, 'bodies': {}}
+        self.encoded_responses_lock = threading.Lock()
+
+        # Concurrent uploads to this partition are merged and saved together
+        self.merge_writer = WriteCoalescer(lambda documents: merge(self, documents))
+
+class CombinedStorage:
+    """Read-only storage interface over several partitions, ordered like one sorted store."""
+
+    def __init__(self, partitions):
+        self.partitions = partitions
+
+    def get_data_version(self):
+        return ','.join(f"{p.account}={p.storage.get_data_version()}" for p in self.partitions)
+
+    def load_documents(self):
+        documents = [d for p in self.partitions for d in p.storage.load_documents()]
+        documents.sort(key=statement_sort_key)
+        return documents
+
+    def load_aggregates(self):
+        combined = None
+        entries = []
+        for partition in self.partitions:
+            aggregates = partition.storage.load_aggregates()
+            if combined is None:
+                combined = {'format_version': aggregates.get('format_version'), 'order': [], 'documents': {}}
+            combined['documents'].update(aggregates['documents'])
+            entries.extend((aggregates['documents'][key].get('end_date') or '1900-01-01', key)
+                           for key in aggregates['order'] if key in aggregates['documents'])
+        # Stable, so documents with equal end dates keep their account and storage order
+        entries.sort(key=lambda entry: entry[0])
+        combined['order'] = [key for _, key in entries]
+        return combined
+
+class CombinedView:
+    """
+    All of one user's accounts as a single read-only partition, for requests
+    that name no account. Has the derived-state attributes of a Partition.
+    """
+
+    def __init__(self, user_id, partitions, directory):
+        self.user_id = user_id
+        self.account = None
+        self.accounts = [p.account for p in partitions]
+        self.tag = hashlib.sha256(
+            "\0".join([user_id] + self.accounts).encode('utf-8')
+        ).hexdigest()[:12]
+        self.storage = CombinedStorage(partitions)
+        self.analysis_cache = VersionedCache(os.path.join(directory, 'analysis_cache'))
+
+        self.transaction_index = {'version': None, 'index': None}
+        self.transaction_index_lock = threading.Lock()
+        self.chat_search_index = {'version': None, 'index': None}
+        self.chat_search_index_lock = threading.Lock()
+        self.encoded_responses = {'version': None, 'bodies': {}}
+        self.encoded_responses_lock = threading.Lock()
+
+class PartitionRegistry:
+    """Opens partitions on demand and keeps the most recently used idle ones in memory."""
+
+    def __init__(self, root_dir, backend, merge, max_open=256, **log_options):
+        self.root_dir = root_dir
+        self.backend = backend
+        self.merge = merge
+        self.max_open = max_open
+        self.log_options = log_options
+        self._open = OrderedDict()
+        # Evicted partitions that are still referenced elsewhere (e.g. by a running request)
+        self._closed = weakref.WeakValueDictionary()
+        self._combined = OrderedDict()
+        self._account_names = {}
+        self._lock = threading.Lock()
+        os.makedirs(root_dir, exist_ok=True)
+
+    def _user_dir(self, user_id):
+        return os.path.join(self.root_dir, safe_name(user_id))
+
+    def get(self, user_id, account):
+        """Returns the partition for (user_id, account), creating it on first use."""
+        account = normalize_account(account)
+        key = (user_id, account)
+        with self._lock:
+            partition = self._open.get(key)
+            if partition is not None:
+                self._open.move_to_end(key)
+                return partition
+
+            partition = self._closed.pop(key, None)
+            if partition is None:
+                directory = os.path.join(self._user_dir(user_id), safe_name(account))
+                partition = Partition(user_id, account, directory, self.backend, self.merge, **self.log_options)
+            self._open[key] = partition
+            self._evict(keep=key)
+        return partition
+
+    def _evict(self, keep):
+        # Least recently used first, skipping partitions with queued or running merges
+        while len(self._open) > self.max_open:
+            victim = next((key for key, partition in self._open.items()
+                           if key != keep and not partition.merge_writer.busy()), None)
+            if victim is None:
+                return
+            self._closed[victim] = self._open.pop(victim)
+
+    def accounts(self, user_id):
+        """Account numbers stored for a user (a listing of that user's directory only)."""
+        user_dir = self._user_dir(user_id)
+        try:
+            names = os.listdir(user_dir)
+        except OSError:
+            return []
+
+        accounts = []
+        for name in names:
+            path = os.path.join(user_dir, name)
+            account = self._account_names.get(path)
+            if account is None:
+                try:
+                    with open(os.path.join(path, META_NAME), 'r', encoding='utf-8') as f:
+                        account = json.load(f)['account']
+                except (OSError, ValueError, KeyError):
+                    continue
+                self._account_names[path] = account
+            accounts.append(account)
+        return sorted(accounts)
+
+    def find(self, user_id, account):
+        """The partition for a stored account, or None if the user has no such account."""
+        account = normalize_account(account)
+        if account not in self.accounts(user_id):
+            return None
+        return self.get(user_id, account)
+
+    def combined(self, user_id):
+        """A CombinedView of every stored account of the user (rebuilt when accounts are added)."""
+        accounts = self.accounts(user_id)
+        with self._lock:
+            view = self._combined.get(user_id)
+            if view is not None and view.accounts == accounts:
+                self._combined.move_to_end(user_id)
+                return view
+        view = CombinedView(
+            user_id, [self.get(user_id, account) for account in accounts],
+            # Not a partition directory: it has no partition.json, so accounts() skips it
+            os.path.join(self._user_dir(user_id), '.combined')
+        )
+        with self._lock:
+            self._combined[user_id] = view
+            while len(self._combined) > self.max_open:
+                self._combined.popitem(last=False)
+        return view
+
+    def resolve_accounts(self, user_id, documents):
+        """
+        The partition account of each document. A document without an account
+        number goes to the user's only account (stored or in this batch), else
+        to the account with a monthly statement overlapping its dates, else to
+        UNKNOWN_ACCOUNT.
+        """
+        accounts = [account_of(document) for document in documents]
+        if UNKNOWN_ACCOUNT not in accounts:
+            return accounts
+
+        known = {a for a in self.accounts(user_id) if a != UNKNOWN_ACCOUNT}
+        known.update(a for a in accounts if a != UNKNOWN_ACCOUNT)
+        periods = None
+        for position, document in enumerate(documents):
+            if accounts[position] != UNKNOWN_ACCOUNT or not known:
+                continue
+            if len(known) == 1:
+                accounts[position] = next(iter(known))
+                continue
+            if periods is None:
+                periods = self._statement_periods(user_id, known, documents, accounts)
+            dates = document_dates(document)
+            for account, start, end in periods:
+                if _overlaps(dates, start, end):
+                    accounts[position] = account
+                    break
+        return accounts
+
+    def _statement_periods(self, user_id, known, documents, accounts):
+        # (account, start, end) of every monthly statement, stored or in the batch
+        periods = []
+        stored = set(self.accounts(user_id))
+        for account in sorted(known):
+            if account not in stored:
+                continue
+            aggregates = self.get(user_id, account).storage.load_aggregates()
+            for doc_summary in aggregates['documents'].values():
+                if doc_summary.get('document_type') == 'monthly_statement':
+                    periods.append((account, doc_summary.get('start_date'), doc_summary.get('end_date')))
+        for document, account in zip(documents, accounts):
+            if account != UNKNOWN_ACCOUNT and document.get('document_type') == 'monthly_statement':
+                periods.append((account,) + document_dates(document))
+        return periods
+
+    def legacy_migrated(self):
+        return os.path.exists(os.path.join(self.root_dir, LEGACY_MARKER))
+
+    def migrate_legacy(self, documents, user_id=DEFAULT_USER_ID):
+        """One-shot split of a single-store history into per-account partitions of user_id."""
+        by_account = defaultdict(list)
+        documents = documents or []
+        for document, account in zip(documents, self.resolve_accounts(user_id, documents)):
+            by_account[account].append(document)
+        for account, account_documents in by_account.items():
+            partition = self.get(user_id, account)
+            with partition.storage.lock():
+                if partition.storage.get_data_version() == 0:
+                    partition.storage.save_changes(account_documents, [('insert', d) for d in account_documents])
+        with open(os.path.join(self.root_dir, LEGACY_MARKER), 'w', encoding='utf-8') as f:
+            f.write(user_id)
+        print(f"--- ✅ Migrated {len(documents or [])} documents into {len(by_account)} account partitions ---")
@@ -0,0 +1,99 @@
+import io
+import os
+import atexit
+import signal
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import PyPDF2
+
+# --- Per-Page PDF Text Extraction ---
+# PyPDF2 text extraction is CPU bound and done page by page, so long PDFs are
+# split into contiguous page ranges that are extracted in a process pool.
+# Page texts are cached per (file hash, page index) in the extraction cache,
+# which makes repeated fallbacks and reprocessing of a known file free.
+# The pool never forks the server itself: by the time a long PDF arrives it
+# runs upload threads, SQLite connections and gRPC clients whose locks a forked
+# child could inherit held. Workers come from a forkserver (a clean,
+# single-threaded process that only preloads this module), or are spawned
+# where forkserver is unavailable. Workers ignore Ctrl-C; the pool is shut down
+# by the server process when it exits.
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _ignore_interrupts():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def _get_pool(max_workers):
+    """The shared extraction pool, created once (sized by the first caller)."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            if 'forkserver' in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context('forkserver')
+                context.set_forkserver_preload([__name__])
+            else:
+                context = multiprocessing.get_context('spawn')
+            _pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=context, initializer=_ignore_interrupts)
+        return _pool
+
+@atexit.register
+def shutdown_pool():
+    """Stops the extraction pool's workers, if the pool was started."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+def _extract_range(pdf_data, page_indexes):
+    reader = PyPDF2.PdfReader(io.BytesIO(pdf_data))
+    return [(index, reader.pages[index].extract_text() or '') for index in page_indexes]
+
+def count_pages(pdf_data):
+    """Returns the number of pages in a PDF."""
+    return len(PyPDF2.PdfReader(io.BytesIO(pdf_data)).pages)
+
+def extract_page_texts(pdf_data, file_hash=None, cache=None, page_indexes=None,
+                       max_workers=None, parallel_min_pages=8):
+    """
+    Returns the extracted text of each requested page (all pages by default), in
+    page order. Pages found in the cache are not parsed again. When at least
+    parallel_min_pages pages are missing they are extracted in a process pool.
+    """
+    if page_indexes is None:
+        page_indexes = range(count_pages(pdf_data))
+    page_indexes = list(page_indexes)
+
+    texts = {}
+    if cache is not None and file_hash:
+        cached = cache.get_page_texts(file_hash)
+        texts = {index: cached[index] for index in page_indexes if index in cached}
+
+    missing = [index for index in page_indexes if index not in texts]
+    if missing:
+        workers = max_workers or min(4, os.cpu_count() or 1)
+        extracted = []
+        if workers > 1 and len(missing) >= parallel_min_pages:
+            chunk_size = -(-len(missing) // workers)
+            chunks = [missing[i:i + chunk_size] for i in range(0, len(missing), chunk_size)]
+            try:
+                pool = _get_pool(workers)
+                for result in pool.map(_extract_range, [pdf_data] * len(chunks), chunks):
+                    extracted.extend(result)
+            except Exception as e:
+                print(f"--- ❌ Parallel page extraction failed, extracting serially: {e} ---")
+                extracted = []
+        if not extracted:
+            extracted = _extract_range(pdf_data, missing)
+
+        new_pages = dict(extracted)
+        texts.update(new_pages)
+        if cache is not None and file_hash:
+            try:
+                cache.put_page_texts(file_hash, new_pages)
+            except Exception as e:
+                print(f"--- ❌ Could not cache page texts: {e} ---")
+
+    return [texts[index] for index in page_indexes]
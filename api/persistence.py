@@ -0,0 +1,175 @@
+import os
+import json
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl  # POSIX only: enables inter-process file locks
+except ImportError:
+    fcntl = None
+
+# --- Durable File Persistence ---
+# Helpers shared by the file-based stores:
+#   file_lock(path)            -> exclusive lock held across processes (flock on
+#                                 '<path>.lock'), so load-merge-save cycles of
+#                                 several workers never interleave
+#   atomic_write_json(...)     -> write to a temp file, fsync, rename over the
+#                                 target, fsync the directory; a crash leaves
+#                                 either the old or the new file, never half of one
+#   load_json_with_recovery()  -> falls back to the '<path>.bak' snapshot of the
+#                                 last good version when the file is corrupt
+#   WriteCoalescer             -> group commit: concurrent callers queue their
+#                                 work and one of them applies the whole queue
+
+SNAPSHOT_SUFFIX = '.bak'
+
+class CorruptDataError(ValueError):
+    """A data file and its snapshot are both unreadable."""
+
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+def _thread_lock(path):
+    with _thread_locks_guard:
+        return _thread_locks.setdefault(os.path.abspath(path), threading.RLock())
+
+@contextmanager
+def file_lock(path):
+    """Exclusive lock on path, shared by threads and (on POSIX) processes."""
+    with _thread_lock(path):
+        if fcntl is None:
+            yield
+            return
+        with open(path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+def _fsync_directory(directory):
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _snapshot(path):
+    """Keeps the current file as '<path>.bak' (a hard link when possible, else a copy)."""
+    snapshot_path = path + SNAPSHOT_SUFFIX
+    tmp_path = snapshot_path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        os.link(path, tmp_path)
+    except OSError:
+        shutil.copy2(path, tmp_path)
+    os.replace(tmp_path, snapshot_path)
+
+def atomic_write_json(path, data, indent=None, keep_snapshot=False):
+    """
+    Atomically replaces path with data serialized as JSON. With keep_snapshot,
+    the previous version is kept as '<path>.bak' for corruption recovery.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=indent, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        if keep_snapshot and os.path.exists(path):
+            _snapshot(path)
+        os.replace(tmp_path, path)
+        _fsync_directory(directory)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def atomic_write_text(path, text):
+    """Atomically replaces path with a short text value."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def load_json_with_recovery(path, default):
+    """
+    Loads JSON from path (default if it does not exist). A corrupt file is
+    replaced by its snapshot; if the snapshot is unusable too, CorruptDataError
+    is raised instead of returning empty data that a later save would persist.
+    """
+    if not os.path.exists(path):
+        return default
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        error = e
+
+    snapshot_path = path + SNAPSHOT_SUFFIX
+    try:
+        with open(snapshot_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        raise CorruptDataError(f"'{path}' is corrupt ({error}) and no usable snapshot exists.")
+
+    print(f"--- ❌ '{path}' is corrupt ({error}), restoring the last good snapshot ---")
+    shutil.copy2(snapshot_path, path)
+    return data
+
+
+class WriteCoalescer:
+    """
+    Group commit for expensive writes. Callers submit items; whoever gets the
+    write lock first applies every queued item in one call to apply(items),
+    and the other callers just wait for that result.
+    """
+
+    def __init__(self, apply):
+        self._apply = apply
+        self._write_lock = threading.Lock()
+        self._queue_lock = threading.Lock()
+        self._queue = []
+
+    def submit(self, items):
+        """Queues items and returns apply()'s result for the batch that included them."""
+        request = {'items': list(items), 'done': False, 'result': None, 'error': None}
+        with self._queue_lock:
+            self._queue.append(request)
+
+        with self._write_lock:
+            if not request['done']:
+                with self._queue_lock:
+                    batch, self._queue = self._queue, []
+                try:
+                    result = self._apply([item for queued in batch for item in queued['items']])
+                    for queued in batch:
+                        queued['result'] = result
+                except Exception as e:
+                    for queued in batch:
+                        queued['error'] = e
+                finally:
+                    for queued in batch:
+                        queued['done'] = True
+
+        if request['error'] is not None:
+            raise request['error']
+        return request['result']
+
+    def busy(self):
+        """True while items are queued or a write is in progress."""
+        return self._write_lock.locked() or bool(self._queue)
@@ -0,0 +1,149 @@
+import re
+import calendar
+from datetime import datetime, timedelta
+
+# --- Recurring Payment Detection ---
+# Debits are grouped by a normalized merchant key (dates and times stripped)
+# in one pass. Each group's dated occurrences are then sorted once, and the
+# gaps between charges decide the cadence (weekly, monthly or annual). The
+# group also gets its amount drift and the date the next charge is expected.
+
+_DATE_PATTERN = re.compile(r'\d{2}/\d{2}(/\d{4})?')
+_TIME_PATTERN = re.compile(r'\d{2}H\d{2}')
+_SPACE_PATTERN = re.compile(r'\s+')
+
+MIN_RECURRING_OCCURRENCES = 3
+MIN_KEY_LENGTH = 5
+
+# (name, smallest gap in days, largest gap in days)
+CADENCES = [
+    ('weekly', 5, 9),
+    ('monthly', 26, 35),
+    ('annual', 350, 380),
+]
+# Share of gaps that must fall inside the cadence window
+CADENCE_MATCH_RATIO = 0.6
+
+def normalize_merchant(description):
+    """Strips dates and times from a description so repeated charges group together."""
+    desc = _DATE_PATTERN.sub('', description)
+    desc = _TIME_PATTERN.sub('', desc)
+    return _SPACE_PATTERN.sub(' ', desc).strip().upper()
+
+def recurring_key(transaction):
+    """Returns the merchant key for a debit, or None if it is not meaningful enough."""
+    desc = transaction.get('description', '')
+    if not desc:
+        return None
+    key = normalize_merchant(desc)
+    return key if len(key) > MIN_KEY_LENGTH else None
+
+def group_recurring(transactions, markers=None):
+    """
+    Groups debits by merchant key in one pass, in the order given.
+    Returns {key: {'count', 'total_amount', 'first', 'occurrences': [[date, amount], ...]}},
+    where 'first' is the marker (from markers, one per transaction) of the
+    group's first debit, or its position in transactions.
+    """
+    groups = {}
+    for position, transaction in enumerate(transactions):
+        marker = markers[position] if markers is not None else position
+        if not transaction.get('debit'):
+            continue
+        key = recurring_key(transaction)
+        if key is None:
+            continue
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = {'count': 0, 'total_amount': 0, 'first': marker, 'occurrences': []}
+        group['count'] += 1
+        group['total_amount'] += transaction['debit']
+        trans_date = transaction.get('transaction_date')
+        if trans_date:
+            group['occurrences'].append([trans_date, transaction['debit']])
+    return groups
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(value[:10], '%Y-%m-%d')
+    except (TypeError, ValueError):
+        return None
+
+def _add_months(date, months):
+    month_index = date.month - 1 + months
+    year, month = date.year + month_index // 12, month_index % 12 + 1
+    day = min(date.day, calendar.monthrange(year, month)[1])
+    return date.replace(year=year, month=month, day=day)
+
+def analyze_series(occurrences):
+    """
+    Detects cadence and amount drift for one merchant's [date, amount] occurrences.
+    Occurrences do not need to be sorted.
+    """
+    dated = sorted((d, amount, raw) for raw, amount in occurrences for d in [_parse_date(raw)] if d)
+    result = {
+        'cadence': 'irregular',
+        'interval_days': None,
+        'last_date': dated[-1][2] if dated else None,
+        'next_expected_date': None,
+        'amount_drift': 0,
+        'amount_drift_percentage': 0,
+    }
+    if not dated:
+        return result
+
+    first_amount, last_amount = dated[0][1], dated[-1][1]
+    result['amount_drift'] = last_amount - first_amount
+    result['amount_drift_percentage'] = ((last_amount - first_amount) / first_amount * 100) if first_amount else 0
+
+    # Same-day duplicates (e.g. split charges) count as one billing event
+    days = []
+    for d, _, _ in dated:
+        if not days or d != days[-1]:
+            days.append(d)
+    gaps = [(b - a).days for a, b in zip(days, days[1:])]
+    if not gaps:
+        return result
+
+    gaps_sorted = sorted(gaps)
+    median_gap = gaps_sorted[len(gaps_sorted) // 2]
+    result['interval_days'] = median_gap
+
+    for name, low, high in CADENCES:
+        if low <= median_gap <= high:
+            matching = sum(1 for gap in gaps if low <= gap <= high)
+            if matching / len(gaps) >= CADENCE_MATCH_RATIO:
+                result['cadence'] = name
+            break
+
+    last = days[-1]
+    if result['cadence'] == 'weekly':
+        next_date = last + timedelta(days=7)
+    elif result['cadence'] == 'monthly':
+        next_date = _add_months(last, 1)
+    elif result['cadence'] == 'annual':
+        next_date = _add_months(last, 12)
+    else:
+        next_date = None
+    if next_date:
+        result['next_expected_date'] = next_date.strftime('%Y-%m-%d')
+    return result
+
+def detect_recurring(groups, min_occurrences=MIN_RECURRING_OCCURRENCES):
+    """
+    Turns merchant groups (see group_recurring) into recurring-expense entries,
+    keeping only merchants charged at least min_occurrences times.
+    """
+    recurring = {}
+    for key, group in groups.items():
+        if group['count'] < min_occurrences:
+            continue
+        entry = {
+            'count': group['count'],
+            'total_amount': group['total_amount'],
+            'avg_amount': group['total_amount'] / group['count'],
+            'dates': sorted(date for date, _ in group['occurrences']),
+        }
+        entry.update(analyze_series(group['occurrences']))
+        recurring[key] = entry
+    return recurring
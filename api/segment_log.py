@@ -0,0 +1,342 @@
+import os
+import json
+import threading
+from bisect import bisect_left, bisect_right
+
+from persistence import atomic_write_text, file_lock, load_json_with_recovery
+from financial_aggregates import build_aggregates, document_key, summarize_document, summary_version, update_aggregates
+from merge_index import merge_candidate_ranges, statement_sort_key
+
+# --- Append-Only Segment Log Backend ---
+# Statement data lives in a directory holding one snapshot plus log segments:
+#   snapshot.json         -> {'data_version', 'segment', 'documents', 'aggregates'}
+#   segment-00000042.log  -> one compact JSON record per save, appended and fsynced
+# A save appends a record describing the smart_merge_data outcome:
+#   insert  -> the new document
+#   replace -> the re-extracted document
+#   merge   -> only the transactions appended to an existing statement, plus its summary
+# so its cost depends on the uploaded document, not on the size of the history.
+# Startup loads the snapshot and replays the segments written after it. Once
+# the segments grow past a threshold, a background thread folds everything
+# into a new snapshot and deletes the segments it covers.
+#
+# In memory, documents are kept in end-date order with their keys and sort
+# keys, so a merge's candidates are found by key and by bisecting on dates,
+# and a save applies its record exactly like a replay does.
+
+SNAPSHOT_NAME = 'snapshot.json'
+SEGMENT_PREFIX = 'segment-'
+SEGMENT_SUFFIX = '.log'
+
+class SegmentLogStorage:
+    """Snapshot plus append-only log of merge outcomes, replayed on startup."""
+
+    def __init__(self, log_dir, legacy_json_path=None, segment_max_bytes=8 * 1024 * 1024,
+                 compact_threshold_bytes=32 * 1024 * 1024):
+        self.log_dir = log_dir
+        self.segment_max_bytes = segment_max_bytes
+        self.compact_threshold_bytes = compact_threshold_bytes
+        self.snapshot_path = os.path.join(log_dir, SNAPSHOT_NAME)
+        self._state_lock = threading.RLock()
+        self._compacting = False
+        os.makedirs(log_dir, exist_ok=True)
+
+        with self.lock():
+            if legacy_json_path and not os.path.exists(self.snapshot_path) and not self._segment_ids():
+                self._migrate_from_json(legacy_json_path)
+            self._reload()
+
+    # --- Files ---
+
+    def lock(self):
+        return file_lock(os.path.join(self.log_dir, 'log'))
+
+    def _segment_path(self, segment_id):
+        return os.path.join(self.log_dir, f"{SEGMENT_PREFIX}{segment_id:08d}{SEGMENT_SUFFIX}")
+
+    def _segment_ids(self):
+        ids = []
+        for name in os.listdir(self.log_dir):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+                try:
+                    ids.append(int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]))
+                except ValueError:
+                    continue
+        return sorted(ids)
+
+    def _write_snapshot(self, data_version, segment_id, documents, aggregates):
+        payload = json.dumps({
+            'data_version': data_version,
+            'segment': segment_id,
+            'documents': documents,
+            'aggregates': aggregates,
+        }, ensure_ascii=False, separators=(',', ':'))
+        atomic_write_text(self.snapshot_path, payload)
+
+    def _migrate_from_json(self, json_path):
+        """One-shot import of the legacy JSON file as the first snapshot."""
+        if not os.path.exists(json_path):
+            return
+        try:
+            documents = load_json_with_recovery(json_path, [])
+        except ValueError as e:
+            print(f"--- ❌ Could not migrate legacy data file '{json_path}': {e} ---")
+            return
+        self._write_snapshot(1, 0, documents, build_aggregates(documents))
+        print(f"--- ✅ Migrated {len(documents)} documents from '{json_path}' to the segment log ---")
+
+    # --- Replay ---
+
+    def _reload(self):
+        """Loads the snapshot, then replays every later segment."""
+        with self._state_lock:
+            self._loaded_snapshot = self._snapshot_stamp()
+            snapshot = load_json_with_recovery(self.snapshot_path, None) or {}
+            self._documents = snapshot.get('documents', [])
+            self._data_version = snapshot.get('data_version', 0)
+            self._snapshot_segment = snapshot.get('segment', 0)
+            self._index_documents()
+
+            aggregates = snapshot.get('aggregates')
+            if not aggregates or aggregates.get('format_version') != summary_version():
+                aggregates = None
+            self._aggregates = aggregates
+
+            self._segment = self._snapshot_segment + 1
+            self._offset = 0
+            self._replayed_bytes = 0
+            self._catch_up()
+
+    def _snapshot_stamp(self):
+        try:
+            stat = os.stat(self.snapshot_path)
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _catch_up(self):
+        """Applies records appended (possibly by other processes) since the last read."""
+        with self._state_lock:
+            if self._snapshot_stamp() != self._loaded_snapshot:
+                # Another process compacted the log; its snapshot replaces our state
+                return self._reload()
+            while True:
+                path = self._segment_path(self._segment)
+                if os.path.exists(path):
+                    size = os.path.getsize(path)
+                    if size > self._offset:
+                        self._replay(path, size)
+                elif self._offset:
+                    return self._reload()
+                if not os.path.exists(self._segment_path(self._segment + 1)):
+                    return
+                self._segment += 1
+                self._offset = 0
+
+    def _replay(self, path, size):
+        with open(path, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read(size - self._offset)
+        consumed = 0
+        for line in data.splitlines(keepends=True):
+            if not line.endswith(b'\n'):
+                break  # Torn tail from an interrupted append; ignored until completed
+            consumed += len(line)
+            if line.strip():
+                self._apply_record(json.loads(line))
+        self._offset += consumed
+        self._replayed_bytes += consumed
+
+    # --- In-memory index ---
+
+    def _index_documents(self):
+        # Snapshots and logs written before the index may hold an unsorted list
+        self._documents.sort(key=statement_sort_key)
+        self._keys = [document_key(d) for d in self._documents]
+        self._sort_keys = [statement_sort_key(d) for d in self._documents]
+        self._by_key = dict(zip(self._keys, self._documents))
+        self._tx_counts = {k: len(d.get('transactions') or []) for k, d in zip(self._keys, self._documents)}
+
+    def _position(self, key):
+        document = self._by_key[key]
+        position = bisect_left(self._sort_keys, statement_sort_key(document))
+        while position < len(self._documents) and self._documents[position] is not document:
+            position += 1
+        if position == len(self._documents):
+            position = next(i for i, d in enumerate(self._documents) if d is document)
+        return position
+
+    def _insert_at(self, position, key, document):
+        self._documents.insert(position, document)
+        self._keys.insert(position, key)
+        self._sort_keys.insert(position, statement_sort_key(document))
+        self._by_key[key] = document
+
+    def _remove_at(self, position):
+        del self._documents[position]
+        del self._keys[position]
+        del self._sort_keys[position]
+
+    def _apply_record(self, record):
+        # Placement matches SQLiteStorage: new documents go after those with the same
+        # end date; one whose end date changed goes after the documents it moved back
+        # past, or before those it moved forward past. Merges are applied from the
+        # statement's previous transaction count, so re-applying a live save is a no-op.
+        touched = {}
+        for entry in record['changes']:
+            action, key = entry['op'], entry['key']
+            if action == 'insert':
+                document = entry['doc']
+                self._insert_at(bisect_right(self._sort_keys, statement_sort_key(document)), key, document)
+            elif action == 'replace':
+                document = entry['doc']
+                position = self._position(key)
+                old_sort_key, new_sort_key = self._sort_keys[position], statement_sort_key(document)
+                self._remove_at(position)
+                if new_sort_key < old_sort_key:
+                    position = bisect_right(self._sort_keys, new_sort_key)
+                elif new_sort_key > old_sort_key:
+                    position = bisect_left(self._sort_keys, new_sort_key)
+                self._insert_at(position, key, document)
+            else:
+                document = self._by_key[key]
+                transactions = document.setdefault('transactions', [])
+                del transactions[self._tx_counts.get(key, len(transactions)):]
+                transactions.extend(entry['append'])
+                document['summary'] = entry['summary']
+            self._tx_counts[key] = len(document.get('transactions') or [])
+            touched[key] = (action, document)
+
+        if record.get('order'):
+            # Written by an older version, which spelled out unsorted orders
+            self._documents = [self._by_key[key] for key in record['order']]
+            self._index_documents()
+            if self._aggregates is not None:
+                self._aggregates = update_aggregates(self._aggregates, self._documents, list(touched.values()))
+        elif self._aggregates is not None:
+            for key, (_, document) in touched.items():
+                self._aggregates['documents'][key] = summarize_document(document)
+            self._aggregates['order'] = list(self._keys)
+        self._data_version = record['v']
+
+    # --- Storage interface ---
+
+    def load_documents(self):
+        with self._state_lock:
+            self._catch_up()
+            return list(self._documents)
+
+    def load_merge_candidates(self, documents):
+        hashes, ranges = merge_candidate_ranges(documents)
+        with self._state_lock:
+            self._catch_up()
+            positions = {self._position(h) for h in hashes if h in self._by_key}
+            for first, last in ranges:
+                # Only documents ending on or after the list's first date can overlap it
+                for position in range(bisect_left(self._sort_keys, first), len(self._documents)):
+                    document = self._documents[position]
+                    period = document.get('statement_period') or {}
+                    start, end = period.get('start_date'), period.get('end_date')
+                    if document.get('document_type') == 'monthly_statement' and start and end \
+                            and start <= last and end >= first:
+                        positions.add(position)
+            return [self._documents[position] for position in sorted(positions)]
+
+    def load_aggregates(self):
+        with self._state_lock:
+            self._catch_up()
+            if self._aggregates is None:
+                self._aggregates = build_aggregates(self._documents)
+            return self._aggregates
+
+    def get_data_version(self):
+        with self._state_lock:
+            self._catch_up()
+            return self._data_version
+
+    def _build_record(self, changes):
+        entries = []
+        counts = {}
+        for action, document in changes:
+            key = document_key(document)
+            transactions = document.get('transactions') or []
+            previous = counts.get(key, self._tx_counts.get(key))
+            if action == 'merge' and previous is not None and len(transactions) >= previous:
+                entries.append({
+                    'op': 'merge', 'key': key,
+                    'append': transactions[previous:], 'summary': document.get('summary'),
+                })
+            elif action == 'merge':
+                entries.append({'op': 'replace', 'key': key, 'doc': document})
+            else:
+                entries.append({'op': action, 'key': key, 'doc': document})
+            counts[key] = len(transactions)
+        return {'v': self._data_version + 1, 'changes': entries}
+
+    def save_changes(self, documents, changes):
+        """
+        Appends one record for the merge; callers hold lock() across load and save.
+        Only the changes are used: the merged documents are the candidates handed out
+        by load_merge_candidates, already placed (and merged into) in memory.
+        """
+        with self._state_lock:
+            self._catch_up()
+            record = self._build_record(changes)
+            line = (json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8')
+
+            # The roll is decided from the file on disk under lock(), and the new
+            # segment is created by this append, so every process sees where it went
+            path = self._segment_path(self._segment)
+            if os.path.exists(path) and os.path.getsize(path) >= self.segment_max_bytes:
+                self._segment += 1
+                self._offset = 0
+                path = self._segment_path(self._segment)
+            try:
+                with open(path, 'ab') as f:
+                    f.write(line)
+                    f.flush()
+                    os.fsync(f.fileno())
+            except Exception:
+                # The merged documents were changed in place; rebuild from disk
+                self._reload()
+                raise
+
+            self._apply_record(record)
+            self._offset += len(line)
+            self._replayed_bytes += len(line)
+
+            if self._replayed_bytes >= self.compact_threshold_bytes and not self._compacting:
+                self._compacting = True
+                threading.Thread(target=self._compact_in_background, daemon=True).start()
+
+    # --- Compaction ---
+
+    def compact(self):
+        """Folds the log into a new snapshot and removes the covered segments."""
+        with self.lock():
+            with self._state_lock:
+                self._catch_up()
+                # Later appends go to a fresh segment that the snapshot does not cover
+                covered = self._segment if self._offset else self._segment - 1
+                if self._offset:
+                    self._segment += 1
+                    self._offset = 0
+                if self._aggregates is None:
+                    self._aggregates = build_aggregates(self._documents)
+                self._write_snapshot(self._data_version, covered, self._documents, self._aggregates)
+                self._loaded_snapshot = self._snapshot_stamp()
+                self._snapshot_segment = covered
+                self._replayed_bytes = 0
+
+            for segment_id in self._segment_ids():
+                if segment_id <= covered:
+                    os.remove(self._segment_path(segment_id))
+        print(f"--- ✅ Compacted statement log into a snapshot at version {self._data_version} ---")
+
+    def _compact_in_background(self):
+        try:
+            self.compact()
+        except Exception as e:
+            print(f"--- ❌ Statement log compaction failed: {e} ---")
+        finally:
+            self._compacting = False
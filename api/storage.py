@@ -0,0 +1,356 @@
+import os
+import json
+import sqlite3
+import threading
+
+from segment_log import SegmentLogStorage
+from merge_index import merge_candidate_ranges, statement_sort_key
+from persistence import atomic_write_json, atomic_write_text, file_lock, load_json_with_recovery
+from financial_aggregates import (
+    build_aggregates,
+    document_key,
+    load_aggregates,
+    save_aggregates,
+    summarize_document,
+    summary_version,
+    update_aggregates,
+)
+
+# --- Statement Storage Backends ---
+# Every backend exposes the same small interface used by the API endpoints:
+#   load_documents()                   -> list of stored documents, in storage order
+#   load_merge_candidates(documents)   -> the stored documents a merge of these documents can
+#                                         touch (see merge_candidate_ranges), in storage order
+#   load_aggregates()                  -> running aggregates (see financial_aggregates.py)
+#   save_changes(documents, changes)   -> persists the outcome of smart_merge_data run over
+#                                         load_merge_candidates()
+#   get_data_version()                 -> counter bumped on every successful save
+#   lock()                             -> inter-process lock to hold across a load-merge-save cycle
+# Storage order is by end date (statement_sort_key), as smart_merge_data keeps it.
+
+class JSONFileStorage:
+    """Legacy backend: the whole history lives in one pretty-printed JSON file."""
+
+    def __init__(self, data_path, aggregates_path):
+        self.data_path = data_path
+        self.aggregates_path = aggregates_path
+        self.version_path = os.path.splitext(data_path)[0] + '.version'
+
+    def _stamp(self):
+        stat = os.stat(self.data_path)
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def lock(self):
+        return file_lock(self.data_path)
+
+    def load_documents(self):
+        # A corrupt file is restored from the last good snapshot, never replaced by []
+        return load_json_with_recovery(self.data_path, [])
+
+    def load_merge_candidates(self, documents):
+        # The file is rewritten whole on every save, so the merge gets the whole history
+        return self.load_documents()
+
+    def load_aggregates(self):
+        if not os.path.exists(self.data_path):
+            return build_aggregates([])
+
+        stamp = self._stamp()
+        aggregates = load_aggregates(self.aggregates_path)
+        if aggregates is not None and aggregates.get('source_stamp') == stamp:
+            return aggregates
+
+        print("--- Rebuilding financial aggregates from data file ---")
+        aggregates = build_aggregates(self.load_documents())
+        aggregates['source_stamp'] = stamp
+        save_aggregates(self.aggregates_path, aggregates)
+        return aggregates
+
+    def save_changes(self, documents, changes):
+        aggregates = self.load_aggregates()
+
+        atomic_write_json(self.data_path, documents, indent=2, keep_snapshot=True)
+
+        aggregates = update_aggregates(aggregates, documents, changes)
+        aggregates['source_stamp'] = self._stamp()
+        save_aggregates(self.aggregates_path, aggregates)
+
+        atomic_write_text(self.version_path, str(self.get_data_version() + 1))
+
+    def get_data_version(self):
+        try:
+            with open(self.version_path, 'r', encoding='utf-8') as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    doc_key TEXT NOT NULL UNIQUE,
+    source_file_hash TEXT,
+    document_type TEXT,
+    account_number TEXT,
+    start_date TEXT,
+    end_date TEXT,
+    position INTEGER NOT NULL,
+    body TEXT NOT NULL,
+    summary TEXT,
+    summary_version TEXT
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY,
+    document_id INTEGER NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    transaction_date TEXT,
+    description TEXT,
+    debit REAL,
+    credit REAL,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_documents_source_file_hash ON documents(source_file_hash);
+CREATE INDEX IF NOT EXISTS idx_documents_account_number ON documents(account_number);
+CREATE INDEX IF NOT EXISTS idx_documents_position ON documents(position);
+CREATE INDEX IF NOT EXISTS idx_documents_order ON documents(COALESCE(NULLIF(end_date, ''), '1900-01-01'), position);
+CREATE INDEX IF NOT EXISTS idx_documents_period ON documents(document_type, end_date);
+CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions(transaction_date);
+CREATE INDEX IF NOT EXISTS idx_transactions_document ON transactions(document_id, seq);
+"""
+
+# statement_sort_key order; positions break ties (see SQLiteStorage._position)
+SQLITE_DOCUMENT_ORDER = "COALESCE(NULLIF(end_date, ''), '1900-01-01'), position, id"
+
+class SQLiteStorage:
+    """
+    Embedded SQLite backend. Documents and transactions live in their own
+    tables, so an upload only reads the documents it can merge with and only
+    writes the rows it touched, in one transaction.
+    """
+
+    def __init__(self, db_path, legacy_json_path=None):
+        self.db_path = db_path
+        self._local = threading.local()
+        conn = self._connect()
+        conn.executescript(SQLITE_SCHEMA)
+        if legacy_json_path:
+            self._migrate_from_json(legacy_json_path)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    def lock(self):
+        return file_lock(self.db_path)
+
+    def _get_meta(self, conn, key):
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, conn, key, value):
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def _bump_data_version(self, conn):
+        self._set_meta(conn, 'data_version', str(self.get_data_version(conn) + 1))
+
+    def get_data_version(self, conn=None):
+        value = self._get_meta(conn or self._connect(), 'data_version')
+        return int(value) if value else 0
+
+    def _migrate_from_json(self, json_path):
+        """One-shot import of the legacy JSON file into an empty database."""
+        conn = self._connect()
+        if self._get_meta(conn, 'migrated_from_json') or not os.path.exists(json_path):
+            return
+
+        try:
+            documents = load_json_with_recovery(json_path, [])
+        except ValueError as e:
+            print(f"--- ❌ Could not migrate legacy data file '{json_path}': {e} ---")
+            return
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if self._get_meta(conn, 'migrated_from_json'):
+                conn.execute("ROLLBACK")
+                return
+            existing = conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+            for position, document in enumerate(documents or [], start=existing):
+                self._write_document(conn, document, position)
+            self._set_meta(conn, 'migrated_from_json', json_path)
+            self._bump_data_version(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        print(f"--- ✅ Migrated {len(documents or [])} documents from '{json_path}' to SQLite ---")
+
+    def _position(self, conn, key, first, document):
+        """
+        Tie-break position among documents with the same end date, as smart_merge_data
+        orders them: a new document goes after them; one whose end date changed goes
+        after those it moved back past, or before those it moved forward past.
+        """
+        row = conn.execute("SELECT end_date, position FROM documents WHERE doc_key = ?", (key,)).fetchone()
+        previous_key, position = (row[0] or '1900-01-01', row[1]) if row else (statement_sort_key(first), None)
+        new_key = statement_sort_key(document)
+        if position is None or new_key < previous_key:
+            return conn.execute("SELECT COALESCE(MAX(position), -1) + 1 FROM documents").fetchone()[0]
+        if new_key > previous_key:
+            return conn.execute("SELECT MIN(position) - 1 FROM documents").fetchone()[0]
+        return position
+
+    def _write_document(self, conn, document, position):
+        key = document_key(document)
+        body = dict(document)
+        transactions = body.get('transactions')
+        if transactions is not None:
+            body['transactions'] = []
+        period = document.get('statement_period') or {}
+        account = document.get('account_details') or {}
+        summary = summarize_document(document)
+
+        row = conn.execute("SELECT id FROM documents WHERE doc_key = ?", (key,)).fetchone()
+        values = (
+            document.get('source_file_hash'), document.get('document_type'), account.get('account_number'),
+            period.get('start_date'), period.get('end_date'),
+            json.dumps(body, ensure_ascii=False), json.dumps(summary, ensure_ascii=False), summary_version(),
+        )
+        if row:
+            document_id = row[0]
+            conn.execute(
+                "UPDATE documents SET source_file_hash = ?, document_type = ?, account_number = ?, "
+                "start_date = ?, end_date = ?, body = ?, summary = ?, summary_version = ?, "
+                "position = ? WHERE id = ?",
+                values + (position, document_id)
+            )
+            conn.execute("DELETE FROM transactions WHERE document_id = ?", (document_id,))
+        else:
+            cursor = conn.execute(
+                "INSERT INTO documents (source_file_hash, document_type, account_number, start_date, end_date, "
+                "body, summary, summary_version, position, doc_key) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                values + (position, key)
+            )
+            document_id = cursor.lastrowid
+
+        conn.executemany(
+            "INSERT INTO transactions (document_id, seq, transaction_date, description, debit, credit, data) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (document_id, seq, _text_or_none(t.get('transaction_date')), _text_or_none(t.get('description')),
+                 _number_or_none(t.get('debit')), _number_or_none(t.get('credit')), json.dumps(t, ensure_ascii=False))
+                for seq, t in enumerate(transactions or [])
+            ]
+        )
+
+    def _read_document(self, conn, document_id, body):
+        document = json.loads(body)
+        if 'transactions' in document:
+            rows = conn.execute(
+                "SELECT data FROM transactions WHERE document_id = ? ORDER BY seq", (document_id,)
+            ).fetchall()
+            document['transactions'] = [json.loads(r[0]) for r in rows]
+        return document
+
+    def load_documents(self):
+        conn = self._connect()
+        documents = []
+        by_id = {}
+        for document_id, body in conn.execute(f"SELECT id, body FROM documents ORDER BY {SQLITE_DOCUMENT_ORDER}"):
+            document = json.loads(body)
+            if 'transactions' in document:
+                by_id[document_id] = document['transactions']
+            documents.append(document)
+        for document_id, data in conn.execute("SELECT document_id, data FROM transactions ORDER BY document_id, seq"):
+            if document_id in by_id:
+                by_id[document_id].append(json.loads(data))
+        return documents
+
+    def load_merge_candidates(self, documents):
+        hashes, ranges = merge_candidate_ranges(documents)
+        conn = self._connect()
+        ids = set()
+        for file_hash in hashes:
+            ids.update(row[0] for row in conn.execute(
+                "SELECT id FROM documents WHERE source_file_hash = ?", (file_hash,)
+            ))
+        for first, last in ranges:
+            ids.update(row[0] for row in conn.execute(
+                "SELECT id FROM documents WHERE document_type = 'monthly_statement' "
+                "AND end_date >= ? AND start_date <= ?", (first, last)
+            ))
+        if not ids:
+            return []
+        placeholders = ','.join('?' * len(ids))
+        rows = conn.execute(
+            f"SELECT id, body FROM documents WHERE id IN ({placeholders}) ORDER BY {SQLITE_DOCUMENT_ORDER}",
+            sorted(ids)
+        ).fetchall()
+        return [self._read_document(conn, document_id, body) for document_id, body in rows]
+
+    def load_aggregates(self):
+        conn = self._connect()
+        rows = conn.execute(
+            f"SELECT id, doc_key, body, summary, summary_version FROM documents ORDER BY {SQLITE_DOCUMENT_ORDER}"
+        ).fetchall()
+
+        current_version = summary_version()
+        aggregates = {'format_version': current_version, 'order': [], 'documents': {}}
+        stale = []
+        for document_id, key, body, summary, stored_version in rows:
+            if stored_version != current_version or not summary:
+                doc_summary = summarize_document(self._read_document(conn, document_id, body))
+                stale.append((json.dumps(doc_summary, ensure_ascii=False), current_version, document_id))
+            else:
+                doc_summary = json.loads(summary)
+            aggregates['order'].append(key)
+            aggregates['documents'][key] = doc_summary
+
+        if stale:
+            print(f"--- Refreshing {len(stale)} outdated document summaries ---")
+            conn.executemany("UPDATE documents SET summary = ?, summary_version = ? WHERE id = ?", stale)
+        return aggregates
+
+    def save_changes(self, documents, changes):
+        # Rows are ordered by end date on read, so only the changed documents are written
+        touched = {}
+        for action, document in changes:
+            entry = touched.setdefault(document_key(document), [document, document])
+            entry[1] = document
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for key, (first, document) in touched.items():
+                self._write_document(conn, document, self._position(conn, key, first, document))
+            self._bump_data_version(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+
+def _text_or_none(value):
+    return value if isinstance(value, str) else None
+
+def _number_or_none(value):
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+def create_storage(backend, data_path, aggregates_path, db_path, log_dir=None, **log_options):
+    """Creates the configured storage backend ('sqlite', 'json' or 'log')."""
+    if backend == 'json':
+        return JSONFileStorage(data_path, aggregates_path)
+    if backend == 'sqlite':
+        return SQLiteStorage(db_path, legacy_json_path=data_path)
+    if backend == 'log':
+        return SegmentLogStorage(log_dir, legacy_json_path=data_path, **log_options)
+    raise ValueError(f"Unknown storage backend '{backend}'. Use 'sqlite', 'json' or 'log'.")
@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+# The api modules import each other as top-level modules (as app.py does)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    """The Flask app module, started with its data files in a temporary directory."""
+    previous = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('app'))
+    import app
+    app.create_app()
+    yield app
+    os.chdir(previous)
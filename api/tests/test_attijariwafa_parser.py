@@ -0,0 +1,114 @@
+import pytest
+
+from attijariwafa_parser import StatementParseError, parse_amount, parse_statement
+
+STATEMENT = """ATTIJARIWAFA BANK
+AGENCE : CASA ANFA
+N° COMPTE : 0001234567890123
+M. AHMED BENNANI
+RELEVE DE COMPTE DU 01/12/2023 AU 31/01/2024
+SOLDE DEPART {opening} CREDITEUR
+28 12 PRLV NETFLIX 28 12 2023 99,00
+05 01 PAIEMENT CB MARJANE 05 01 2024 250,00
+10 01 VIREMENT RECU SALAIRE 10 01 2024 5 000,00
+15 01 RETRAIT GAB 15 01 2024 1 000,00
+TOTAL MOUVEMENTS {debits} 5 000,00
+SOLDE FINAL {closing} CREDITEUR
+"""
+
+TRANSACTION_LIST = """MOUVEMENT DU COMPTE
+N° COMPTE : 0001234567890123
+SOLDE AU 01/01/2024 {opening}
+05/01/2024 PAIEMENT CB MARJANE 05/01/2024 -250,00 MAD
+10/01/2024 VIREMENT RECU 10/01/2024 500,00 MAD
+12/01/2024 RETRAIT GAB -1 000,00
+SOLDE REEL {closing}
+"""
+
+def _statement(opening='1 000,00', debits='1 349,00', closing='4 651,00'):
+    return STATEMENT.format(opening=opening, debits=debits, closing=closing)
+
+def _transaction_list(opening='2 000,00', closing='1 250,00'):
+    return TRANSACTION_LIST.format(opening=opening, closing=closing)
+
+def test_parse_amount_handles_french_formats():
+    assert parse_amount('1 234,56') == 1234.56
+    assert parse_amount('-1.234,56') == -1234.56
+    assert parse_amount('12 000,00') == 12000.0
+
+def test_monthly_statement_that_reconciles_is_parsed():
+    document = parse_statement(_statement(), 'monthly_statement')
+    assert document['document_type'] == 'monthly_statement'
+    assert document['agency'] == 'CASA ANFA'
+    assert document['account_holder']['name'] == 'AHMED BENNANI'
+    assert document['account_details']['account_number'] == '0001234567890123'
+    assert document['statement_period'] == {'start_date': '2023-12-01', 'end_date': '2024-01-31'}
+    assert document['summary'] == {
+        'opening_balance': 1000.0, 'closing_balance': 4651.0, 'total_debits': 1349.0, 'total_credits': 5000.0,
+    }
+    # A December operation in a statement spanning the new year keeps its own year
+    assert [t['transaction_date'] for t in document['transactions']] == [
+        '2023-12-28', '2024-01-05', '2024-01-10', '2024-01-15'
+    ]
+
+def test_credits_are_recognized_by_their_wording():
+    transactions = parse_statement(_statement(), 'monthly_statement')['transactions']
+    kinds = {t['description']: ('credit' if t['credit'] else 'debit') for t in transactions}
+    assert kinds == {
+        'PRLV NETFLIX': 'debit', 'PAIEMENT CB MARJANE': 'debit',
+        'VIREMENT RECU SALAIRE': 'credit', 'RETRAIT GAB': 'debit',
+    }
+    salary = transactions[2]
+    assert (salary['debit'], salary['credit']) == (None, 5000.0)
+
+def test_transaction_list_signs_decide_debits_and_credits():
+    document = parse_statement(_transaction_list(), 'transaction_list')
+    assert [(t['debit'], t['credit']) for t in document['transactions']] == [
+        (250.0, None), (None, 500.0), (1000.0, None)
+    ]
+    assert document['transactions'][2]['value_date'] is None
+    assert document['summary'] == {
+        'opening_balance': None, 'closing_balance': 1250.0, 'total_debits': 1250.0, 'total_credits': 500.0,
+    }
+
+@pytest.mark.parametrize('text, pdf_type', [
+    # Closing balance off by one dirham
+    (_statement(closing='4 650,00'), 'monthly_statement'),
+    # TOTAL MOUVEMENTS disagrees with the parsed debits
+    (_statement(debits='1 249,00'), 'monthly_statement'),
+    # A credit the keywords do not recognize is read as a debit and breaks the balance
+    (_statement().replace('VIREMENT RECU SALAIRE', 'VIR INST DE M BENNANI'), 'monthly_statement'),
+    # A dated line whose amount is missing
+    (_statement().replace('15 01 RETRAIT GAB 15 01 2024 1 000,00', '15 01 RETRAIT GAB 1 000,00'), 'monthly_statement'),
+    (_statement().replace('SOLDE FINAL', 'SOLDE'), 'monthly_statement'),
+    (_transaction_list(closing='1 300,00'), 'transaction_list'),
+    (_transaction_list().replace('SOLDE AU 01/01/2024', 'DETAIL'), 'transaction_list'),
+    (_statement(), 'unknown'),
+], ids=['balance', 'totals', 'unrecognized-credit', 'unparsed-line', 'no-closing', 'list-balance', 'list-no-opening', 'unknown-type'])
+def test_documents_that_do_not_reconcile_are_rejected(text, pdf_type):
+    with pytest.raises(StatementParseError):
+        parse_statement(text, pdf_type)
+
+def test_upload_falls_back_to_the_model_when_the_statement_does_not_reconcile(app_module, monkeypatch):
+    pages = [_statement(closing='4 650,00')]
+    model_result = {'document_type': 'monthly_statement', 'transactions': [], 'summary': {}}
+    model_calls = []
+
+    def analyze_with_model(pdf_data, pdf_type, api_key, file_hash, page_texts, has_text):
+        model_calls.append((pdf_type, page_texts))
+        return dict(model_result)
+
+    monkeypatch.setattr(app_module, 'classify_pdf', lambda *args: {'pdf_type': 'monthly_statement'})
+    monkeypatch.setattr(app_module, 'extract_page_texts', lambda *args, **kwargs: pages)
+    monkeypatch.setattr(app_module, '_analyze_pdf_with_model', analyze_with_model)
+    monkeypatch.setattr(app_module.extraction_cache, 'put', lambda *args: None)
+
+    result = app_module.analyze_pdf_with_smart_detection(b'not reconciling', 'releve.pdf', 'key', force_reextract=True)
+    assert model_calls == [('monthly_statement', pages)]
+    assert not result.get('processed_with_local_parser')
+
+    pages[:] = [_statement()]
+    result = app_module.analyze_pdf_with_smart_detection(b'reconciling', 'releve.pdf', 'key', force_reextract=True)
+    assert len(model_calls) == 1
+    assert result['processed_with_local_parser'] is True
+    assert len(result['transactions']) == 4
@@ -0,0 +1,87 @@
+import json
+
+import pytest
+
+from categorization import Categorizer, DEFAULT_CATEGORY_RULES, USER_RULE_PRIORITY, load_categorizer
+
+def _rules_file(tmp_path, config):
+    path = tmp_path / 'category_rules.json'
+    path.write_text(json.dumps(config), encoding='utf-8')
+    return str(path)
+
+def test_default_rules_keep_the_original_keyword_order():
+    categorizer = Categorizer(DEFAULT_CATEGORY_RULES)
+    assert categorizer.categorize('PAIEMENT CB RECHARGE INWI') == 'TELECOMMUNICATIONS'
+    assert categorizer.categorize('RETRAIT GAB FRAIS') == 'CASH_WITHDRAWALS'
+    assert categorizer.categorize('FRAIS VIREMENT') == 'TRANSFERS'
+    assert categorizer.categorize('PAIEMENT CB MARJANE') == 'CARD_PAYMENTS'
+    assert categorizer.categorize('loyer') == 'OTHER'
+    assert categorizer.categorize(None) == 'OTHER'
+
+def test_highest_priority_wins_and_ties_go_to_the_first_rule():
+    categorizer = Categorizer([
+        {'category': 'LOW', 'keywords': ['ALPHA'], 'priority': 1},
+        {'category': 'HIGH', 'keywords': ['BETA'], 'priority': 9},
+        {'category': 'FIRST', 'keywords': ['GAMMA'], 'priority': 5},
+        {'category': 'SECOND', 'keywords': ['DELTA'], 'priority': 5},
+    ])
+    assert categorizer.categorize('alpha beta') == 'HIGH'
+    assert categorizer.categorize('beta alpha') == 'HIGH'
+    assert categorizer.categorize('delta gamma') == 'FIRST'
+    assert categorizer.categorize('alpha') == 'LOW'
+
+def test_overlapping_keywords_do_not_hide_each_other():
+    categorizer = Categorizer([
+        {'category': 'SHORT', 'keywords': ['CB'], 'priority': 1},
+        {'category': 'LONG', 'keywords': ['CBX'], 'priority': 2},
+        {'category': 'INNER', 'keywords': ['BXY'], 'priority': 3},
+    ])
+    assert categorizer.categorize('CBXY') == 'INNER'
+    assert categorizer.categorize('CBX') == 'LONG'
+
+def test_user_rule_without_priority_beats_the_defaults(tmp_path):
+    path = _rules_file(tmp_path, {'rules': [{'category': 'groceries', 'keywords': ['marjane']}]})
+    categorizer = load_categorizer(path)
+    assert categorizer.rules[0]['priority'] == USER_RULE_PRIORITY
+    assert categorizer.categorize('PAIEMENT CB MARJANE') == 'GROCERIES'
+    assert categorizer.categorize('PAIEMENT CB ACIMA') == 'CARD_PAYMENTS'
+
+def test_user_rule_with_a_low_priority_loses_to_the_defaults(tmp_path):
+    path = _rules_file(tmp_path, {'rules': [{'category': 'GROCERIES', 'keywords': ['MARJANE'], 'priority': 5}]})
+    assert load_categorizer(path).categorize('PAIEMENT CB MARJANE') == 'CARD_PAYMENTS'
+
+def test_replace_defaults_and_default_category(tmp_path):
+    path = _rules_file(tmp_path, {
+        'replace_defaults': True,
+        'default_category': 'misc',
+        'rules': [{'category': 'GROCERIES', 'keywords': ['MARJANE']}],
+    })
+    categorizer = load_categorizer(path)
+    assert categorizer.categorize('RETRAIT GAB') == 'MISC'
+    assert categorizer.categories() == ['GROCERIES', 'MISC']
+
+@pytest.mark.parametrize('rule', [
+    {'category': 'GROCERIES'},
+    {'keywords': ['MARJANE']},
+    {'category': 'GROCERIES', 'keywords': ['MARJANE'], 'priority': 'high'},
+    {'category': 'GROCERIES', 'keywords': ['MARJANE'], 'priority': True},
+])
+def test_invalid_user_rules_are_rejected(tmp_path, rule):
+    with pytest.raises(ValueError):
+        load_categorizer(_rules_file(tmp_path, {'rules': [rule]}))
+
+def test_cached_results_match_uncached_ones():
+    categorizer = Categorizer(DEFAULT_CATEGORY_RULES)
+    descriptions = ['PAIEMENT CB MARJANE', 'retrait gab', 'FACTURE IAM', 'LOYER', '']
+    first = [categorizer.categorize(d) for d in descriptions]
+    second = [categorizer.categorize(d) for d in descriptions]
+    assert first == second == [categorizer._categorize(d.upper()) for d in descriptions]
+
+    info = categorizer._categorize_cached.cache_info()
+    assert info.misses == len(descriptions)
+    assert info.hits == len(descriptions)
+
+def test_fingerprint_follows_the_rule_table():
+    assert Categorizer(DEFAULT_CATEGORY_RULES).fingerprint == Categorizer(DEFAULT_CATEGORY_RULES).fingerprint
+    changed = DEFAULT_CATEGORY_RULES + [{'category': 'GROCERIES', 'keywords': ['MARJANE'], 'priority': 1}]
+    assert Categorizer(changed).fingerprint != Categorizer(DEFAULT_CATEGORY_RULES).fingerprint
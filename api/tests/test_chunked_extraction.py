@@ -0,0 +1,94 @@
+from chunked_extraction import plan_chunks, stitch_extractions
+
+def _withdrawal(date, amount=200.0, description='RETRAIT GAB AGENCE CENTRE'):
+    return {'transaction_date': date, 'value_date': date, 'description': description, 'debit': amount, 'credit': None}
+
+def _part(transactions, **fields):
+    return dict({'document_type': 'monthly_statement', 'transactions': transactions}, **fields)
+
+def test_plan_chunks_covers_every_page_with_overlap():
+    pages = ['page one\n', 'page two\n', 'page three\n', 'page four\n', 'page five\n']
+    chunks = plan_chunks(pages, 2, 6)
+    assert [(c['first_page'], c['last_page']) for c in chunks] == [(1, 2), (3, 4), (5, 5)]
+    assert chunks[0]['overlap'] == ''
+    assert chunks[0]['text'] == 'page one\npage two\n'
+    assert chunks[1]['overlap'] == 'e two\n'
+    assert chunks[1]['text'] == chunks[1]['overlap'] + 'page three\npage four\n'
+    assert chunks[2]['overlap'] == ' four\n'
+    assert plan_chunks(pages, 2, 0)[1]['overlap'] == ''
+    assert len(plan_chunks(pages, 0, 0)) == 5
+
+def test_transaction_repeated_across_a_boundary_is_dropped():
+    chunks = [
+        {'first_page': 1, 'last_page': 1, 'overlap': ''},
+        {'first_page': 2, 'last_page': 2, 'overlap': '05/01 Retrait GAB agence   centre 200,00\n'},
+    ]
+    first = _part([_withdrawal('2024-01-02', 50.0, 'PAIEMENT CB MARJANE'), _withdrawal('2024-01-05')])
+    second = _part([_withdrawal('2024-01-05'), _withdrawal('2024-01-07', 80.0, 'FACTURE IAM')])
+    stitched = stitch_extractions([first, second], chunks)
+    assert [t['description'] for t in stitched['transactions']] == [
+        'PAIEMENT CB MARJANE', 'RETRAIT GAB AGENCE CENTRE', 'FACTURE IAM'
+    ]
+    assert stitched['summary']['total_debits'] == 330.0
+
+def test_same_day_identical_transaction_outside_the_overlap_is_kept():
+    chunks = [
+        {'first_page': 1, 'last_page': 1, 'overlap': ''},
+        {'first_page': 2, 'last_page': 2, 'overlap': 'SOLDE REPORTE 1 000,00\n'},
+    ]
+    first = _part([_withdrawal('2024-01-05')])
+    second = _part([_withdrawal('2024-01-05')])
+    stitched = stitch_extractions([first, second], chunks)
+    assert len(stitched['transactions']) == 2
+    assert stitched['summary']['total_debits'] == 400.0
+
+def test_only_as_many_repeats_as_the_overlap_shows_are_dropped():
+    # The overlap holds the previous chunk's last withdrawal; the next one,
+    # identical and on the same day, starts the new page and must be kept.
+    chunks = [
+        {'first_page': 1, 'last_page': 1, 'overlap': ''},
+        {'first_page': 2, 'last_page': 2, 'overlap': '05/01 RETRAIT GAB AGENCE CENTRE 200,00\n'},
+    ]
+    first = _part([_withdrawal('2024-01-05')])
+    second = _part([_withdrawal('2024-01-05'), _withdrawal('2024-01-05')])
+    assert len(stitch_extractions([first, second], chunks)['transactions']) == 2
+
+def test_leading_transactions_that_differ_from_the_previous_tail_are_kept():
+    chunks = [
+        {'first_page': 1, 'last_page': 1, 'overlap': ''},
+        {'first_page': 2, 'last_page': 2, 'overlap': 'RETRAIT GAB AGENCE CENTRE\n'},
+    ]
+    first = _part([_withdrawal('2024-01-05')])
+    second = _part([_withdrawal('2024-01-06')])
+    assert len(stitch_extractions([first, second], chunks)['transactions']) == 2
+
+def test_header_fields_period_and_balances_are_combined():
+    chunks = [{'first_page': n, 'last_page': n, 'overlap': ''} for n in (1, 2, 3)]
+    first = _part(
+        [_withdrawal('2024-01-05')],
+        account_holder={'name': 'A. CLIENT', 'account_number': None},
+        statement_period={'start_date': '2024-01-01', 'end_date': None},
+        summary={'opening_balance': 1000.0, 'closing_balance': None},
+    )
+    second = _part(
+        [{'transaction_date': '2024-01-20', 'description': 'VIREMENT RECU', 'debit': None, 'credit': 500.0}],
+        document_type=None,
+        bank_name='ATTIJARIWAFA BANK',
+        account_holder={'name': 'IGNORED', 'account_number': '0001'},
+        statement_period={'start_date': None, 'end_date': '2024-01-31'},
+        summary={'opening_balance': 7.0, 'closing_balance': 1300.0},
+    )
+    stitched = stitch_extractions([first, None, second], chunks)
+    assert stitched['document_type'] == 'monthly_statement'
+    assert stitched['bank_name'] == 'ATTIJARIWAFA BANK'
+    assert stitched['account_holder'] == {'name': 'A. CLIENT', 'account_number': '0001'}
+    assert stitched['statement_period'] == {'start_date': '2024-01-01', 'end_date': '2024-01-31'}
+    assert stitched['summary'] == {
+        'opening_balance': 1000.0, 'closing_balance': 1300.0, 'total_debits': 200.0, 'total_credits': 500.0,
+    }
+
+def test_a_single_or_missing_result_is_returned_as_is():
+    chunks = [{'first_page': 1, 'last_page': 1, 'overlap': ''}, {'first_page': 2, 'last_page': 2, 'overlap': 'x'}]
+    only = _part([_withdrawal('2024-01-05')])
+    assert stitch_extractions([None, only], chunks) is only
+    assert stitch_extractions([None, None], chunks) is None
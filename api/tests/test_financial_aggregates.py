@@ -0,0 +1,306 @@
+import os
+import re
+import sys
+import copy
+import random
+import contextlib
+import io
+from datetime import datetime
+from collections import defaultdict
+
+from financial_aggregates import build_aggregates, combine_document_summaries, ordered_summaries, update_aggregates
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+from synthetic import generate_documents
+
+# Keys added to the metrics after the full recompute was replaced
+ADDED_METRICS = {'account_holder'}
+
+def baseline_comprehensive_metrics(financial_data):
+    """calculate_comprehensive_metrics before the running aggregates: a full pass over every transaction."""
+    if not financial_data:
+        return {}
+
+    monthly_statements = [d for d in financial_data if d.get('document_type') == 'monthly_statement']
+    transaction_lists = [d for d in financial_data if d.get('document_type') == 'transaction_list']
+
+    monthly_statements.sort(key=lambda x: x.get('statement_period', {}).get('end_date', ''))
+    transaction_lists.sort(key=lambda x: x.get('statement_period', {}).get('end_date', ''))
+
+    metrics = {}
+
+    current_net_worth = 0
+    latest_balance_date = None
+
+    if monthly_statements:
+        latest_statement = monthly_statements[-1]
+        current_net_worth = latest_statement.get('summary', {}).get('closing_balance', 0)
+        latest_balance_date = latest_statement.get('statement_period', {}).get('end_date')
+
+    if transaction_lists:
+        latest_transaction_list = transaction_lists[-1]
+        latest_closing_balance = latest_transaction_list.get('summary', {}).get('closing_balance')
+        if latest_closing_balance is not None:
+            latest_list_date = latest_transaction_list.get('statement_period', {}).get('end_date')
+            if not latest_balance_date or (latest_list_date and latest_list_date > latest_balance_date):
+                current_net_worth = latest_closing_balance
+                latest_balance_date = latest_list_date
+
+    metrics['current_net_worth'] = current_net_worth
+    metrics['net_worth_as_of_date'] = latest_balance_date
+
+    balance_history = []
+    for stmt in monthly_statements:
+        end_date = stmt.get('statement_period', {}).get('end_date')
+        closing_balance = stmt.get('summary', {}).get('closing_balance')
+        if end_date and closing_balance is not None:
+            balance_history.append({'date': end_date, 'balance': closing_balance, 'source': 'monthly_statement'})
+
+    for tlist in transaction_lists:
+        end_date = tlist.get('statement_period', {}).get('end_date')
+        closing_balance = tlist.get('summary', {}).get('closing_balance')
+        if end_date and closing_balance is not None:
+            balance_history.append({'date': end_date, 'balance': closing_balance, 'source': 'transaction_list'})
+
+    balance_history.sort(key=lambda x: x.get('date') or '1900-01-01')
+    metrics['balance_history'] = balance_history
+
+    if len(balance_history) >= 2:
+        first_balance = balance_history[0]['balance']
+        latest_balance = balance_history[-1]['balance']
+
+        metrics['total_net_worth_change'] = latest_balance - first_balance
+        metrics['net_worth_change_percentage'] = ((latest_balance - first_balance) / first_balance * 100) if first_balance != 0 else 0
+
+        first_date_str = balance_history[0].get('date')
+        latest_date_str = balance_history[-1].get('date')
+
+        if first_date_str and latest_date_str:
+            try:
+                first_date = datetime.strptime(first_date_str, '%Y-%m-%d')
+                latest_date = datetime.strptime(latest_date_str, '%Y-%m-%d')
+                metrics['tracking_period_days'] = (latest_date - first_date).days
+                metrics['tracking_period_months'] = metrics['tracking_period_days'] / 30.44
+            except ValueError:
+                metrics['tracking_period_days'] = 0
+                metrics['tracking_period_months'] = 0
+
+    all_transactions = []
+    for doc in financial_data:
+        all_transactions.extend(doc.get('transactions', []))
+
+    all_transactions.sort(key=lambda x: x.get('transaction_date') or '1900-01-01')
+
+    total_income = sum(t.get('credit', 0) or 0 for t in all_transactions)
+    total_expenses = sum(t.get('debit', 0) or 0 for t in all_transactions)
+
+    metrics['total_income_all_time'] = total_income
+    metrics['total_expenses_all_time'] = total_expenses
+    metrics['net_cash_flow_all_time'] = total_income - total_expenses
+
+    monthly_data = defaultdict(lambda: {'income': 0, 'expenses': 0, 'transactions': []})
+
+    for transaction in all_transactions:
+        trans_date = transaction.get('transaction_date')
+        if trans_date and isinstance(trans_date, str) and len(trans_date) >= 7:
+            month_key = trans_date[:7]
+            monthly_data[month_key]['transactions'].append(transaction)
+            if transaction.get('credit'):
+                monthly_data[month_key]['income'] += transaction['credit']
+            if transaction.get('debit'):
+                monthly_data[month_key]['expenses'] += transaction['debit']
+
+    monthly_summary = []
+    for month, data in monthly_data.items():
+        monthly_summary.append({
+            'month': month,
+            'income': data['income'],
+            'expenses': data['expenses'],
+            'net_flow': data['income'] - data['expenses'],
+            'transaction_count': len(data['transactions'])
+        })
+
+    monthly_summary.sort(key=lambda x: x['month'])
+    metrics['monthly_summary'] = monthly_summary
+
+    if monthly_summary:
+        recent_months = monthly_summary[-3:]
+        recent_income = sum(m['income'] for m in recent_months)
+        recent_expenses = sum(m['expenses'] for m in recent_months)
+
+        metrics['recent_3_months'] = {
+            'income': recent_income,
+            'expenses': recent_expenses,
+            'net_flow': recent_income - recent_expenses,
+            'avg_monthly_income': recent_income / len(recent_months),
+            'avg_monthly_expenses': recent_expenses / len(recent_months)
+        }
+
+    if len(monthly_summary) >= 3:
+        incomes = [m['income'] for m in monthly_summary if m['income'] > 0]
+        if incomes:
+            avg_income = sum(incomes) / len(incomes)
+            income_variance = sum((x - avg_income) ** 2 for x in incomes) / len(incomes)
+            income_std_dev = income_variance ** 0.5
+            income_stability = max(0, 100 - (income_std_dev / avg_income * 100)) if avg_income > 0 else 0
+
+            metrics['income_analysis'] = {
+                'average_monthly_income': avg_income,
+                'income_stability_score': income_stability,
+                'income_volatility': (income_std_dev / avg_income * 100) if avg_income > 0 else 0
+            }
+
+    expense_categories = defaultdict(lambda: {'total': 0, 'count': 0, 'transactions': []})
+
+    for transaction in all_transactions:
+        if transaction.get('debit'):
+            description = transaction.get('description', '').upper()
+
+            category = 'OTHER'
+            if any(word in description for word in ['INWI', 'IAM', 'ORANGE']):
+                category = 'TELECOMMUNICATIONS'
+            elif any(word in description for word in ['GAB', 'RETRAIT', 'ATM']):
+                category = 'CASH_WITHDRAWALS'
+            elif any(word in description for word in ['VIREMENT', 'TRANSFER']):
+                category = 'TRANSFERS'
+            elif any(word in description for word in ['COMMISSION', 'FRAIS', 'TIMBRE']):
+                category = 'BANK_FEES'
+            elif any(word in description for word in ['PAIEMENT', 'CB']):
+                category = 'CARD_PAYMENTS'
+
+            expense_categories[category]['total'] += transaction['debit']
+            expense_categories[category]['count'] += 1
+            expense_categories[category]['transactions'].append(transaction)
+
+    metrics['expense_categories'] = dict(expense_categories)
+
+    largest_expenses = sorted([t for t in all_transactions if t.get('debit')],
+                              key=lambda x: x['debit'], reverse=True)[:10]
+    metrics['largest_expenses'] = largest_expenses
+
+    recurring_patterns = defaultdict(lambda: {'count': 0, 'total_amount': 0, 'avg_amount': 0, 'dates': []})
+
+    for transaction in all_transactions:
+        if transaction.get('debit'):
+            desc = transaction.get('description', '')
+            if desc:
+                desc = re.sub(r'\d{2}/\d{2}(/\d{4})?', '', desc)
+                desc = re.sub(r'\d{2}H\d{2}', '', desc)
+                desc = re.sub(r'\s+', ' ', desc).strip().upper()
+
+                if len(desc) > 5:
+                    recurring_patterns[desc]['count'] += 1
+                    recurring_patterns[desc]['total_amount'] += transaction['debit']
+                    trans_date = transaction.get('transaction_date')
+                    if trans_date:
+                        recurring_patterns[desc]['dates'].append(trans_date)
+
+    recurring_expenses = {}
+    for pattern, data in recurring_patterns.items():
+        if data['count'] >= 3:
+            data['avg_amount'] = data['total_amount'] / data['count']
+            recurring_expenses[pattern] = data
+
+    metrics['recurring_expenses'] = recurring_expenses
+
+    health_score = 100
+
+    if metrics.get('recent_3_months'):
+        recent_net_flow = metrics['recent_3_months']['net_flow']
+        if recent_net_flow < 0:
+            health_score -= 20
+
+        avg_monthly_expenses = metrics['recent_3_months']['avg_monthly_expenses']
+        if avg_monthly_expenses > 0:
+            runway_months = current_net_worth / avg_monthly_expenses
+            if runway_months < 3:
+                health_score -= 30
+            elif runway_months < 6:
+                health_score -= 15
+
+    if metrics.get('income_analysis'):
+        stability = metrics['income_analysis']['income_stability_score']
+        if stability < 70:
+            health_score -= 15
+        elif stability < 50:
+            health_score -= 25
+
+    metrics['financial_health_score'] = max(0, health_score)
+
+    if balance_history and len(balance_history) >= 2:
+        time_period_months = metrics.get('tracking_period_months', 1)
+        total_net_worth_change = metrics.get('total_net_worth_change', 0)
+
+        if time_period_months > 0 and total_income > 0:
+            savings_rate = (total_net_worth_change / total_income) * 100
+            metrics['savings_rate'] = savings_rate
+
+    return metrics
+
+def _assert_same_to_the_cent(actual, expected, path='metrics'):
+    """
+    Compares metrics structures, key order included, with floats equal to the
+    cent. A half-cent tolerance rather than rounding both sides, since a last
+    ulp of summation order can move an exact half cent to either side.
+    """
+    if isinstance(expected, float) or isinstance(actual, float):
+        assert abs(actual - expected) < 0.005, f"{path}: {actual} != {expected}"
+    elif isinstance(expected, dict):
+        assert isinstance(actual, dict) and list(actual) == list(expected), f"{path}: keys differ"
+        for key, item in expected.items():
+            _assert_same_to_the_cent(actual[key], item, f"{path}[{key!r}]")
+    elif isinstance(expected, list):
+        assert isinstance(actual, list) and len(actual) == len(expected), f"{path}: lengths differ"
+        for index, item in enumerate(expected):
+            _assert_same_to_the_cent(actual[index], item, f"{path}[{index}]")
+    else:
+        assert actual == expected, f"{path}: {actual!r} != {expected!r}"
+
+def _comparable(metrics, baseline):
+    """The metrics restricted to what the baseline reports, in its key order."""
+    assert set(baseline) <= set(metrics) <= set(baseline) | ADDED_METRICS
+    metrics = {key: metrics[key] for key in baseline}
+    if 'recurring_expenses' in metrics:
+        # Entries now also carry cadence and drift (see recurring.py)
+        metrics['recurring_expenses'] = {
+            pattern: {field: entry[field] for field in baseline['recurring_expenses'].get(pattern, entry)}
+            for pattern, entry in metrics['recurring_expenses'].items()
+        }
+    return metrics
+
+def _assert_matches_baseline(documents, aggregates):
+    baseline = baseline_comprehensive_metrics(copy.deepcopy(documents))
+    metrics = combine_document_summaries(ordered_summaries(aggregates))
+    _assert_same_to_the_cent(_comparable(metrics, baseline), baseline)
+
+def _history(seed):
+    rng = random.Random(seed)
+    documents = generate_documents(
+        rng.randint(20, 400), transactions_per_statement=rng.randint(10, 40),
+        list_every=rng.randint(1, 4), seed=seed
+    )
+    # Extractions are not always complete
+    for document in documents:
+        for transaction in document['transactions']:
+            if rng.random() < 0.02:
+                transaction['transaction_date'] = None
+        if rng.random() < 0.1:
+            document['summary'].pop('closing_balance')
+    return documents
+
+def test_combined_summaries_match_the_full_recompute_on_synthetic_histories():
+    for seed in range(25):
+        documents = _history(seed)
+        _assert_matches_baseline(documents, build_aggregates(documents))
+
+def test_incrementally_updated_aggregates_match_the_full_recompute(app_module):
+    for seed in range(10):
+        uploads = _history(seed)
+        random.Random(seed).shuffle(uploads)
+        stored, aggregates = [], build_aggregates([])
+        for document in uploads:
+            changes = []
+            with contextlib.redirect_stdout(io.StringIO()):
+                stored = app_module.smart_merge_data(stored, copy.deepcopy(document), changes)
+            update_aggregates(aggregates, stored, changes)
+            _assert_matches_baseline(stored, aggregates)
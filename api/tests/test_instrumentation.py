@@ -0,0 +1,60 @@
+import pytest
+
+from instrumentation import Instrumentation, get_instrumentation
+
+def _metric(instrumentation, line_prefix):
+    for line in instrumentation.render_prometheus().splitlines():
+        if line.startswith(line_prefix + ' '):
+            return float(line.rsplit(' ', 1)[1])
+    return 0.0
+
+def test_span_outcomes():
+    instrumentation = Instrumentation(enabled=True)
+    with instrumentation.span('parse'):
+        pass
+    with pytest.raises(ValueError):
+        with instrumentation.span('parse'):
+            raise ValueError('bad amount')
+
+    assert _metric(instrumentation, 'finance_stage_duration_seconds_count{stage="parse"}') == 2
+    assert _metric(instrumentation, 'finance_stage_errors_total{stage="parse"}') == 1
+    assert _metric(instrumentation, 'finance_stage_cancellations_total{stage="parse"}') == 0
+
+def test_closed_generator_is_a_cancellation_not_an_error():
+    instrumentation = Instrumentation(enabled=True)
+
+    def stream():
+        with instrumentation.span('model_stream'):
+            yield 'first'
+            yield 'second'
+
+    chunks = stream()
+    assert next(chunks) == 'first'
+    chunks.close()
+
+    assert _metric(instrumentation, 'finance_stage_cancellations_total{stage="model_stream"}') == 1
+    assert _metric(instrumentation, 'finance_stage_errors_total{stage="model_stream"}') == 0
+    assert _metric(instrumentation, 'finance_stage_duration_seconds_count{stage="model_stream"}') == 0
+
+def test_disconnected_chat_stream_is_counted_as_cancelled(app_module, monkeypatch):
+    class StreamingClient:
+        def generate_content(self, prompt, generation_config=None, stream=False):
+            return iter([type('Chunk', (), {'text': text})() for text in ('Hello', ' there', '!')])
+
+    monkeypatch.setattr(app_module.llm_backend, 'get', lambda api_key: StreamingClient())
+    instrumentation = get_instrumentation()
+    errors = 'finance_stage_errors_total{stage="chat_model_stream"}'
+    cancellations = 'finance_stage_cancellations_total{stage="chat_model_stream"}'
+    errors_before = _metric(instrumentation, errors)
+    cancellations_before = _metric(instrumentation, cancellations)
+
+    response = app_module.app.test_client().post(
+        '/api/chat/stream', json={'message': 'How much did I spend?'},
+        headers={'X-Gemini-API-Key': 'key', 'X-User-ID': 'stream-user'}, buffered=False
+    )
+    assert response.status_code == 200
+    assert b'Hello' in next(response.response)
+    response.close()
+
+    assert _metric(instrumentation, cancellations) == cancellations_before + 1
+    assert _metric(instrumentation, errors) == errors_before
@@ -0,0 +1,120 @@
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import jobs
+from jobs import JOB_DONE, JOB_FAILED, JOB_QUEUED, JOB_RUNNING, QueueFullError, UploadJobQueue
+
+def _wait_for(queue, job_id, statuses, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = queue.get(job_id)
+        if job['status'] in statuses:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} stayed {queue.get(job_id)['status']}")
+
+def _dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+def test_job_runs_from_queued_to_done(tmp_path):
+    started, release = threading.Event(), threading.Event()
+
+    def handler(filename, value):
+        started.set()
+        release.wait(5)
+        return {'filename': filename, 'value': value}
+
+    queue = UploadJobQueue(str(tmp_path / 'jobs.db'), handler, 1, 5)
+    running_id = queue.submit('first.pdf', 1)
+    queued_id = queue.submit('second.pdf', 2)
+    assert started.wait(5)
+    assert _wait_for(queue, running_id, {JOB_RUNNING})['status'] == JOB_RUNNING
+    assert queue.get(queued_id)['status'] == JOB_QUEUED
+    assert queue.depth() == 2
+
+    release.set()
+    assert _wait_for(queue, running_id, {JOB_DONE})['result'] == {'filename': 'first.pdf', 'value': 1}
+    job = _wait_for(queue, queued_id, {JOB_DONE})
+    assert (job['filename'], job['error'], job['result']) == ('second.pdf', None, {'filename': 'second.pdf', 'value': 2})
+    assert queue.depth() == 0
+    assert queue.get('missing') is None
+
+def test_handler_errors_fail_the_job(tmp_path):
+    def handler(filename):
+        raise ValueError('no transactions found')
+
+    queue = UploadJobQueue(str(tmp_path / 'jobs.db'), handler, 1, 5)
+    job = _wait_for(queue, queue.submit('broken.pdf'), {JOB_DONE, JOB_FAILED})
+    assert (job['status'], job['error'], job['result']) == (JOB_FAILED, 'no transactions found', None)
+    assert queue.depth() == 0
+
+def test_a_result_that_cannot_be_stored_fails_the_job(tmp_path):
+    queue = UploadJobQueue(str(tmp_path / 'jobs.db'), lambda filename: {'value': object()}, 1, 5)
+    job = _wait_for(queue, queue.submit('odd.pdf'), {JOB_DONE, JOB_FAILED})
+    assert job['status'] == JOB_FAILED
+    assert job['error'].startswith('The job finished but its result could not be stored')
+    assert queue.depth() == 0
+
+def test_full_queue_rejects_new_jobs(tmp_path):
+    release = threading.Event()
+    queue = UploadJobQueue(str(tmp_path / 'jobs.db'), lambda filename: release.wait(5) and {}, 1, 2)
+    first, second = queue.submit('a.pdf'), queue.submit('b.pdf')
+    with pytest.raises(QueueFullError):
+        queue.submit('c.pdf')
+    release.set()
+    _wait_for(queue, first, {JOB_DONE})
+    _wait_for(queue, second, {JOB_DONE})
+    queue.submit('c.pdf')
+
+def test_restart_fails_only_orphaned_jobs(tmp_path):
+    db_path = str(tmp_path / 'jobs.db')
+    UploadJobQueue(db_path, lambda filename: {}, 1, 5)
+    host, now = socket.gethostname(), time.time()
+    rows = [
+        ('dead-worker', JOB_RUNNING, host, _dead_pid(), 'old-boot'),
+        ('no-owner', JOB_QUEUED, None, None, None),
+        ('same-pid-earlier-start', JOB_QUEUED, host, os.getpid(), 'old-boot'),
+        ('live-worker', JOB_RUNNING, host, os.getppid(), 'other-boot'),
+        ('other-host', JOB_RUNNING, host + '-elsewhere', 1, 'other-boot'),
+        ('this-process', JOB_RUNNING, host, os.getpid(), jobs.BOOT_ID),
+        ('finished', JOB_DONE, host, _dead_pid(), 'old-boot'),
+    ]
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.executemany(
+        "INSERT INTO upload_jobs (id, filename, status, created_at, updated_at, owner_host, owner_pid, owner_boot) "
+        "VALUES (?, 'f.pdf', ?, ?, ?, ?, ?, ?)",
+        [(job_id, status, now, now, owner_host, pid, boot) for job_id, status, owner_host, pid, boot in rows]
+    )
+
+    queue = UploadJobQueue(db_path, lambda filename: {}, 1, 5)
+    statuses = {job_id: queue.get(job_id)['status'] for job_id, *_ in rows}
+    assert statuses == {
+        'dead-worker': JOB_FAILED, 'no-owner': JOB_FAILED, 'same-pid-earlier-start': JOB_FAILED,
+        'live-worker': JOB_RUNNING, 'other-host': JOB_RUNNING, 'this-process': JOB_RUNNING, 'finished': JOB_DONE,
+    }
+    assert 'restarted' in queue.get('dead-worker')['error']
+
+def test_prune_deletes_only_old_finished_jobs(tmp_path):
+    queue = UploadJobQueue(str(tmp_path / 'jobs.db'), lambda filename: {}, 1, 5, retention_seconds=60)
+    done = queue.submit('a.pdf')
+    _wait_for(queue, done, {JOB_DONE})
+    queued = 'stuck'
+    old = time.time() - 120
+    queue._connect().execute(
+        "INSERT INTO upload_jobs (id, filename, status, created_at, updated_at, owner_host, owner_pid, owner_boot) "
+        "VALUES (?, 'b.pdf', ?, ?, ?, ?, ?, ?)",
+        (queued, JOB_QUEUED, old, old, queue.host, queue.pid, queue.boot_id)
+    )
+    queue._connect().execute("UPDATE upload_jobs SET updated_at = ? WHERE id = ?", (old, done))
+    assert queue.prune() == 1
+    assert queue.get(done) is None
+    assert queue.get(queued)['status'] == JOB_QUEUED
@@ -0,0 +1,120 @@
+import copy
+import random
+import contextlib
+import io
+
+from merge_index import MergeIndex
+
+def baseline_smart_merge_data(existing_data, new_data):
+    """smart_merge_data before the merge indexes: linear scans over documents and transactions."""
+    if not existing_data:
+        return [new_data]
+
+    new_hash = new_data.get('source_file_hash')
+    for i, stmt in enumerate(existing_data):
+        if stmt.get('source_file_hash') == new_hash:
+            existing_data[i] = new_data
+            return existing_data
+
+    if new_data.get('document_type') == 'transaction_list':
+        merged = False
+        new_transactions = new_data.get('transactions', [])
+        for stmt in existing_data:
+            if stmt.get('document_type') == 'monthly_statement':
+                stmt_start = stmt.get('statement_period', {}).get('start_date')
+                stmt_end = stmt.get('statement_period', {}).get('end_date')
+                if stmt_start and stmt_end:
+                    overlapping_transactions = []
+                    for trans in new_transactions:
+                        trans_date = trans.get('transaction_date')
+                        if trans_date and stmt_start <= trans_date <= stmt_end:
+                            overlapping_transactions.append(trans)
+                    if overlapping_transactions:
+                        existing_transactions = stmt.get('transactions', [])
+                        existing_descriptions = [t.get('description', '') + str(t.get('transaction_date', ''))
+                                                 for t in existing_transactions]
+                        for new_trans in overlapping_transactions:
+                            new_desc_date = new_trans.get('description', '') + str(new_trans.get('transaction_date', ''))
+                            if new_desc_date not in existing_descriptions:
+                                existing_transactions.append(new_trans)
+                        stmt['summary']['total_debits'] = sum(t.get('debit', 0) or 0 for t in existing_transactions)
+                        stmt['summary']['total_credits'] = sum(t.get('credit', 0) or 0 for t in existing_transactions)
+                        merged = True
+                        break
+        if not merged:
+            existing_data.append(new_data)
+    else:
+        existing_data.append(new_data)
+
+    existing_data.sort(key=lambda x: x.get('statement_period', {}).get('end_date', '') or '1900-01-01')
+    return existing_data
+
+DESCRIPTIONS = ['PAIEMENT CB MARJANE', 'RETRAIT GAB', 'FACTURE IAM', 'VIREMENT RECU SALAIRE']
+
+def _transactions(rng, year, month, count):
+    transactions = []
+    for _ in range(count):
+        date = f"{year}-{month:02d}-{rng.randint(1, 28):02d}"
+        debit = rng.random() < 0.8
+        amount = float(rng.randint(1, 500))
+        transactions.append({
+            'transaction_date': date, 'value_date': date, 'description': rng.choice(DESCRIPTIONS),
+            'debit': amount if debit else None, 'credit': None if debit else amount,
+        })
+    return transactions
+
+def _random_document(rng, serial):
+    year, month = rng.choice([2019, 2020]), rng.randint(1, 12)
+    document_type = rng.choice(['monthly_statement', 'monthly_statement', 'transaction_list', 'unknown'])
+    transactions = _transactions(rng, year, month, rng.randint(0, 6))
+    if document_type == 'transaction_list' and rng.random() < 0.5:
+        # Lists often span a month boundary
+        transactions += _transactions(rng, year, month % 12 + 1, rng.randint(1, 4))
+    if rng.random() < 0.1:
+        period = {}
+    elif rng.random() < 0.1:
+        period = {'start_date': f"{year}-{month:02d}-01", 'end_date': None}
+    else:
+        period = {'start_date': f"{year}-{month:02d}-01", 'end_date': f"{year}-{month:02d}-{rng.choice([15, 28])}"}
+    document = {
+        'document_type': document_type,
+        'statement_period': period,
+        'summary': {'opening_balance': 0.0, 'closing_balance': 0.0, 'total_debits': 0.0, 'total_credits': 0.0},
+        'transactions': transactions,
+    }
+    if rng.random() < 0.9:
+        # Re-uploads reuse an earlier hash, sometimes with a different period
+        document['source_file_hash'] = f"file-{rng.randint(0, serial)}"
+    return document
+
+def _merge_batches(app, documents, batches, shared_index):
+    baseline, indexed = copy.deepcopy(documents), copy.deepcopy(documents)
+    for batch in batches:
+        index = MergeIndex(indexed) if shared_index else None
+        for document in batch:
+            baseline = baseline_smart_merge_data(baseline, copy.deepcopy(document))
+            with contextlib.redirect_stdout(io.StringIO()):
+                indexed = app.smart_merge_data(indexed, copy.deepcopy(document), [], index)
+            assert indexed == baseline
+    return indexed
+
+def test_indexed_merge_matches_the_linear_merge_on_random_histories(app_module):
+    for seed in range(60):
+        rng = random.Random(seed)
+        serial = 0
+        history = []
+        for _ in range(rng.randint(0, 25)):
+            history.append(_random_document(rng, serial))
+            serial += 1
+        if rng.random() < 0.3:
+            rng.shuffle(history)  # Stored lists are not guaranteed to be sorted
+        batches = []
+        for _ in range(rng.randint(1, 6)):
+            batch = []
+            for _ in range(rng.randint(1, 8)):
+                batch.append(_random_document(rng, serial))
+                serial += 1
+            batches.append(batch)
+
+        _merge_batches(app_module, history, batches, shared_index=True)
+        _merge_batches(app_module, history, batches, shared_index=False)
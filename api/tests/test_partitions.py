@@ -0,0 +1,83 @@
+import io
+
+import pytest
+
+def _statement(account_number='0001'):
+    transactions = [
+        {'transaction_date': '2024-01-05', 'value_date': '2024-01-05', 'description': 'PAIEMENT CB MARJANE', 'debit': 120.0, 'credit': None},
+        {'transaction_date': '2024-01-25', 'value_date': '2024-01-25', 'description': 'VIREMENT RECU SALAIRE', 'debit': None, 'credit': 9000.0},
+    ]
+    return {
+        'document_type': 'monthly_statement',
+        'account_details': {'account_number': account_number, 'currency': 'MAD'},
+        'statement_period': {'start_date': '2024-01-01', 'end_date': '2024-01-31'},
+        'summary': {'opening_balance': 1000.0, 'closing_balance': 9880.0, 'total_debits': 120.0, 'total_credits': 9000.0},
+        'transactions': transactions,
+        'source_file_hash': f"statement-{account_number}",
+    }
+
+def _transaction_list():
+    # Lists carry no account number; it repeats one statement transaction
+    transactions = [
+        {'transaction_date': '2024-01-25', 'value_date': '2024-01-25', 'description': 'VIREMENT RECU SALAIRE', 'debit': None, 'credit': 9000.0},
+        {'transaction_date': '2024-01-28', 'value_date': '2024-01-28', 'description': 'RETRAIT GAB', 'debit': 200.0, 'credit': None},
+    ]
+    return {
+        'document_type': 'transaction_list',
+        'account_details': {'account_number': None, 'currency': 'MAD'},
+        'statement_period': {'start_date': '2024-01-20', 'end_date': '2024-01-28'},
+        'summary': {'opening_balance': None, 'closing_balance': None, 'total_debits': 200.0, 'total_credits': 9000.0},
+        'transactions': transactions,
+        'source_file_hash': 'list-1',
+    }
+
+@pytest.fixture
+def upload(app_module, monkeypatch):
+    """Posts a document to /api/upload-statement as if the model had extracted it from a PDF."""
+    client = app_module.app.test_client()
+
+    def post(document, user_id):
+        monkeypatch.setattr(app_module, 'analyze_pdf_with_smart_detection', lambda *args: dict(document))
+        response = client.post(
+            '/api/upload-statement',
+            data={'file': (io.BytesIO(b'%PDF-1.4'), 'statement.pdf')},
+            headers={'X-Gemini-API-Key': 'test-key', 'X-User-ID': user_id},
+        )
+        assert response.status_code == 200
+        return response.get_json()
+    return post
+
+def test_transaction_list_without_account_merges_into_the_statement(app_module, upload):
+    client = app_module.app.test_client()
+    headers = {'X-User-ID': 'null-account-list'}
+    upload(_statement(), 'null-account-list')
+    assert upload(_transaction_list(), 'null-account-list')['account'] == '0001'
+
+    assert client.get('/api/accounts', headers=headers).get_json()['accounts'] == ['0001']
+    response = client.get('/api/get-financial-data', headers=headers)
+    assert response.status_code == 200
+    documents = response.get_json()
+    assert len(documents) == 1
+    assert [t['description'] for t in documents[0]['transactions']] == [
+        'PAIEMENT CB MARJANE', 'VIREMENT RECU SALAIRE', 'RETRAIT GAB'
+    ]
+    assert documents[0]['summary']['total_debits'] == 320.0
+
+    assert client.get('/api/get-financial-metrics', headers=headers).status_code == 200
+    assert client.get('/api/transactions', headers=headers).get_json()['count'] == 3
+
+def test_requests_without_an_account_read_every_account(app_module, upload):
+    client = app_module.app.test_client()
+    headers = {'X-User-ID': 'two-accounts'}
+    upload(_statement('0001'), 'two-accounts')
+    upload(_statement('0002'), 'two-accounts')
+
+    response = client.get('/api/get-financial-data', headers=headers)
+    assert response.status_code == 200
+    assert len(response.get_json()) == 2
+    metrics = client.get('/api/get-financial-metrics', headers=headers).get_json()
+    assert metrics['total_income_all_time'] == 18000.0
+    assert client.get('/api/transactions', headers=headers).get_json()['count'] == 4
+
+    one = client.get('/api/get-financial-data?account=0002', headers=headers).get_json()
+    assert [d['source_file_hash'] for d in one] == ['statement-0002']
@@ -0,0 +1,102 @@
+from financial_aggregates import summarize_document
+from recurring import (
+    CADENCE_MATCH_RATIO, analyze_series, detect_recurring, group_recurring, normalize_merchant
+)
+
+def _debit(date, description, amount):
+    return {'transaction_date': date, 'description': description, 'debit': amount, 'credit': None}
+
+def test_monthly_projection_is_clamped_to_the_end_of_the_month():
+    result = analyze_series([['2024-03-31', 110.0], ['2024-01-31', 100.0], ['2024-02-29', 105.0]])
+    assert result['cadence'] == 'monthly'
+    assert result['interval_days'] == 31
+    assert result['last_date'] == '2024-03-31'
+    assert result['next_expected_date'] == '2024-04-30'
+    assert result['amount_drift'] == 10.0
+    assert result['amount_drift_percentage'] == 10.0
+
+def test_weekly_and_annual_projections():
+    weekly = analyze_series([['2024-01-01', 20], ['2024-01-08', 20], ['2024-01-15', 20]])
+    assert (weekly['cadence'], weekly['next_expected_date']) == ('weekly', '2024-01-22')
+    annual = analyze_series([['2021-02-28', 50], ['2022-02-28', 50], ['2023-02-28', 50]])
+    assert (annual['cadence'], annual['next_expected_date']) == ('annual', '2024-02-28')
+
+def test_cadence_follows_the_median_gap():
+    # Gaps 7, 30, 30, 31: the median is monthly even though the first gap is weekly
+    occurrences = [['2024-01-01', 9], ['2024-01-08', 9], ['2024-02-07', 9], ['2024-03-08', 9], ['2024-04-08', 9]]
+    result = analyze_series(occurrences)
+    assert result['interval_days'] == 30
+    assert result['cadence'] == 'monthly'
+
+def test_cadence_needs_the_match_ratio():
+    # Gaps 30, 30, 30, 100, 100: 3 of 5 in the monthly window (exactly the ratio)
+    dates = ['2024-01-01', '2024-01-31', '2024-03-01', '2024-03-31', '2024-07-09', '2024-10-17']
+    assert 3 / 5 >= CADENCE_MATCH_RATIO
+    assert analyze_series([[d, 10] for d in dates])['cadence'] == 'monthly'
+
+    # Gaps 30, 30, 100, 100: the median is still 30 but only half the gaps match
+    dates = ['2024-01-01', '2024-01-31', '2024-03-01', '2024-06-09', '2024-09-17']
+    assert 2 / 4 < CADENCE_MATCH_RATIO
+    result = analyze_series([[d, 10] for d in dates])
+    assert result['cadence'] == 'irregular'
+    assert result['next_expected_date'] is None
+
+def test_same_day_charges_count_as_one_billing_event():
+    occurrences = [['2024-01-05', 10], ['2024-01-05', 15], ['2024-02-05', 10], ['2024-03-05', 10]]
+    result = analyze_series(occurrences)
+    assert result['interval_days'] == 31
+    assert result['cadence'] == 'monthly'
+
+def test_undated_and_single_occurrences():
+    assert analyze_series([[None, 10], ['not a date', 10]])['last_date'] is None
+    single = analyze_series([['2024-01-05', 10]])
+    assert (single['cadence'], single['interval_days'], single['next_expected_date']) == ('irregular', None, None)
+
+def test_detect_recurring_keeps_merchants_above_the_minimum():
+    transactions = [
+        _debit('2024-01-10', 'PRLV NETFLIX 10/01', 99.0),
+        _debit('2024-02-10', 'PRLV NETFLIX 10/02', 99.0),
+        _debit('2024-03-10', 'PRLV NETFLIX 10/03', 109.0),
+        _debit('2024-01-12', 'PAIEMENT CB ACIMA', 50.0),
+        _debit('2024-02-12', 'PAIEMENT CB ACIMA', 50.0),
+        {'transaction_date': '2024-03-12', 'description': 'PAIEMENT CB ACIMA', 'debit': None, 'credit': 50.0},
+        _debit('2024-01-01', 'IAM', 10.0),
+    ]
+    groups = group_recurring(transactions)
+    assert set(groups) == {'PRLV NETFLIX', 'PAIEMENT CB ACIMA'}
+    assert groups['PAIEMENT CB ACIMA']['count'] == 2
+
+    recurring = detect_recurring(groups)
+    assert list(recurring) == ['PRLV NETFLIX']
+    netflix = recurring['PRLV NETFLIX']
+    assert netflix['count'] == 3
+    assert netflix['avg_amount'] == 307.0 / 3
+    assert netflix['dates'] == ['2024-01-10', '2024-02-10', '2024-03-10']
+    assert (netflix['cadence'], netflix['next_expected_date']) == ('monthly', '2024-04-10')
+    assert detect_recurring(groups, min_occurrences=2).keys() == {'PRLV NETFLIX', 'PAIEMENT CB ACIMA'}
+
+def test_normalize_merchant_strips_dates_and_times():
+    assert normalize_merchant('  Retrait gab 12/03/2024 14H25  agence ') == 'RETRAIT GAB AGENCE'
+
+def test_document_summaries_group_merchants_through_group_recurring():
+    # Regression test for bf9a410: summaries build merchant groups with
+    # group_recurring, in date order, each marked with its first debit.
+    transactions = [
+        _debit('2024-03-10', 'PRLV NETFLIX 10/03', 109.0),
+        _debit('2024-01-10', 'PRLV NETFLIX 10/01', 99.0),
+        {'transaction_date': '2024-01-11', 'description': 'VIREMENT RECU', 'debit': None, 'credit': 500.0},
+        _debit(None, 'PRLV NETFLIX', 99.0),
+        _debit('2024-02-10', 'PRLV NETFLIX 10/02', 99.0),
+    ]
+    summary = summarize_document({'source_file_hash': 'doc', 'transactions': transactions})
+
+    # Undated debits sort first (as 1900-01-01)
+    order = [3, 1, 4, 0]
+    expected = group_recurring([transactions[i] for i in order], [[transactions[i]['transaction_date'] or '1900-01-01', i] for i in order])
+    assert summary['recurring'] == expected
+
+    netflix = summary['recurring']['PRLV NETFLIX']
+    assert netflix['first'] == ['1900-01-01', 3]
+    assert netflix['count'] == 4
+    assert netflix['total_amount'] == 406.0
+    assert [date for date, _ in netflix['occurrences']] == ['2024-01-10', '2024-02-10', '2024-03-10']
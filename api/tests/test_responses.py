@@ -0,0 +1,49 @@
+import gzip
+import json
+
+def _statement(serial, transactions=60):
+    rows = [
+        {'transaction_date': f"2024-{serial:02d}-{day % 28 + 1:02d}", 'value_date': None,
+         'description': f"PAIEMENT CB MARJANE {day}", 'debit': float(day + 1), 'credit': None}
+        for day in range(transactions)
+    ]
+    return {
+        'document_type': 'monthly_statement',
+        'account_details': {'account_number': '0001'},
+        'statement_period': {'start_date': f"2024-{serial:02d}-01", 'end_date': f"2024-{serial:02d}-28"},
+        'summary': {'opening_balance': 0.0, 'closing_balance': 0.0, 'total_debits': 0.0, 'total_credits': 0.0},
+        'transactions': rows,
+        'source_file_hash': f"statement-{serial}",
+    }
+
+def test_each_encoding_has_its_own_etag_and_revalidates(app_module):
+    client = app_module.app.test_client()
+    app_module.merge_and_persist([_statement(1)], 'etags')
+    gzip_headers = {'X-User-ID': 'etags', 'Accept-Encoding': 'gzip'}
+    identity_headers = {'X-User-ID': 'etags', 'Accept-Encoding': 'identity'}
+
+    compressed = client.get('/api/get-financial-data', headers=gzip_headers)
+    plain = client.get('/api/get-financial-data', headers=identity_headers)
+    assert compressed.status_code == plain.status_code == 200
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Encoding' not in plain.headers
+    assert gzip.decompress(compressed.data) == plain.data
+    assert compressed.headers['ETag'] != plain.headers['ETag']
+    for response in (compressed, plain):
+        assert 'Accept-Encoding' in response.headers['Vary']
+
+    # A repeated ETag is not modified, for the representation it names only
+    repeated = client.get('/api/get-financial-data', headers=dict(gzip_headers, **{'If-None-Match': compressed.headers['ETag']}))
+    assert repeated.status_code == 304
+    assert repeated.headers['ETag'] == compressed.headers['ETag']
+    assert 'Accept-Encoding' in repeated.headers['Vary']
+    assert client.get('/api/get-financial-data', headers=dict(identity_headers, **{'If-None-Match': plain.headers['ETag']})).status_code == 304
+    assert client.get('/api/get-financial-data', headers=dict(identity_headers, **{'If-None-Match': compressed.headers['ETag']})).status_code == 200
+
+    # New data, new ETag
+    app_module.merge_and_persist([_statement(2)], 'etags')
+    changed = client.get('/api/get-financial-data', headers=dict(gzip_headers, **{'If-None-Match': compressed.headers['ETag']}))
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != compressed.headers['ETag']
+    assert changed.headers['Content-Encoding'] == 'gzip'
+    assert len(json.loads(gzip.decompress(changed.data))) == 2
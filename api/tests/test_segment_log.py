@@ -0,0 +1,53 @@
+from financial_aggregates import document_key
+from segment_log import SegmentLogStorage
+
+def _statement(index):
+    month = index % 12 + 1
+    year = 2020 + index // 12
+    return {
+        'source_file_hash': f'statement-{index}',
+        'document_type': 'monthly_statement',
+        'statement_period': {'start_date': f'{year}-{month:02d}-01', 'end_date': f'{year}-{month:02d}-28'},
+        'summary': {'opening_balance': 1000.0, 'closing_balance': 900.0},
+        'transactions': [{
+            'transaction_date': f'{year}-{month:02d}-10', 'value_date': f'{year}-{month:02d}-10',
+            'description': f'PAIEMENT CB MARJANE {index}', 'debit': 100.0, 'credit': None,
+        }],
+    }
+
+def _insert(storage, document):
+    with storage.lock():
+        documents = storage.load_documents() + [document]
+        documents.sort(key=lambda d: d['statement_period']['end_date'])
+        storage.save_changes(documents, [('insert', document)])
+
+def test_two_writers_rolling_segments_keep_every_record(tmp_path):
+    log_dir = str(tmp_path / 'log')
+    # Every record fills a segment, so each save has to roll to a new one
+    writers = [SegmentLogStorage(log_dir, segment_max_bytes=1) for _ in range(2)]
+
+    statements = [_statement(i) for i in range(12)]
+    for i, statement in enumerate(statements):
+        _insert(writers[i % 2], statement)
+
+    expected = [document_key(s) for s in statements]
+    assert len(writers[0]._segment_ids()) == len(statements)
+    for storage in writers + [SegmentLogStorage(log_dir, segment_max_bytes=1)]:
+        assert [document_key(d) for d in storage.load_documents()] == expected
+        assert storage.get_data_version() == len(statements)
+
+def test_compaction_by_one_writer_is_seen_by_the_other(tmp_path):
+    log_dir = str(tmp_path / 'log')
+    first = SegmentLogStorage(log_dir, segment_max_bytes=1)
+    second = SegmentLogStorage(log_dir, segment_max_bytes=1)
+
+    statements = [_statement(i) for i in range(6)]
+    for i, statement in enumerate(statements[:3]):
+        _insert([first, second][i % 2], statement)
+    first.compact()
+    for i, statement in enumerate(statements[3:]):
+        _insert([second, first][i % 2], statement)
+
+    expected = [document_key(s) for s in statements]
+    for storage in (first, second, SegmentLogStorage(log_dir)):
+        assert [document_key(d) for d in storage.load_documents()] == expected
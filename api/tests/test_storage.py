@@ -0,0 +1,125 @@
+import copy
+import random
+import contextlib
+import io
+
+import pytest
+
+from financial_aggregates import build_aggregates, document_key
+from merge_index import MergeIndex, statement_sort_key
+from partitions import Partition
+from segment_log import SegmentLogStorage
+
+DESCRIPTIONS = ['PAIEMENT CB MARJANE', 'RETRAIT GAB', 'FACTURE IAM', 'VIREMENT RECU SALAIRE']
+
+def _transactions(rng, year, month, count):
+    transactions = []
+    for _ in range(count):
+        date = f"{year}-{month:02d}-{rng.randint(1, 28):02d}"
+        debit = rng.random() < 0.8
+        amount = float(rng.randint(1, 500))
+        transactions.append({
+            'transaction_date': date, 'value_date': date, 'description': rng.choice(DESCRIPTIONS),
+            'debit': amount if debit else None, 'credit': None if debit else amount,
+        })
+    return transactions
+
+def _upload(rng, serial):
+    """An extracted document as uploads produce it: always with a source file hash."""
+    year, month = 2020, rng.randint(1, 12)
+    document_type = rng.choice(['monthly_statement', 'monthly_statement', 'transaction_list'])
+    transactions = _transactions(rng, year, month, rng.randint(0, 6))
+    if document_type == 'transaction_list' and rng.random() < 0.5:
+        transactions += _transactions(rng, year, month % 12 + 1, rng.randint(1, 4))
+    end_day = rng.choice([15, 28])
+    return {
+        'document_type': document_type,
+        'statement_period': {'start_date': f"{year}-{month:02d}-01", 'end_date': f"{year}-{month:02d}-{end_day}"},
+        'summary': {'opening_balance': 0.0, 'closing_balance': 0.0, 'total_debits': 0.0, 'total_credits': 0.0},
+        'transactions': transactions,
+        # Re-uploads reuse an earlier hash, sometimes with a different period
+        'source_file_hash': f"file-{rng.randint(0, serial)}",
+    }
+
+def _reference_merge(app, history, batch):
+    """The merge over the whole history, which storage keeps in end-date order between uploads."""
+    index = MergeIndex(history)
+    with contextlib.redirect_stdout(io.StringIO()):
+        for document in batch:
+            history = app.smart_merge_data(history, copy.deepcopy(document), [], index)
+    history.sort(key=statement_sort_key)
+    return history
+
+def _by_hash(documents):
+    return {d['source_file_hash']: d for d in documents}
+
+@pytest.mark.parametrize('backend', ['sqlite', 'json', 'log'])
+def test_merging_candidates_only_matches_merging_the_whole_history(app_module, tmp_path, backend):
+    for seed in range(30):
+        rng = random.Random(seed)
+        partition = Partition('user', 'account', str(tmp_path / f"{backend}-{seed}"), backend, app_module._merge_and_save)
+        history = []
+        serial = 0
+        for _ in range(rng.randint(1, 12)):
+            batch = []
+            for _ in range(rng.randint(1, 4)):
+                batch.append(_upload(rng, serial))
+                serial += 1
+            history = _reference_merge(app_module, history, batch)
+            with contextlib.redirect_stdout(io.StringIO()):
+                partition.merge_writer.submit(copy.deepcopy(batch))
+
+            # Documents with equal end dates may be stored in another order
+            stored = partition.storage.load_documents()
+            assert [statement_sort_key(d) for d in stored] == [statement_sort_key(d) for d in history]
+            assert _by_hash(stored) == _by_hash(history)
+            aggregates = partition.storage.load_aggregates()
+            assert aggregates['order'] == [document_key(d) for d in stored]
+            assert aggregates['documents'] == build_aggregates(history)['documents']
+
+def test_log_replay_matches_the_state_after_live_saves(app_module, tmp_path):
+    for seed in range(10):
+        rng = random.Random(seed)
+        directory = tmp_path / f"log-{seed}"
+        partition = Partition('user', 'account', str(directory), 'log', app_module._merge_and_save)
+        serial = 0
+        for _ in range(rng.randint(1, 12)):
+            batch = []
+            for _ in range(rng.randint(1, 4)):
+                batch.append(_upload(rng, serial))
+                serial += 1
+            with contextlib.redirect_stdout(io.StringIO()):
+                partition.merge_writer.submit(batch)
+
+        live = partition.storage
+        replayed = SegmentLogStorage(str(directory / 'statement_log'))
+        assert replayed.load_documents() == live.load_documents()
+        assert replayed.load_aggregates() == live.load_aggregates()
+        with contextlib.redirect_stdout(io.StringIO()):
+            live.compact()
+        assert SegmentLogStorage(str(directory / 'statement_log')).load_documents() == live.load_documents()
+
+@pytest.mark.parametrize('backend', ['sqlite', 'log'])
+def test_merge_loads_only_overlapping_documents(app_module, tmp_path, backend):
+    partition = Partition('user', 'account', str(tmp_path / backend), backend, app_module._merge_and_save)
+    statements = []
+    for month in range(1, 13):
+        statements.append({
+            'document_type': 'monthly_statement',
+            'statement_period': {'start_date': f"2020-{month:02d}-01", 'end_date': f"2020-{month:02d}-28"},
+            'summary': {'total_debits': 0.0, 'total_credits': 0.0},
+            'transactions': _transactions(random.Random(month), 2020, month, 3),
+            'source_file_hash': f"statement-{month}",
+        })
+    with contextlib.redirect_stdout(io.StringIO()):
+        partition.merge_writer.submit(statements)
+
+    transaction_list = {
+        'document_type': 'transaction_list',
+        'statement_period': {'start_date': '2020-05-20', 'end_date': '2020-06-05'},
+        'transactions': _transactions(random.Random(0), 2020, 5, 2) + _transactions(random.Random(1), 2020, 6, 2),
+        'source_file_hash': 'list-1',
+    }
+    candidates = partition.storage.load_merge_candidates([transaction_list])
+    assert [d['source_file_hash'] for d in candidates] == ['statement-5', 'statement-6']
+    assert partition.storage.load_merge_candidates([dict(statements[2], transactions=[])])[0]['transactions'] == statements[2]['transactions']
@@ -0,0 +1,63 @@
+import random
+
+from transaction_index import TransactionIndex
+
+DESCRIPTIONS = ['PAIEMENT CB MARJANE', 'RETRAIT GAB', 'FACTURE IAM', 'VIREMENT RECU SALAIRE', 'FRAIS TENUE DE COMPTE']
+
+def _documents(rng):
+    documents = []
+    for serial in range(rng.randint(1, 6)):
+        transactions = []
+        for _ in range(rng.randint(0, 40)):
+            debit = rng.random() < 0.7
+            amount = float(rng.randint(1, 1000))
+            transactions.append({
+                'transaction_date': f"2024-{rng.randint(1, 3):02d}-{rng.randint(1, 28):02d}" if rng.random() < 0.95 else None,
+                'description': rng.choice(DESCRIPTIONS),
+                'debit': amount if debit else None,
+                'credit': None if debit else amount,
+            })
+        documents.append({'document_type': 'monthly_statement', 'source_file_hash': f"doc-{serial}", 'transactions': transactions})
+    return documents
+
+def _pages(index, limit, **filters):
+    items, cursor = index.query(limit=limit, **filters)
+    while cursor:
+        page, cursor = index.query(limit=limit, cursor=cursor, **filters)
+        assert len(page) <= limit
+        items.extend(page)
+    return items
+
+def _expected(index, start_date, end_date, kind, category, descending):
+    positions = [
+        position for position, date in enumerate(index.dates)
+        if (not start_date or date >= start_date) and (not end_date or date <= end_date)
+        and (not kind or index.transactions[position].get(kind))
+        and (not category or index.categories[position] == category)
+    ]
+    return [index.transactions[position] for position in (reversed(positions) if descending else positions)]
+
+def test_cursor_pages_match_a_full_filter():
+    for seed in range(40):
+        rng = random.Random(seed)
+        index = TransactionIndex(_documents(rng))
+        for _ in range(10):
+            filters = {
+                'start_date': rng.choice([None, '2024-01-15', '2024-02-01']),
+                'end_date': rng.choice([None, '2024-02-15', '2024-03-31']),
+                'kind': rng.choice([None, 'debit', 'credit']),
+                'category': rng.choice([None, 'CASH_WITHDRAWALS', 'CARD_PAYMENTS']),
+                'descending': rng.random() < 0.5,
+            }
+            items = _pages(index, rng.randint(1, 7), **filters)
+            # Items are the transactions plus category, document_type and source_file_hash
+            transactions = [{key: item[key] for key in ('transaction_date', 'description', 'debit', 'credit')}
+                            for item in items]
+            assert transactions == _expected(index, **filters)
+
+def test_transactions_endpoint_rejects_malformed_dates(app_module):
+    client = app_module.app.test_client()
+    assert client.get('/api/transactions?from=2024-13-01').status_code == 400
+    assert client.get('/api/transactions?to=yesterday').status_code == 400
+    assert client.get('/api/transactions?from=2024-02-01&to=2024-01-01').status_code == 400
+    assert client.get('/api/transactions?from=2024-01-01&to=2024-02-01').status_code == 200
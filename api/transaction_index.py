@@ -0,0 +1,182 @@
+import json
+import base64
+from array import array
+from bisect import bisect_left, bisect_right
+
+from financial_aggregates import categorize_expense, document_key
+
+# --- Transaction Query Index ---
+# All stored transactions flattened into one list sorted by
+# (transaction_date, document key, position in document), plus posting lists
+# of positions per category and per debit/credit. A page of results costs two
+# binary searches on the date range plus a walk over at most the page size of
+# index-matching entries (amount and description filters are checked inline).
+# Cumulative sums of credits and debits (overall and per category, aligned with
+# the posting lists) answer totals for any date range with binary searches.
+
+MAX_PAGE_SIZE = 500
+
+def encode_cursor(sort_key):
+    """Encodes a sort key as an opaque, URL-safe pagination cursor."""
+    raw = json.dumps(list(sort_key), ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """Decodes a cursor produced by encode_cursor. Raises ValueError if malformed."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        date_key, doc_key, seq = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return (str(date_key), str(doc_key), int(seq))
+    except Exception:
+        raise ValueError("Invalid cursor.")
+
+class TransactionIndex:
+    """Sorted, category- and type-indexed view over every stored transaction."""
+
+    def __init__(self, documents):
+        entries = []
+        for document in documents or []:
+            doc_key = document_key(document)
+            for seq, transaction in enumerate(document.get('transactions') or []):
+                date_key = transaction.get('transaction_date') or '1900-01-01'
+                if not isinstance(date_key, str):
+                    date_key = str(date_key)
+                entries.append(((date_key, doc_key, seq), transaction, document))
+        entries.sort(key=lambda entry: entry[0])
+
+        self.keys = [entry[0] for entry in entries]
+        self.dates = [key[0] for key in self.keys]
+        self.transactions = [entry[1] for entry in entries]
+        self.documents = [entry[2] for entry in entries]
+        self.categories = []
+        self.by_category = {}
+        self.by_kind = {'debit': [], 'credit': []}
+        # Entry i holds the sum over positions before i (cumulative_* have len + 1 entries)
+        self.cumulative_income = array('d', [0.0])
+        self.cumulative_expenses = array('d', [0.0])
+        self.category_cumulative = {}
+
+        income = expenses = 0.0
+        for position, transaction in enumerate(self.transactions):
+            category = None
+            debit = transaction.get('debit') or 0
+            credit = transaction.get('credit') or 0
+            if transaction.get('debit'):
+                category = categorize_expense(transaction.get('description', ''))
+                self.by_category.setdefault(category, []).append(position)
+                cumulative = self.category_cumulative.setdefault(category, array('d', [0.0]))
+                cumulative.append(cumulative[-1] + debit)
+                self.by_kind['debit'].append(position)
+            if transaction.get('credit'):
+                self.by_kind['credit'].append(position)
+            self.categories.append(category)
+            income += credit
+            expenses += debit
+            self.cumulative_income.append(income)
+            self.cumulative_expenses.append(expenses)
+
+    def __len__(self):
+        return len(self.transactions)
+
+    def range_totals(self, start_date=None, end_date=None):
+        """
+        Income, expenses, net flow, counts and per-category debit totals for
+        transactions dated within [start_date, end_date] (inclusive).
+        """
+        lo = bisect_left(self.dates, start_date) if start_date else 0
+        hi = bisect_right(self.dates, end_date) if end_date else len(self.dates)
+        hi = max(lo, hi)
+
+        def count_between(postings):
+            return bisect_left(postings, hi) - bisect_left(postings, lo)
+
+        categories = {}
+        for category, postings in self.by_category.items():
+            start, stop = bisect_left(postings, lo), bisect_left(postings, hi)
+            if stop > start:
+                cumulative = self.category_cumulative[category]
+                categories[category] = {'total': round(cumulative[stop] - cumulative[start], 2), 'count': stop - start}
+
+        income = round(self.cumulative_income[hi] - self.cumulative_income[lo], 2)
+        expenses = round(self.cumulative_expenses[hi] - self.cumulative_expenses[lo], 2)
+        return {
+            'from': start_date,
+            'to': end_date,
+            'income': income,
+            'expenses': expenses,
+            'net_flow': round(income - expenses, 2),
+            'transaction_count': hi - lo,
+            'income_count': count_between(self.by_kind['credit']),
+            'expense_count': count_between(self.by_kind['debit']),
+            'first_date': self.dates[lo] if hi > lo else None,
+            'last_date': self.dates[hi - 1] if hi > lo else None,
+            'expense_categories': dict(sorted(categories.items(), key=lambda item: -item[1]['total'])),
+        }
+
+    def query(self, start_date=None, end_date=None, kind=None, category=None, min_amount=None,
+              max_amount=None, text=None, cursor=None, limit=50, descending=True):
+        """
+        Returns (items, next_cursor) for one page of matching transactions.
+        next_cursor is None when there are no further matches.
+        """
+        lo = bisect_left(self.dates, start_date) if start_date else 0
+        hi = bisect_right(self.dates, end_date) if end_date else len(self.dates)
+
+        if cursor:
+            cursor_key = decode_cursor(cursor)
+            if descending:
+                hi = min(hi, bisect_left(self.keys, cursor_key))
+            else:
+                lo = max(lo, bisect_right(self.keys, cursor_key))
+
+        # Walk the most selective posting list available
+        postings = []
+        if category:
+            postings.append(self.by_category.get(category, []))
+        if kind:
+            postings.append(self.by_kind.get(kind, []))
+        if postings:
+            base = min(postings, key=len)
+            start, stop = bisect_left(base, lo), bisect_left(base, hi)
+        else:
+            base = None
+            start, stop = lo, max(lo, hi)
+        # Positions are read lazily, so a page costs its own length, not the range's
+        steps = reversed(range(start, stop)) if descending else range(start, stop)
+        candidates = steps if base is None else (base[step] for step in steps)
+
+        text = text.upper() if text else None
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        matches = []
+        for position in candidates:
+            transaction = self.transactions[position]
+            if category and self.categories[position] != category:
+                continue
+            if kind and not transaction.get(kind):
+                continue
+            if min_amount is not None or max_amount is not None:
+                amount = transaction.get('debit') or transaction.get('credit') or 0
+                if min_amount is not None and amount < min_amount:
+                    continue
+                if max_amount is not None and amount > max_amount:
+                    continue
+            if text and text not in (transaction.get('description') or '').upper():
+                continue
+            matches.append(position)
+            if len(matches) > limit:
+                break
+
+        next_cursor = None
+        if len(matches) > limit:
+            matches = matches[:limit]
+            next_cursor = encode_cursor(self.keys[matches[-1]])
+
+        items = []
+        for position in matches:
+            document = self.documents[position]
+            item = dict(self.transactions[position])
+            item['category'] = self.categories[position]
+            item['document_type'] = document.get('document_type')
+            item['source_file_hash'] = document.get('source_file_hash')
+            items.append(item)
+        return items, next_cursor